@@ -17,7 +17,7 @@
 # admin.site.register(PasswordReset)
 
 from django.contrib import admin
-from .models import User, EmailActivation, PasswordReset, Category, Tag, Projects, ProjectImages, Donation, Comment, Report, Rating,ExtraInfo
+from .models import User, EmailActivation, PasswordReset, Category, Tag, Projects, ProjectImages, Donation, Comment, Report, Rating,ExtraInfo,HomeFeedSection,SimilarProject,OutboxEmail,HourlyDonationRollup,DailyDonationRollup
 
 # Register User model
 @admin.register(User)
@@ -65,7 +65,8 @@ class ProjectsAdmin(admin.ModelAdmin):
 # Register ProjectImages model
 @admin.register(ProjectImages)
 class ProjectImagesAdmin(admin.ModelAdmin):
-    list_display = ('project', 'image')
+    list_display = ('project', 'image', 'status', 'uploaded_at')
+    list_filter = ('status',)
     search_fields = ('project__title',)
 
 # Register Donation model
@@ -74,6 +75,9 @@ class DonationAdmin(admin.ModelAdmin):
     list_display = ('user', 'project', 'amount', 'created_at')
     list_filter = ('created_at',)
     search_fields = ('user__email', 'project__title')
+    list_select_related = ('user', 'project')
+    ## no COUNT(*) over the whole table on every page, bulk exports go through /api/donations/export/
+    show_full_result_count = False
 
 # Register Comment model
 @admin.register(Comment)
@@ -102,3 +106,28 @@ class RatingAdmin(admin.ModelAdmin):
 class ExtraInfoAdmin(admin.ModelAdmin):
     list_display = ('user', 'address', 'birth_date')
     search_fields = ('user__email', 'address')
+
+
+@admin.register(HomeFeedSection)
+class HomeFeedSectionAdmin(admin.ModelAdmin):
+    list_display = ('name', 'project_ids', 'updated_at', 'pending', 'dirty_since')
+
+
+@admin.register(SimilarProject)
+class SimilarProjectAdmin(admin.ModelAdmin):
+    list_display = ('project', 'similar', 'score')
+    search_fields = ('project__title',)
+
+
+@admin.register(HourlyDonationRollup, DailyDonationRollup)
+class DonationRollupAdmin(admin.ModelAdmin):
+    list_display = ('project', 'bucket', 'amount', 'count', 'donors')
+    list_select_related = ('project',)
+    search_fields = ('project__title',)
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('subject',)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CrowdFundingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crowd_funding'
+
+    def ready(self):
+        from . import routers, signals, sqlite  # noqa: F401
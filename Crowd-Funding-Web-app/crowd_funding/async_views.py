@@ -0,0 +1,134 @@
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import NotFound
+from . import conditional, fastpath, home_feed, similarity, views
+from .metrics import query_budget
+from .models import Projects, Comment
+from .pagination import CommentCursorPagination
+from .renderers import ORJSONRenderer
+
+## Async variants of the public read endpoints, served instead of the DRF views when
+## settings.ASYNC_READ_PATH is on (project runs under ASGI, see urls.py).
+## Same JSON as the sync views (rows come from fastpath / the stored home feed), the same
+## ETag / 304 handling and the same DRF authentication / permission / throttle checks.
+## The async ORM runs every query of a request on one thread, one after the other, so the
+## gain is the worker being free while the database answers, not parallel SQL.
+
+
+def json_response(data, status=200):
+    return HttpResponse(ORJSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def not_found():
+    return json_response({'detail': 'No Projects matches the given query.'}, status=404)
+
+
+## the DRF checks of the sync view (authentication, permissions, throttles) on the ORM thread:
+## (DRF request, None), or (None, the sync view's own 401 / 403 / 429 response)
+def drf_initial(request, view_class, **kwargs):
+    view = view_class()
+    view.args, view.kwargs = (), kwargs
+    view.headers = view.default_response_headers
+    request = view.initialize_request(request, **kwargs)
+    view.request = request
+    try:
+        view.initial(request, **kwargs)
+    except Exception as exc:
+        response = view.finalize_response(request, view.handle_exception(exc), **kwargs)
+        return None, response.render()
+    return request, None
+
+
+async def project_validators(pk):
+    return await Projects.objects.filter(pk=pk).values_list('version', 'modified_at').afirst()
+
+
+@query_budget(4)
+@require_GET
+async def home_projects(request):
+    request, error = await sync_to_async(drf_initial)(request, views.home_projects.cls)
+    if error is not None:
+        return error
+    updated_at, sections = await home_feed.afeed_validators()
+    etag = conditional.make_etag(request, 'home', updated_at and updated_at.isoformat(), sections)
+    response = conditional.check(request, etag, updated_at)
+    if response is not None:
+        return conditional.set_validators(response, etag, updated_at)
+
+    feed = home_feed.present(await home_feed.aget_home_feed(), request)
+    return conditional.set_validators(json_response(feed), etag, updated_at)
+
+
+## one more than the reads for the token lookup of drf_initial when its cache is cold
+@query_budget(5)
+@require_GET
+async def project_detail(request, pk):
+    request, error = await sync_to_async(drf_initial)(request, views.ProjectDetailView, pk=pk)
+    if error is not None:
+        return error
+    validators = await project_validators(pk)
+    if validators is None:
+        return not_found()
+    version, modified_at = validators
+    etag = conditional.make_etag(request, 'project', pk, version)
+    response = conditional.check(request, etag, modified_at)
+    if response is None:
+        rows = await fastpath.aproject_rows([pk], request)
+        response = json_response(rows[0]) if rows else not_found()
+    return conditional.set_validators(response, etag, modified_at)
+
+
+@query_budget(6)
+@require_GET
+async def similar_projects(request, pk):
+    request, error = await sync_to_async(drf_initial)(request, views.SimilarProjectsView, pk=pk)
+    if error is not None:
+        return error
+    if not await Projects.objects.filter(pk=pk).aexists():
+        return HttpResponse(status=404)
+    similar_ids = await fastpath.alist(similarity.similar_projects(pk).values_list('pk', flat=True))
+    return json_response(await fastpath.aproject_rows(similar_ids, request))
+
+
+@query_budget(4)
+@require_GET
+async def comment_list(request):
+    request, error = await sync_to_async(drf_initial)(request, views.CommentListView)
+    if error is not None:
+        return error
+    try:
+        project_id = int(request.query_params.get('project', ''))
+    except ValueError:
+        project_id = None
+    validators = await project_validators(project_id) if project_id is not None else None
+    if validators is None:
+        ## no such project, same empty page as the DRF view
+        return json_response({'next': None, 'previous': None, 'results': []})
+    version, modified_at = validators
+    etag = conditional.make_etag(request, 'comments', project_id, version)
+    response = conditional.check(request, etag, modified_at)
+    if response is not None:
+        return conditional.set_validators(response, etag, modified_at)
+
+    paginator = CommentCursorPagination()
+    queryset = fastpath.comment_values(Comment.objects.filter(project_id=project_id, parent=None))
+    try:
+        page = await sync_to_async(paginator.paginate_queryset)(queryset, request)
+    except NotFound as error:
+        return json_response({'detail': error.detail}, status=404)
+    results = await fastpath.acomment_rows(page, depth(request), request)
+    response = json_response({
+        'next': paginator.get_next_link(),
+        'previous': paginator.get_previous_link(),
+        'results': results,
+    })
+    return conditional.set_validators(response, etag, modified_at)
+
+
+def depth(request):
+    try:
+        value = int(request.query_params.get('depth', views.CommentListView.DEFAULT_DEPTH))
+    except ValueError:
+        value = views.CommentListView.DEFAULT_DEPTH
+    return max(0, min(value, views.CommentListView.MAX_DEPTH))
@@ -1,4 +1,15 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
 from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.functional import SimpleLazyObject
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
 from .models import User
 
 ##Authentication backend Email
@@ -14,4 +25,109 @@ class EmailBackend(ModelBackend):
 
         if user.check_password(password):
             return user
-        return None
\ No newline at end of file
+        return None
+
+
+## Token authentication cache
+## TOKEN_AUTH_CACHE = {'LOCAL_TTL': .., 'LOCAL_SIZE': .., 'SHARED_TTL': ..} in settings
+## - in process LRU: no network hop at all, kept short because other processes can't clear it
+## - shared cache (CACHES['default']): TTL bounded, cleared as soon as a token / user changes;
+##   with a per process backend (LocMem, the default) it can't be cleared from the process
+##   that made the change either, so it lives no longer than the LRU
+## Only (user id, is_active, key) is cached, the user row is loaded when the view uses it.
+def _auth_cache_setting(name, default):
+    return getattr(settings, 'TOKEN_AUTH_CACHE', {}).get(name, default)
+
+
+def shared_cache_ttl():
+    local_ttl = _auth_cache_setting('LOCAL_TTL', 5)
+    shared_ttl = _auth_cache_setting('SHARED_TTL', 300)
+    if shared_ttl > local_ttl and isinstance(caches['default'], (LocMemCache, DummyCache)):
+        return local_ttl
+    return shared_ttl
+
+
+class LocalLRUCache:
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + ttl)
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+_local_tokens = LocalLRUCache(_auth_cache_setting('LOCAL_SIZE', 10000))
+
+
+## raw tokens never end up in cache keys
+def token_cache_key(key):
+    return 'auth_token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def invalidate_token(key):
+    cache_key = token_cache_key(key)
+    _local_tokens.delete(cache_key)
+    cache.delete(cache_key)
+
+
+## request.user of a cached token: the user row is only read when something other than
+## its id / is_authenticated is used (throttles, routing and most permissions don't)
+class LazyUser(SimpleLazyObject):
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id):
+        super().__init__(lambda: User.objects.get(pk=user_id))
+        self.__dict__['pk'] = self.__dict__['id'] = user_id
+
+    def __bool__(self):
+        return True
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        entry = _local_tokens.get(cache_key)
+        if entry is None:
+            entry = cache.get(cache_key)
+            if entry is None:
+                model = self.get_model()
+                try:
+                    entry = model.objects.filter(key=key).values_list('user_id', 'user__is_active', 'key').get()
+                except model.DoesNotExist:
+                    raise exceptions.AuthenticationFailed('Invalid token.')
+                cache.set(cache_key, entry, shared_cache_ttl())
+            _local_tokens.set(cache_key, entry, _auth_cache_setting('LOCAL_TTL', 5))
+
+        user_id, is_active, key = entry
+        if not is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        user = LazyUser(user_id)
+        token = self.get_model()(key=key, user_id=user_id)
+        token._meta.get_field('user').set_cached_value(token, user)
+        return (user, token)
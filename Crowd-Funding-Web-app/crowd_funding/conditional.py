@@ -0,0 +1,33 @@
+import hashlib
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+## Conditional GET for reads whose data has a cheap version (Projects.version / modified_at,
+## HomeFeedSection.updated_at): the views check If-None-Match / If-Modified-Since against it
+## before loading and serializing anything and answer 304 when the client is up to date.
+
+
+## strong validator of one representation: the data version plus everything else that
+## changes the bytes (host for absolute urls, query string, negotiated format)
+def make_etag(request, *versions):
+    raw = '|'.join([
+        *map(str, versions),
+        request.get_host(),
+        request.get_full_path(),
+        request.META.get('HTTP_ACCEPT', ''),
+    ])
+    return '"%s"' % hashlib.sha1(raw.encode()).hexdigest()
+
+
+## 304 (or 412 for a failed If-Match) response, None when the view has to answer
+def check(request, etag, last_modified=None):
+    return get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
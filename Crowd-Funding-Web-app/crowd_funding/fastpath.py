@@ -0,0 +1,216 @@
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.core.files.storage import default_storage
+from django.db import models
+from django.utils import timezone
+from .models import User, Projects, ProjectImages, Comment
+
+## Read-only fast path: rows come from values() queries and are built into plain dicts
+## with the same keys, order and value formats as ProjectSerializer / CommentSerializer,
+## so no model instance or serializer field is created per row.
+## settings.FAST_READ_PATH turns it off (the views then use the serializers).
+
+
+def enabled(request):
+    if not getattr(settings, 'FAST_READ_PATH', False):
+        return False
+    ## sparse fieldsets (fieldsets.py) go through the serializer
+    return not (request.query_params.get('fields') or request.query_params.get('expand'))
+
+
+## same text as serializers.DateTimeField
+def datetime_text(value):
+    if value is None:
+        return None
+    if settings.USE_TZ and timezone.is_aware(value):
+        value = timezone.localtime(value)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+## same url as serializers.ImageField
+def file_url(name, request=None):
+    if not name:
+        return None
+    url = default_storage.url(name)
+    return request.build_absolute_uri(url) if request else url
+
+
+def column_converter(field, request):
+    if isinstance(field, models.DateTimeField):
+        return datetime_text
+    if isinstance(field, models.DateField):
+        return lambda value: value.isoformat() if value else None
+    if isinstance(field, models.FileField):
+        return lambda value: file_url(value, request)
+    if isinstance(field, models.DecimalField):
+        return lambda value: None if value is None else str(value)
+    return None
+
+
+## [(output key, values() column, converter)] for the concrete fields of model named in keys
+def model_columns(model, keys, request):
+    columns = []
+    for key in keys:
+        try:
+            field = model._meta.get_field(key)
+        except FieldDoesNotExist:
+            continue
+        if field.concrete and not field.many_to_many:
+            columns.append((key, field.attname, column_converter(field, request)))
+    return columns
+
+
+def build_row(values, columns):
+    row = {}
+    for key, column, convert in columns:
+        value = values[column]
+        row[key] = convert(value) if convert else value
+    return row
+
+
+## the default ProjectSerializer keys, in its order
+def project_keys():
+    from .serializers import ProjectSerializer
+    return list(ProjectSerializer().fields)
+
+
+IMAGE_FIELDS = ('id', 'image', 'thumbnail', 'card', 'status', 'uploaded_at')
+
+
+## the three values() querysets behind project_rows, nothing is run here
+def project_querysets(project_ids, keys, columns):
+    names = [column for _, column, _ in columns]
+    extra = ['average_rating', 'category__name', *(f'stars_{score}' for score in range(1, 6))]
+    projects = Projects.objects.filter(pk__in=project_ids) \
+        .values(*names, *(name for name in extra if name not in names))
+    ## in (project, tag) order like the tags prefetch, which reads the unique (project, tag) index
+    tags = Projects.tags.through.objects.filter(projects_id__in=project_ids) \
+        .order_by('projects_id', 'tag_id').values_list('projects_id', 'tag_id', 'tag__name')
+    ## (project, pk) order is the project_id index's own order, so no sort
+    images = ProjectImages.objects.filter(project_id__in=project_ids).order_by('project_id', 'pk') \
+        .values('project_id', *(column for _, column, _ in model_columns(ProjectImages, IMAGE_FIELDS, None)))
+    return projects, tags if 'tags' in keys else None, images if 'images' in keys else None
+
+
+def assemble_projects(project_ids, keys, columns, request, projects, tags, images):
+    projects = {values['id']: values for values in projects}
+    tags_by_project = {}
+    for project_id, tag_id, name in tags or ():
+        tags_by_project.setdefault(project_id, []).append({'id': tag_id, 'name': name})
+    image_columns = model_columns(ProjectImages, IMAGE_FIELDS, request)
+    images_by_project = {}
+    placeholder = settings.PROJECT_IMAGE_PLACEHOLDER
+    if placeholder and request:
+        placeholder = request.build_absolute_uri(placeholder)
+    for values in images or ():
+        image = build_row(values, image_columns)
+        ## as ProjectImagesSerializer: no link to an unprocessed upload
+        if values['status'] != ProjectImages.READY:
+            image.update(dict.fromkeys(['image', 'thumbnail', 'card'], placeholder))
+        images_by_project.setdefault(values['project_id'], []).append(image)
+
+    rows = []
+    for project_id in project_ids:
+        values = projects.get(project_id)
+        if values is None:
+            continue
+        data = build_row(values, columns)
+        computed = {
+            'category': values['category__name'],
+            'tags': tags_by_project.get(project_id, []),
+            'images': images_by_project.get(project_id, []),
+            'avg_rating': values['average_rating'],
+            'rating_histogram': {str(score): values[f'stars_{score}'] for score in range(1, 6)},
+        }
+        rows.append({key: data[key] if key in data else computed[key] for key in keys})
+    return rows
+
+
+## ProjectSerializer(projects, many=True).data for these ids (in this order) with three queries
+def project_rows(project_ids, request=None):
+    project_ids = list(project_ids)
+    if not project_ids:
+        return []
+    keys = project_keys()
+    columns = model_columns(Projects, [key for key in keys if key != 'category'], request)
+    querysets = [list(queryset) if queryset is not None else None for queryset in project_querysets(project_ids, keys, columns)]
+    return assemble_projects(project_ids, keys, columns, request, *querysets)
+
+
+async def alist(queryset):
+    if queryset is None:
+        return None
+    return [row async for row in queryset]
+
+
+## project_rows for async views (the async ORM runs the three queries one after the other)
+async def aproject_rows(project_ids, request=None):
+    project_ids = list(project_ids)
+    if not project_ids:
+        return []
+    keys = project_keys()
+    columns = model_columns(Projects, [key for key in keys if key != 'category'], request)
+    querysets = [await alist(queryset) for queryset in project_querysets(project_ids, keys, columns)]
+    return assemble_projects(project_ids, keys, columns, request, *querysets)
+
+
+COMMENT_USER_FIELDS = ('id', 'first_name', 'last_name', 'email', 'mobile_phone', 'profile_picture')
+COMMENT_FIELDS = ('id', 'project', 'content', 'created_at', 'parent', 'depth', 'reply_count')
+
+
+def comment_columns(request):
+    return (
+        model_columns(Comment, COMMENT_FIELDS, request),
+        [(key, f'user__{key}', convert) for key, _, convert in model_columns(User, COMMENT_USER_FIELDS, request)],
+    )
+
+
+## values() querysets for CommentListView, the paginator reads created_at / id from the dicts
+def comment_values(queryset):
+    columns, user_columns = comment_columns(None)
+    return queryset.values(*(column for _, column, _ in columns), *(column for _, column, _ in user_columns))
+
+
+def comment_builder(request):
+    columns, user_columns = comment_columns(request)
+
+    def build(values):
+        row = build_row(values, columns)
+        return {
+            'id': row['id'], 'project': row['project'], 'user': build_row(values, user_columns),
+            'content': row['content'], 'created_at': row['created_at'], 'parent': row['parent'],
+            'depth': row['depth'], 'reply_count': row['reply_count'], 'replies': [],
+        }
+    return build
+
+
+## the replies of a page of threads down to max_depth, None when no query is needed
+def replies_queryset(page, max_depth):
+    root_ids = [values['id'] for values in page if values['reply_count']]
+    if not root_ids or max_depth < 1:
+        return None
+    return comment_values(Comment.objects.filter(root__in=root_ids, depth__lte=max_depth).order_by('root', 'path'))
+
+
+def assemble_comments(page, thread, build):
+    rows = [build(values) for values in page]
+    by_id = {row['id']: row for row in rows}
+    for values in thread or ():
+        row = build(values)
+        by_id[row['id']] = row
+        by_id[row['parent']]['replies'].append(row)
+    return rows
+
+
+## CommentSerializer(page, many=True, context={'reply_map': Comment.reply_map(...)}).data
+## for a page of comment_values() dicts, the replies of the whole page in one query
+def comment_rows(page, max_depth, request=None):
+    thread = replies_queryset(page, max_depth)
+    return assemble_comments(page, list(thread) if thread is not None else None, comment_builder(request))
+
+
+async def acomment_rows(page, max_depth, request=None):
+    return assemble_comments(page, await alist(replies_queryset(page, max_depth)), comment_builder(request))
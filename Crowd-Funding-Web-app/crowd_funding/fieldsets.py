@@ -0,0 +1,76 @@
+from django.db.models import Prefetch
+from django.db.models.functions import Substr
+from .models import Projects, ProjectImages
+
+## Sparse fieldsets for project lists:
+##   ?fields=id,title,category   only these fields
+##   ?fields=card                the compact card (a preset), presets and fields can be mixed
+##   ?expand=tags,images         added on top of ?fields=, or of the default representation
+## Without ?fields= the default representation is unchanged, the computed card fields
+## (excerpt, progress, cover) are only sent when asked for.
+PRESETS = {
+    'card': ('id', 'title', 'excerpt', 'progress', 'cover', 'avg_rating'),
+}
+EXCERPT_LENGTH = 140
+
+## the model columns each serializer field reads, fields not listed read the column of the same name
+FIELD_COLUMNS = {
+    'avg_rating': ('average_rating',),
+    'progress': ('totalDonations', 'totalTarget'),
+    'rating_histogram': ('stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5'),
+    'excerpt': (),
+    'cover': (),
+    'tags': (),
+    'images': (),
+}
+## pagination and the cursor need these whatever the client asked for
+ALWAYS_LOADED = ('id', 'created_at')
+
+
+def split(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+## DRF request (query_params) or plain django request (GET, the async views)
+def from_request(request):
+    params = getattr(request, 'query_params', request.GET)
+    fields = []
+    for name in split(params.get('fields')):
+        fields.extend(PRESETS.get(name, (name,)))
+    return {'fields': fields or None, 'expand': split(params.get('expand'))}
+
+
+## names (in serializer order) to keep out of available
+def selected(available, optional, fields=None, expand=()):
+    if fields:
+        wanted = set(fields) | set(expand)
+    else:
+        wanted = (set(available) - set(optional)) | set(expand)
+    return [name for name in available if name in wanted]
+
+
+## load only what the selected fields read: deferred columns, no unused JOIN / prefetch
+def project_queryset(queryset, names):
+    names = set(names)
+    model_fields = {field.name for field in Projects._meta.concrete_fields}
+    columns = set(ALWAYS_LOADED)
+    for name in names:
+        columns.update(column for column in FIELD_COLUMNS.get(name, (name,)) if column in model_fields)
+
+    queryset = queryset.select_related(None).prefetch_related(None).only(*columns)
+    if 'category' in names:
+        queryset = queryset.select_related('category')
+    if 'tags' in names:
+        queryset = queryset.prefetch_related('tags')
+    if 'images' in names:
+        queryset = queryset.prefetch_related('images')
+    elif 'cover' in names:
+        queryset = queryset.prefetch_related(Prefetch(
+            'images',
+            queryset=ProjectImages.objects.filter(status=ProjectImages.READY).order_by('pk')
+                .only('id', 'project_id', 'image', 'thumbnail', 'status'),
+        ))
+    if 'excerpt' in names:
+        ## one extra character tells the serializer whether the text was cut
+        queryset = queryset.annotate(details_excerpt=Substr('details', 1, EXCERPT_LENGTH + 1))
+    return queryset
@@ -0,0 +1,152 @@
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, DateTimeField, F, Max, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from . import fieldsets, metrics
+from .models import Projects, HomeFeedSection
+from .serializers import ProjectSerializer
+
+HOME_FEED_SIZE = 5
+
+## each home section is the non canceled projects filtered / ordered differently
+SECTIONS = {
+    'latest_projects': lambda qs: qs.order_by('-created_at'),
+    'featured_projects': lambda qs: qs.filter(is_featured=True).order_by('-created_at'),
+    'top_rated_projects': lambda qs: qs.order_by('-average_rating'),
+}
+
+
+def section_queryset(name):
+    base_qs = Projects.objects.filter(is_canceled=False).select_related('category').prefetch_related('tags', 'images')
+    return SECTIONS[name](base_qs)[:HOME_FEED_SIZE]
+
+
+## serialize a section once and store it, reads never touch the projects table
+def rebuild_section(name):
+    seen = HomeFeedSection.objects.filter(name=name).values_list('pending', flat=True).first()
+    projects = list(section_queryset(name))
+    section, _ = HomeFeedSection.objects.update_or_create(
+        name=name,
+        defaults={
+            'project_ids': [project.id for project in projects],
+            'payload': ProjectSerializer(projects, many=True, context={'expand': ProjectSerializer.OPTIONAL_FIELDS}).data,
+        },
+    )
+    ## clean unless a write marked it again while it was being built
+    if seen:
+        HomeFeedSection.objects.filter(name=name, pending=seen).update(pending=0, dirty_since=None)
+    return section
+
+
+def rebuild_home_feed():
+    for name in SECTIONS:
+        rebuild_section(name)
+
+
+## the sections a set of changes can affect, changes are (project id, section name or None):
+## - sections that already show the project (its data changed)
+## - plus the named ones whose ranking may change (e.g. top rated after a rating)
+def affected_sections(changes):
+    names = {name for _, name in changes if name}
+    project_ids = {project_id for project_id, _ in changes}
+    for section in HomeFeedSection.objects.only('name', 'project_ids'):
+        if project_ids.intersection(section.project_ids):
+            names.add(section.name)
+    return names
+
+
+## one UPDATE per write transaction, the rebuild happens later and once (refresh_dirty)
+def mark_dirty(changes):
+    names = affected_sections(changes)
+    if names:
+        HomeFeedSection.objects.filter(name__in=names).update(
+            pending=F('pending') + 1,
+            dirty_since=Coalesce(F('dirty_since'), Value(timezone.now(), output_field=DateTimeField())),
+        )
+    return names
+
+
+## rebuild the marked sections (refresh_home_feed command), older_than only takes
+## those marked at least that long ago
+def refresh_dirty(older_than=None):
+    sections = HomeFeedSection.objects.filter(name__in=SECTIONS, pending__gt=0)
+    if older_than is not None:
+        sections = sections.filter(dirty_since__lte=timezone.now() - older_than)
+    names = list(sections.values_list('name', flat=True))
+    for name in names:
+        rebuild_section(name)
+    return names
+
+
+## a section marked longer ago than HOME_FEED_MAX_STALENESS seconds is rebuilt by the
+## read itself, so the feed can't go stale for good when no refresh_home_feed runs
+def too_stale(dirty_since):
+    if dirty_since is None:
+        return False
+    return dirty_since <= timezone.now() - timedelta(seconds=getattr(settings, 'HOME_FEED_MAX_STALENESS', 60))
+
+
+## rebuilt by a read: counted in its metrics, not against the view's query budget
+def rebuild_off_budget(name):
+    with metrics.off_budget():
+        return rebuild_section(name)
+
+
+def get_home_feed():
+    stored = {
+        section['name']: section
+        for section in HomeFeedSection.objects.filter(name__in=SECTIONS).values('name', 'payload', 'dirty_since')
+    }
+    feed = {}
+    for name in SECTIONS:
+        section = stored.get(name)
+        feed[name] = section['payload'] if section and not too_stale(section['dirty_since']) else rebuild_off_budget(name).payload
+    return feed
+
+
+async def aget_home_feed():
+    stored = {
+        section['name']: section
+        async for section in HomeFeedSection.objects.filter(name__in=SECTIONS).values('name', 'payload', 'dirty_since')
+    }
+    feed = {}
+    for name in SECTIONS:
+        section = stored.get(name)
+        if section and not too_stale(section['dirty_since']):
+            feed[name] = section['payload']
+        else:
+            feed[name] = (await sync_to_async(rebuild_off_budget)(name)).payload
+    return feed
+
+
+## sections are stored pre serialized with every field,
+## ?fields= / ?expand= only pick keys and urls are made absolute for this request
+def present(feed, request):
+    sparse = fieldsets.from_request(request)
+    for name, projects in feed.items():
+        selected = []
+        for project in projects:
+            keep = fieldsets.selected(list(project), ProjectSerializer.OPTIONAL_FIELDS, **sparse)
+            project = {key: project[key] for key in keep}
+            for image in project.get('images', ()):
+                for key in ('image', 'thumbnail', 'card'):
+                    if image.get(key):
+                        image[key] = request.build_absolute_uri(image[key])
+            if project.get('cover'):
+                project['cover'] = request.build_absolute_uri(project['cover'])
+            selected.append(project)
+        feed[name] = selected
+    return feed
+
+
+## (last rebuild, number of sections) for conditional GETs of the feed, without reading the payloads
+def feed_validators():
+    stored = HomeFeedSection.objects.filter(name__in=SECTIONS).aggregate(updated_at=Max('updated_at'), sections=Count('id'))
+    return stored['updated_at'], stored['sections']
+
+
+async def afeed_validators():
+    stored = await HomeFeedSection.objects.filter(name__in=SECTIONS).aaggregate(updated_at=Max('updated_at'), sections=Count('id'))
+    return stored['updated_at'], stored['sections']
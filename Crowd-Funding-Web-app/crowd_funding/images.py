@@ -0,0 +1,158 @@
+import hashlib
+import io
+import uuid
+from datetime import timedelta
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+from .models import ProjectImages
+
+## size boxes of the variants (aspect ratio is kept), all re-encoded as JPEG without EXIF
+VARIANTS = {
+    'thumbnail': (200, 200),
+    'card': (600, 400),
+    'full': (1600, 1600),
+}
+JPEG_QUALITY = 85
+MAX_PIXELS = 40_000_000
+## how long a worker may hold claimed rows before another worker can take them over
+LEASE = timedelta(minutes=10)
+
+
+## pure function (bytes in, bytes out) so it can run in a worker process
+def render_variants(data):
+    with Image.open(io.BytesIO(data)) as probe:
+        probe.verify()
+    with Image.open(io.BytesIO(data)) as image:
+        if image.width * image.height > MAX_PIXELS:
+            raise ValueError(f"Image too large ({image.width}x{image.height})")
+        ## apply the EXIF orientation before the metadata is dropped
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        variants = {}
+        for name, size in VARIANTS.items():
+            variant = image.copy()
+            variant.thumbnail(size, Image.LANCZOS)
+            buffer = io.BytesIO()
+            variant.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+            variants[name] = buffer.getvalue()
+    return hashlib.sha256(data).hexdigest(), variants
+
+
+def render_job(job):
+    pk, data = job
+    try:
+        return pk, render_variants(data), None
+    except Exception as exc:
+        return pk, None, repr(exc)
+
+
+## files are named by the hash of the uploaded bytes, the same picture uploaded twice is stored once
+def variant_path(content_hash, name):
+    return f"projects_Images/{content_hash[:2]}/{content_hash}_{name}.jpg"
+
+
+def store_variants(project_image, content_hash, variants):
+    paths = {}
+    for name, data in variants.items():
+        path = variant_path(content_hash, name)
+        if not default_storage.exists(path):
+            path = default_storage.save(path, ContentFile(data))
+        paths[name] = path
+    use_variants(project_image, content_hash, paths)
+
+
+## point the row at stored variants (its own, or those of an earlier upload of the same bytes)
+def use_variants(project_image, content_hash, paths):
+    original = project_image.image.name
+    project_image.image.name = paths['full']
+    project_image.thumbnail.name = paths['thumbnail']
+    project_image.card.name = paths['card']
+    project_image.content_hash = content_hash
+    project_image.status = ProjectImages.READY
+    project_image.processing_error = ''
+    project_image.locked_by = ''
+    project_image.locked_until = None
+    project_image.save(update_fields=[
+        'image', 'thumbnail', 'card', 'content_hash', 'status', 'processing_error', 'locked_by', 'locked_until',
+    ])
+
+    if original and original != paths['full'] and not ProjectImages.objects.filter(image=original).exists():
+        default_storage.delete(original)
+
+
+def mark_failed(project_image, error):
+    project_image.status = ProjectImages.FAILED
+    project_image.processing_error = error
+    project_image.locked_by = ''
+    project_image.locked_until = None
+    project_image.save(update_fields=['status', 'processing_error', 'locked_by', 'locked_until'])
+
+
+## claim up to batch_size pending uploads (or ones a crashed worker left) for this worker
+## with one conditional UPDATE, so two workers never render the same image
+def claim_batch(worker_id, batch_size):
+    now = timezone.now()
+    pending = Q(status=ProjectImages.PENDING)
+    abandoned = Q(status=ProjectImages.PROCESSING, locked_until__lt=now)
+    ## one indexed query each: new uploads in pk order, then the oldest expired leases
+    ids = list(ProjectImages.objects.filter(pending).order_by('pk').values_list('pk', flat=True)[:batch_size])
+    if len(ids) < batch_size:
+        ids += ProjectImages.objects.filter(abandoned).order_by('locked_until').values_list('pk', flat=True)[:batch_size - len(ids)]
+    if not ids:
+        return []
+    ProjectImages.objects.filter(pending | abandoned, pk__in=ids) \
+        .update(status=ProjectImages.PROCESSING, locked_by=worker_id, locked_until=now + LEASE)
+    return list(ProjectImages.objects.filter(pk__in=ids, locked_by=worker_id).order_by('pk'))
+
+
+## variants already stored for these content hashes, by hash
+def known_variants(content_hashes):
+    done = ProjectImages.objects.filter(content_hash__in=content_hashes, status=ProjectImages.READY) \
+        .values_list('content_hash', 'image', 'thumbnail', 'card')
+    return {content_hash: {'full': full, 'thumbnail': thumbnail, 'card': card} for content_hash, full, thumbnail, card in done}
+
+
+## process one batch of pending uploads, rendering in `pool` (an Executor) when given;
+## an upload whose bytes were processed before reuses those variants without rendering
+def process_batch(batch_size, pool=None, worker_id=None):
+    claimed = claim_batch(worker_id or uuid.uuid4().hex, batch_size)
+    if not claimed:
+        return 0, 0
+    rows = {row.pk: row for row in claimed}
+    uploads = {}
+    for row in claimed:
+        try:
+            with row.image.open('rb') as upload:
+                uploads[row.pk] = upload.read()
+        except (OSError, ValueError) as exc:
+            mark_failed(row, repr(exc))
+
+    hashes = {pk: hashlib.sha256(data).hexdigest() for pk, data in uploads.items()}
+    known = known_variants(set(hashes.values()))
+    ready = failed = 0
+    jobs = []
+    for pk, data in uploads.items():
+        if hashes[pk] in known:
+            use_variants(rows[pk], hashes[pk], known[hashes[pk]])
+            ready += 1
+        else:
+            jobs.append((pk, data))
+    results = pool.map(render_job, jobs) if pool else map(render_job, jobs)
+
+    for pk, rendered, error in results:
+        if error:
+            mark_failed(rows[pk], error)
+            failed += 1
+        else:
+            store_variants(rows[pk], *rendered)
+            ready += 1
+    return ready, failed + len(claimed) - len(uploads)
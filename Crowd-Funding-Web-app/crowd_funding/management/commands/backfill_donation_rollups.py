@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from crowd_funding import rollups
+from crowd_funding.models import Projects
+
+
+class Command(BaseCommand):
+    help = "Recompute the hourly and daily donation rollups from the donations table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, action='append', help="Only these project ids")
+        parser.add_argument('--projects-per-batch', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        projects = Projects.objects.order_by('pk')
+        if options['project']:
+            projects = projects.filter(pk__in=options['project'])
+        project_ids = list(projects.values_list('pk', flat=True))
+
+        ## a few projects per transaction so writers aren't blocked for the whole backfill
+        step = options['projects_per_batch']
+        rows = 0
+        for start in range(0, len(project_ids), step):
+            with transaction.atomic():
+                rows += rollups.rebuild(project_ids[start:start + step], options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} rollup rows for {len(project_ids)} projects"))
@@ -0,0 +1,72 @@
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from crowd_funding import fastpath
+from crowd_funding.models import Projects, Comment
+from crowd_funding.renderers import ORJSONRenderer
+from crowd_funding.serializers import ProjectSerializer, CommentSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare serializers + JSONRenderer with fastpath rows + ORJSONRenderer on the same rows: "
+        "check the JSON is identical and report pages per second (run it on seeded data)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=15, help="Rows per page, like one list response")
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--depth', type=int, default=3, help="Comment reply levels")
+        parser.add_argument('--host', default='localhost', help="Must be in ALLOWED_HOSTS, image urls are built on it")
+
+    def handle(self, *args, **options):
+        request = Request(RequestFactory().get('/', HTTP_HOST=options['host']))
+        rows = options['rows']
+
+        project_ids = list(Projects.objects.order_by('-created_at', '-id').values_list('id', flat=True)[:rows])
+        if not project_ids:
+            raise CommandError("No projects, run seed_data first")
+
+        def projects_serializer():
+            projects = Projects.objects.select_related('category').prefetch_related('tags', 'images').in_bulk(project_ids)
+            data = ProjectSerializer([projects[pk] for pk in project_ids], many=True, context={'request': request}).data
+            return JSONRenderer().render(data)
+
+        def projects_fast():
+            return ORJSONRenderer().render(fastpath.project_rows(project_ids, request))
+
+        threads = Comment.objects.filter(parent=None).values('project').annotate(n=Count('id')).order_by('-n').first()
+        comments = Comment.objects.filter(project=threads['project'], parent=None) if threads else Comment.objects.none()
+        comments = comments.order_by('-created_at', '-id')
+
+        def comments_serializer():
+            page = list(comments.select_related('user')[:rows])
+            context = {'request': request, 'reply_map': Comment.reply_map(page, options['depth'])}
+            return JSONRenderer().render(CommentSerializer(page, many=True, context=context).data)
+
+        def comments_fast():
+            page = list(fastpath.comment_values(comments)[:rows])
+            return ORJSONRenderer().render(fastpath.comment_rows(page, options['depth'], request))
+
+        report = {}
+        for name, slow, fast in (('projects', projects_serializer, projects_fast), ('comments', comments_serializer, comments_fast)):
+            if json.loads(slow()) != json.loads(fast()):
+                raise CommandError(f"{name}: the fast path JSON differs from the serializer output")
+            report[name] = {
+                'serializer_pages_per_s': self.throughput(slow, options['iterations']),
+                'fastpath_pages_per_s': self.throughput(fast, options['iterations']),
+                'identical_bytes': slow() == fast(),
+            }
+            report[name]['speedup'] = round(report[name]['fastpath_pages_per_s'] / report[name]['serializer_pages_per_s'], 2)
+
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def throughput(self, render, iterations):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            render()
+        return round(iterations / (time.perf_counter() - start), 1)
@@ -0,0 +1,201 @@
+from contextlib import nullcontext
+from unittest import mock
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from crowd_funding import home_feed, rollups
+from crowd_funding.models import (
+    User, EmailActivation, PasswordReset, Projects, ProjectImages, Donation, Comment, OutboxEmail, Tag,
+)
+from crowd_funding.pagination import KeysetPagination
+
+## tables small enough that a scan is the best plan (ANALYZE makes the planner pick it)
+ALLOWED_SCANS = {
+    'crowd_funding_homefeedsection': "one row per home feed section",
+}
+## tables whose rows a query may sort: only the matching rows, in an order no index has
+ALLOWED_SORTS = {
+    'crowd_funding_project_fts': "bm25 rank of the matching rows, computed per query",
+}
+
+
+## the read endpoints, each run through the real view (its filters, pagination, serializer
+## or fast path) and every SELECT it sends is checked; {'fts': False} forces the SearchFilter
+## fallback, {'allow': {table: reason}} accepts a scan the endpoint can't avoid
+def view_requests(project, tag):
+    term = tag.name.split('-')[0] if tag else 'water'
+    newest = Projects.objects.order_by(*KeysetPagination.ordering).first()
+    cursor = KeysetPagination().encode_cursor(newest) if newest else ''
+    ## ?page=N keeps the table order clients had before ?cursor (the indexed path for deep pages)
+    page_numbers = {'allow': {'crowd_funding_projects': "?page=N reads in rowid order up to its OFFSET"}}
+    return [
+        ('home_projects', '/api/home-projects/', {}),
+        ('ProjectView.list', '/api/projects/', page_numbers),
+        ('ProjectView.list ?page=2', '/api/projects/?page=2', page_numbers),
+        ('ProjectView.list ?cursor', '/api/projects/?cursor=', {}),
+        ('ProjectView.list next cursor', f'/api/projects/?cursor={cursor}', {}),
+        ('ProjectView.list ?fields=card', '/api/projects/?fields=card', page_numbers),
+        ('ProjectDetailView', f'/api/projects/{project.pk}/', {}),
+        ('SimilarProjectsView', f'/api/projects/{project.pk}/similar/', {}),
+        ('ProjectSearchView', f'/api/projects/search/?search={term}', {}),
+        ('ProjectSearchView SearchFilter', f'/api/projects/search/?search={term}', {
+            'fts': False,
+            'allow': {
+                'crowd_funding_projects': "LIKE '%term%' has no index, only used where FTS5 is missing",
+                'crowd_funding_projects_tags': "joined for tags__name LIKE '%term%'",
+            },
+        }),
+        ('CommentListView', f'/api/comments/list/?project={project.pk}', {}),
+        ('RatingHistogramView', f'/api/projects/{project.pk}/ratings/histogram/', {}),
+        ('DonationSeriesView', f'/api/projects/{project.pk}/donations/series/', {}),
+        ('ProfileView', '/api/profile/', {}),
+        ('ProfileProjectsView', '/api/profile/projects/', {}),
+        ('ProfileDonationsView', '/api/profile/donations/', {}),
+    ]
+
+
+## background jobs and helpers that don't run behind a read endpoint
+def job_querysets():
+    now = timezone.now()
+    project_id = user_id = 1
+    return [
+        ('token authentication', Token.objects.filter(key='0' * 40).values_list('user_id', 'user__is_active', 'key')),
+        ('ActivateAccountView', EmailActivation.objects.filter(activation_key='00000000-0000-0000-0000-000000000000')),
+        ('PasswordResetConfirmView', PasswordReset.objects.filter(reset_key='00000000-0000-0000-0000-000000000000', used=False)),
+        ('UserLoginView', User.objects.filter(email='user@example.com')),
+        ('CommentCreateView parent', Comment.objects.filter(pk=1)),
+        ('DonationCreateView', Projects.objects.filter(pk=project_id)),
+        *[(f'refresh_home_feed {name}', home_feed.section_queryset(name)) for name in home_feed.SECTIONS],
+        ('rollups new donor check', rollups.bucket_donations(project_id, 'hour', now).filter(user_id=user_id)),
+        ('send_outbox claim', OutboxEmail.objects.filter(status=OutboxEmail.PENDING, next_attempt_at__lte=now).order_by('next_attempt_at')[:50]),
+        ('process_images claim', ProjectImages.objects.filter(status=ProjectImages.PENDING).order_by('pk').values('pk')[:20]),
+        ('process_images abandoned claims', ProjectImages.objects.filter(status=ProjectImages.PROCESSING, locked_until__lt=now)
+            .order_by('locked_until').values('pk')[:20]),
+        ('purge_expired_keys activations', EmailActivation.expired().order_by('created_at').values('pk')[:500]),
+        ('purge_expired_keys resets', PasswordReset.expired().order_by('created_at').values('pk')[:500]),
+        ('purge_expired_keys used resets', PasswordReset.objects.filter(used=True).order_by('created_at').values('pk')[:500]),
+    ]
+
+
+## SCAN <table> without an index = full table scan, TEMP B-TREE = sort / distinct without an index;
+## (problems, [(allowed detail, reason)]) of a plan
+def plan_problems(plan, allowed=()):
+    problems = []
+    accepted = []
+    tables = {detail.split()[1] for detail in plan if detail.startswith(('SCAN ', 'SEARCH '))}
+    sorted_tables = tables & set(ALLOWED_SORTS)
+    for detail in plan:
+        if detail.startswith('SCAN ') and ' INDEX ' not in detail:
+            table = detail.split()[1]
+            if table in allowed:
+                accepted.append((detail, allowed[table]))
+            else:
+                problems.append(detail)
+        elif 'USE TEMP B-TREE' in detail:
+            if 'ORDER BY' in detail and sorted_tables:
+                accepted.append((detail, ALLOWED_SORTS[min(sorted_tables)]))
+            else:
+                problems.append(detail)
+    return problems, accepted
+
+
+## tables with only a few rows in the checked database: scanning them is the cheapest plan
+## whatever the indexes, so their plans say nothing (seed the database to check them)
+SMALL_TABLE_ROWS = 100
+
+
+def small_tables():
+    small = {}
+    with connection.cursor() as cursor:
+        for table in connection.introspection.table_names(cursor):
+            cursor.execute(f'SELECT COUNT(*) FROM (SELECT 1 FROM {connection.ops.quote_name(table)} LIMIT {SMALL_TABLE_ROWS})')
+            rows = cursor.fetchone()[0]
+            if rows < SMALL_TABLE_ROWS:
+                small[table] = f"only {rows} rows in this database"
+    return small
+
+
+def explain(sql, params=()):
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN QUERY PLAN every SELECT the read endpoints send (fast path on and off) and the "
+        "background job querysets, fail on full table scans or temp B-tree sorts "
+        "(run it against a seeded database, with --analyze so the planner sees realistic statistics)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true', help="Run ANALYZE first")
+        parser.add_argument('--verbose-plans', action='store_true', help="Print the plan of every query")
+        parser.add_argument('--host', default='localhost', help="Must be in ALLOWED_HOSTS")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("check_query_plans reads SQLite's EXPLAIN QUERY PLAN output")
+
+        if options['analyze']:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        self.failures = 0
+        self.options = options
+        self.allowed = {**small_tables(), **ALLOWED_SCANS}
+        for name, queryset in job_querysets():
+            sql, params = queryset.query.sql_with_params()
+            self.report(name, explain(sql, params), self.allowed)
+        self.check_views(options)
+
+        if self.failures:
+            raise CommandError(f"{self.failures} queries scan a table or sort without an index")
+        self.stdout.write(self.style.SUCCESS("All view queries use indexes"))
+
+    ## requests run in a transaction that is rolled back (login session, home feed rebuilds)
+    def check_views(self, options):
+        project = Projects.objects.annotate(n=Count('comments')).order_by('-n').first()
+        user = User.objects.annotate(n=Count('donation')).order_by('-n').first()
+        if project is None or user is None:
+            self.stdout.write(self.style.WARNING("No projects / users, only the job queries were checked (run seed_data)"))
+            return
+        with transaction.atomic():
+            client = Client(HTTP_HOST=options['host'])
+            client.force_login(user)
+            for name, url, extra in view_requests(project, Tag.objects.first()):
+                for fast_path in (True, False):
+                    self.check_request(client, f"{name} ({'fast path' if fast_path else 'serializer'})", url, extra, fast_path)
+            transaction.set_rollback(True)
+
+    def check_request(self, client, name, url, extra, fast_path):
+        fts = nullcontext() if extra.get('fts', True) else mock.patch('crowd_funding.search.is_available', return_value=False)
+        with override_settings(FAST_READ_PATH=fast_path), fts, CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f"{name} {url} returned {response.status_code}")
+        allowed = {**self.allowed, **extra.get('allow', {})}
+        seen = set()
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT') or sql in seen:
+                continue
+            seen.add(sql)
+            self.report(f"{name}: {sql[:70]}", explain(sql), allowed)
+
+    def report(self, name, plan, allowed):
+        problems, accepted = plan_problems(plan, allowed)
+        if problems:
+            self.failures += 1
+            self.stdout.write(self.style.ERROR(f"FAIL {name}: {'; '.join(problems)}"))
+        else:
+            self.stdout.write(f"ok   {name}")
+        for detail, reason in accepted:
+            self.stdout.write(f"       allowed {detail}: {reason}")
+        if self.options['verbose_plans'] or problems:
+            for detail in plan:
+                self.stdout.write(f"       {detail}")
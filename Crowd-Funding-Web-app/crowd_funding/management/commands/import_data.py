@@ -0,0 +1,275 @@
+import csv
+import json
+from decimal import Decimal
+from itertools import islice
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from crowd_funding import home_feed
+from crowd_funding.models import User, Category, Tag, Projects, ProjectImages, Donation, Comment
+
+## Columns (CSV header or JSONL keys). Lists are "a|b" in CSV and arrays in JSONL.
+##   users:     email, first_name, last_name, mobile_phone, password (already hashed), date_joined
+##   tags:      name
+##   projects:  id, owner (email), title, details, totalTarget, startTime, endTime, category (name),
+##              tags, images (paths in MEDIA_ROOT), is_featured, is_canceled, created_at
+##   donations: project, user (email), amount, created_at
+##   comments:  id, project, user (email), content, parent, created_at
+## project / parent refer to the id column of a file imported in the same run, otherwise to an existing pk.
+## Parents must come before their replies.
+KINDS = ('users', 'tags', 'projects', 'donations', 'comments')
+## legacy id -> pk of the projects / comments imported in this run, in a temporary table of the
+## import's connection so memory stays at one chunk whatever the size of the files
+ID_MAP_TABLE = 'import_data_ids'
+## ids per IN (...) lookup, below SQLite's bound parameter limit
+LOOKUP_SIZE = 500
+
+
+def read_rows(path, file_format=None):
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as source:
+        if file_format == 'csv':
+            yield from csv.DictReader(source)
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def as_list(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [item.strip() for item in value.split('|') if item.strip()]
+    return list(value)
+
+
+def as_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+def as_datetime(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"Invalid datetime {value!r}")
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream users, tags, projects, donations and comments from CSV/JSONL files into the database "
+        "with chunked bulk_create, then recompute the project counters once"
+    )
+
+    def add_arguments(self, parser):
+        for kind in KINDS:
+            parser.add_argument(f'--{kind}', help=f"CSV or JSONL file of {kind}")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Default: from the file extension")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--skip-rebuild', action='store_true', help="Don't recompute counters and derived tables")
+
+    def handle(self, *args, **options):
+        if not any(options[kind] for kind in KINDS):
+            raise CommandError(f"Give at least one of {', '.join('--' + kind for kind in KINDS)}")
+        self.batch_size = options['batch_size']
+        self.categories = dict(Category.objects.values_list('name', 'pk'))
+
+        self.create_id_map()
+        try:
+            for kind in KINDS:
+                if options[kind]:
+                    self.import_file(kind, options)
+        finally:
+            self.drop_id_map()
+
+        if not options['skip_rebuild']:
+            ## bulk_create skips save() and the signals, rebuild what they maintain in one pass each
+            ## each in batches of --batch-size: bounded memory and IN lists however big the import
+            batch = {'batch_size': self.batch_size, 'stdout': self.stdout}
+            call_command('sync_project_stats', **batch)
+            call_command('backfill_donation_rollups', **batch)
+            call_command('rebuild_comment_tree', **batch)
+            call_command('rebuild_similar_projects', **batch)
+            try:
+                call_command('rebuild_search_index', **batch)
+            except CommandError as exc:
+                self.stdout.write(f"Search index skipped: {exc}")
+            home_feed.rebuild_home_feed()
+        self.stdout.write(self.style.SUCCESS("Import finished"))
+
+    def import_file(self, kind, options):
+        importer = getattr(self, f'import_{kind}')
+        total = 0
+        for number, chunk in enumerate(chunked(read_rows(options[kind], options['format']), self.batch_size), 1):
+            try:
+                with transaction.atomic():
+                    total += importer(chunk)
+            except (KeyError, ValueError, ArithmeticError) as exc:
+                raise CommandError(f"{options[kind]} chunk {number}: {exc!r}")
+        self.stdout.write(f"Imported {total} {kind}")
+
+    def create_id_map(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {ID_MAP_TABLE} ("
+                "kind VARCHAR(16) NOT NULL, legacy_id BIGINT NOT NULL, pk BIGINT NOT NULL, PRIMARY KEY (kind, legacy_id))"
+            )
+
+    def drop_id_map(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {ID_MAP_TABLE}")
+
+    ## saved with the chunk, a later id in the files replaces an earlier one
+    def remember_ids(self, kind, ids):
+        if not ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {ID_MAP_TABLE} (kind, legacy_id, pk) VALUES (%s, %s, %s) "
+                "ON CONFLICT (kind, legacy_id) DO UPDATE SET pk = excluded.pk",
+                [(kind, legacy_id, pk) for legacy_id, pk in ids.items()],
+            )
+
+    ## {legacy id: pk} of the chunk's references, ids not imported in this run are existing pks
+    def resolve_ids(self, kind, values):
+        legacy_ids = {int(value) for value in values if value}
+        found = {}
+        with connection.cursor() as cursor:
+            for batch in chunked(sorted(legacy_ids), LOOKUP_SIZE):
+                cursor.execute(
+                    f"SELECT legacy_id, pk FROM {ID_MAP_TABLE} WHERE kind = %s AND legacy_id IN ({', '.join(['%s'] * len(batch))})",
+                    [kind, *batch],
+                )
+                found.update(cursor.fetchall())
+        return {legacy_id: found.get(legacy_id, legacy_id) for legacy_id in legacy_ids}
+
+    def bulk(self, model, objects, **kwargs):
+        return model.objects.bulk_create(objects, batch_size=self.batch_size, **kwargs)
+
+    ## auto_now_add overwrites created_at on insert, put the legacy timestamps back
+    def restore_created_at(self, model, objects, rows):
+        changed = []
+        for obj, row in zip(objects, rows):
+            created_at = as_datetime(row.get('created_at'))
+            if created_at:
+                obj.created_at = created_at
+                changed.append(obj)
+        if changed:
+            model.objects.bulk_update(changed, ['created_at'], batch_size=self.batch_size)
+
+    def user_ids(self, emails):
+        return dict(User.objects.filter(email__in=set(emails)).values_list('email', 'pk'))
+
+    def import_users(self, rows):
+        unusable = make_password(None)
+        users = [
+            User(
+                email=row['email'], first_name=row.get('first_name', ''), last_name=row.get('last_name', ''),
+                mobile_phone=row.get('mobile_phone', ''), password=row.get('password') or unusable,
+                date_joined=as_datetime(row.get('date_joined')) or timezone.now(),
+            )
+            for row in rows
+        ]
+        ## existing emails are kept as they are
+        self.bulk(User, users, ignore_conflicts=True)
+        return len(users)
+
+    def import_tags(self, rows):
+        self.bulk(Tag, [Tag(name=row['name']) for row in rows], ignore_conflicts=True)
+        return len(rows)
+
+    def tag_ids(self, names):
+        names = set(names)
+        if names:
+            self.bulk(Tag, [Tag(name=name) for name in names], ignore_conflicts=True)
+        return dict(Tag.objects.filter(name__in=names).values_list('name', 'pk'))
+
+    def category_id(self, name):
+        if not name:
+            return None
+        if name not in self.categories:
+            self.categories[name] = Category.objects.create(name=name).pk
+        return self.categories[name]
+
+    def import_projects(self, rows):
+        owners = self.user_ids(row['owner'] for row in rows)
+        tags = self.tag_ids(name for row in rows for name in as_list(row.get('tags')))
+        projects = self.bulk(Projects, [
+            Projects(
+                title=row['title'], details=row.get('details', ''), totalTarget=float(row['totalTarget']),
+                startTime=as_datetime(row['startTime']), endTime=as_datetime(row['endTime']),
+                uid_id=owners[row['owner']], category_id=self.category_id(row.get('category')),
+                is_featured=as_bool(row.get('is_featured')), is_canceled=as_bool(row.get('is_canceled')),
+            )
+            for row in rows
+        ])
+        self.restore_created_at(Projects, projects, rows)
+
+        links = []
+        images = []
+        self.remember_ids('projects', {int(row['id']): project.pk for project, row in zip(projects, rows) if row.get('id')})
+        for project, row in zip(projects, rows):
+            links.extend(Projects.tags.through(projects_id=project.pk, tag_id=tags[name]) for name in as_list(row.get('tags')))
+            ## rendered later by process_images
+            images.extend(ProjectImages(project=project, image=path) for path in as_list(row.get('images')))
+        self.bulk(Projects.tags.through, links, ignore_conflicts=True)
+        self.bulk(ProjectImages, images)
+        return len(projects)
+
+    def import_donations(self, rows):
+        users = self.user_ids(row['user'] for row in rows)
+        projects = self.resolve_ids('projects', (row['project'] for row in rows))
+        donations = self.bulk(Donation, [
+            Donation(project_id=projects[int(row['project'])], user_id=users[row['user']], amount=Decimal(str(row['amount'])))
+            for row in rows
+        ])
+        self.restore_created_at(Donation, donations, rows)
+        return len(donations)
+
+    def import_comments(self, rows):
+        users = self.user_ids(row['user'] for row in rows)
+        projects = self.resolve_ids('projects', (row['project'] for row in rows))
+        ## parents from earlier chunks, the chunk's own comments are added as they are inserted
+        parents = self.resolve_ids('comments', (row.get('parent') for row in rows))
+        comments = []
+        pending_ids = set()
+        ## a reply to a comment of the same chunk needs the parent's pk, insert what is pending first
+        for row in rows:
+            parent = int(row['parent']) if row.get('parent') else None
+            if parent in pending_ids:
+                parents.update(self.flush_comments(comments))
+                comments = []
+                pending_ids = set()
+            if row.get('id'):
+                pending_ids.add(int(row['id']))
+            comments.append((row, Comment(
+                project_id=projects[int(row['project'])], user_id=users[row['user']], content=row['content'],
+                parent_id=parents[parent] if parent else None,
+            )))
+        self.flush_comments(comments)
+        return len(rows)
+
+    ## {legacy id: pk} of the inserted comments
+    def flush_comments(self, pending):
+        rows = [row for row, _ in pending]
+        comments = self.bulk(Comment, [comment for _, comment in pending])
+        ids = {int(row['id']): comment.pk for comment, row in zip(comments, rows) if row.get('id')}
+        self.remember_ids('comments', ids)
+        self.restore_created_at(Comment, comments, rows)
+        return ids
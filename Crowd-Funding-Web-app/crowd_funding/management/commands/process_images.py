@@ -0,0 +1,34 @@
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand
+from crowd_funding import images
+
+
+class Command(BaseCommand):
+    help = "Validate, strip EXIF and resize pending project image uploads into thumbnail / card / full variants"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--workers', type=int, default=2, help="Processes used for decoding / resizing (0 = inline)")
+        parser.add_argument('--loop', action='store_true', help="Keep polling instead of exiting when nothing is pending")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds between polls with --loop")
+
+    def handle(self, *args, **options):
+        pool = ProcessPoolExecutor(max_workers=options['workers']) if options['workers'] > 0 else None
+        worker_id = uuid.uuid4().hex
+        ready = failed = 0
+        try:
+            while True:
+                batch_ready, batch_failed = images.process_batch(options['batch_size'], pool, worker_id)
+                ready += batch_ready
+                failed += batch_failed
+                if batch_ready or batch_failed:
+                    continue
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        finally:
+            if pool:
+                pool.shutdown()
+        self.stdout.write(self.style.SUCCESS(f"Processed {ready} images, {failed} failed"))
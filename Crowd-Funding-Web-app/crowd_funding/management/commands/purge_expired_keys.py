@@ -0,0 +1,46 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from crowd_funding.models import EmailActivation, PasswordReset
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired account activations and expired or used password resets in small batches, "
+        "each its own short transaction (schedule it, e.g. hourly from cron)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--pause', type=float, default=0.05, help="Seconds between batches so other writers get the lock")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the rows")
+
+    def handle(self, *args, **options):
+        purges = (
+            ('expired activations', EmailActivation.expired),
+            ('expired password resets', PasswordReset.expired),
+            ('used password resets', lambda: PasswordReset.objects.filter(used=True)),
+        )
+        total = 0
+        for label, queryset in purges:
+            if options['dry_run']:
+                deleted = queryset().count()
+            else:
+                deleted = self.purge(queryset, options['batch_size'], options['pause'])
+            total += deleted
+            self.stdout.write(f"{label}: {deleted}")
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {total} rows"))
+
+    ## oldest first through the created_at index, the write lock is held for one batch at a time
+    def purge(self, queryset, batch_size, pause):
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                ids = list(queryset().order_by('created_at').values_list('pk', flat=True)[:batch_size])
+                if not ids:
+                    return deleted
+                deleted += queryset().filter(pk__in=ids).delete()[0]
+            if len(ids) < batch_size:
+                return deleted
+            time.sleep(pause)
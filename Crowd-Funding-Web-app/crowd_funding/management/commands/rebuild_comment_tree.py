@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from crowd_funding.models import Comment
+
+
+class Command(BaseCommand):
+    help = "Recompute root, path, depth and reply_count of every comment"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ## parents always have a smaller id than their replies, so walking in id order a parent
+        ## is in the batch or was rewritten by an earlier one: one batch of paths in memory
+        last_pk, total = 0, 0
+        while True:
+            rows = list(Comment.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'parent_id')[:batch_size])
+            if not rows:
+                break
+            with transaction.atomic():
+                self.rebuild(rows)
+            last_pk, total = rows[-1][0], total + len(rows)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt tree for {total} comments"))
+
+    def rebuild(self, rows):
+        first_pk = rows[0][0]
+        earlier = {parent_id for _, parent_id in rows if parent_id and parent_id < first_pk}
+        nodes = {
+            pk: (root_id, path, depth) for pk, root_id, path, depth
+            in Comment.objects.filter(pk__in=earlier).values_list('pk', 'root_id', 'path', 'depth')
+        }
+        batch = []
+        for comment_id, parent_id in rows:
+            parent = nodes.get(parent_id)
+            step = str(comment_id).zfill(Comment.PATH_STEP) + '/'
+            if parent:
+                root_id, path, depth = parent[0] or parent_id, parent[1] + step, parent[2] + 1
+            else:
+                root_id, path, depth = None, step, 0
+            nodes[comment_id] = (root_id, path, depth)
+            batch.append(Comment(pk=comment_id, root_id=root_id, path=path, depth=depth))
+        Comment.objects.bulk_update(batch, ['root', 'path', 'depth'])
+
+        ## replies may be in later batches, counted through the parent index
+        replies = Comment.objects.filter(parent=OuterRef('pk')).order_by().values('parent').annotate(n=Count('pk')).values('n')
+        Comment.objects.filter(pk__gte=first_pk, pk__lte=rows[-1][0]).update(reply_count=Coalesce(Subquery(replies), 0))
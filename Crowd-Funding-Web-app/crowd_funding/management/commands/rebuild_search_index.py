@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from crowd_funding import search
+from crowd_funding.models import Projects
+
+
+class Command(BaseCommand):
+    help = "Create the project full text index if needed and rebuild it from the projects table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError("Full text search needs SQLite with FTS5, ProjectSearchView falls back to SearchFilter")
+        search.create_index()
+        batch_size = options['batch_size']
+        project_ids = list(Projects.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(project_ids), batch_size):
+            with transaction.atomic():
+                search.index_projects(project_ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {len(project_ids)} projects"))
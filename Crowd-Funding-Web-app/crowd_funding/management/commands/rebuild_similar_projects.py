@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from crowd_funding import similarity
+
+
+class Command(BaseCommand):
+    help = "Recompute the similar projects table from scratch (refreshes tag rarity weights)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = similarity.rebuild_all(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt similar projects for {count} projects"))
@@ -0,0 +1,31 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from crowd_funding import home_feed
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the home feed sections marked by writes since their last rebuild, once for all of "
+        "those writes (run it with --loop next to the web workers, or every few seconds from cron)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Rebuild every section, marked or not")
+        parser.add_argument('--delay', type=float, default=0, help="Only sections marked at least this many seconds ago")
+        parser.add_argument('--loop', action='store_true', help="Keep polling instead of exiting")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds between polls with --loop")
+
+    def handle(self, *args, **options):
+        if options['all']:
+            home_feed.rebuild_home_feed()
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(home_feed.SECTIONS)} sections"))
+            return
+        older_than = timedelta(seconds=options['delay']) if options['delay'] else None
+        while True:
+            names = home_feed.refresh_dirty(older_than)
+            if names or not options['loop']:
+                self.stdout.write(f"Rebuilt {', '.join(names) or 'no sections'}")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
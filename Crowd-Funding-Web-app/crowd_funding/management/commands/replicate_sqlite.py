@@ -0,0 +1,45 @@
+import sqlite3
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Replication stand-in for local primary / replica routing: copy the SQLite primary into every "
+        "replica file (SQLITE_REPLICAS) with the online backup API, once or every --interval seconds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help="Seconds between copies, 0 copies once")
+        parser.add_argument('--iterations', type=int, default=0, help="Stop after this many copies (0: run until interrupted)")
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError("Only SQLite primaries can be copied, real replicas use the database's own replication")
+        targets = {alias: settings.DATABASES[alias]['NAME'] for alias in settings.DATABASE_REPLICAS}
+        if not targets:
+            raise CommandError("No replicas configured, set SQLITE_REPLICAS")
+
+        copies = 0
+        while True:
+            start = time.perf_counter()
+            source = sqlite3.connect(primary['NAME'])
+            try:
+                for alias, path in targets.items():
+                    target = sqlite3.connect(path)
+                    try:
+                        ## a consistent snapshot even while the primary is being written
+                        source.backup(target)
+                    finally:
+                        target.close()
+            finally:
+                source.close()
+            copies += 1
+            self.stdout.write(f"Copied the primary to {', '.join(targets)} in {(time.perf_counter() - start) * 1000:.1f} ms")
+            if not options['interval'] or copies == options['iterations']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f"{copies} replication pass(es) done"))
@@ -0,0 +1,101 @@
+import json
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test import Client, override_settings
+from rest_framework.authtoken.models import Token
+from crowd_funding.metrics import count_queries, percentile
+from crowd_funding.models import User, Projects, Comment, Donation, Tag
+
+
+class Command(BaseCommand):
+    help = "Drive the main read endpoints through the test client and report latency percentiles and query counts as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--label', default='', help="Stored in the report, e.g. the commit being measured")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+        parser.add_argument('--only', action='append', help="Only run these endpoint names")
+        parser.add_argument('--host', default='localhost', help="Must be in ALLOWED_HOSTS")
+        parser.add_argument('--fast-path', choices=['on', 'off'], help="Override settings.FAST_READ_PATH for this run")
+
+    ## the busiest objects of the dataset, so the numbers reflect the worst pages
+    def targets(self):
+        project = Projects.objects.annotate(n=Count('comments')).order_by('-n').first()
+        user = User.objects.annotate(n=Count('donation')).order_by('-n').first()
+        tag = Tag.objects.first()
+        if project is None or user is None:
+            raise CommandError("No data to benchmark, run seed_data first")
+        return project, user, tag
+
+    def endpoints(self, project, tag):
+        term = tag.name.split('-')[0] if tag else 'water'
+        return {
+            'home_projects': '/api/home-projects/',
+            'ProjectView.list': '/api/projects/',
+            'ProjectView.detail': f'/api/projects/{project.pk}/',
+            'ProjectSearchView': f'/api/projects/search/?search={term}',
+            'CommentListView': f'/api/comments/list/?project={project.pk}',
+            'ProfileView': '/api/profile/',
+            'SimilarProjectsView': f'/api/projects/{project.pk}/similar/',
+        }
+
+    def handle(self, *args, **options):
+        if options['fast_path']:
+            with override_settings(FAST_READ_PATH=options['fast_path'] == 'on'):
+                return self.run(options)
+        return self.run(options)
+
+    def run(self, options):
+        project, user, tag = self.targets()
+        token, _ = Token.objects.get_or_create(user=user)
+        client = Client(HTTP_HOST=options['host'], HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        results = {}
+        for name, url in self.endpoints(project, tag).items():
+            if options['only'] and name not in options['only']:
+                continue
+            for _ in range(options['warmup']):
+                client.get(url)
+            latencies = []
+            queries = []
+            for _ in range(options['iterations']):
+                with count_queries() as counter:
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                queries.append(counter.count)
+                if response.status_code != 200:
+                    raise CommandError(f"{name} {url} returned {response.status_code}")
+            latencies.sort()
+            results[name] = {
+                'url': url,
+                'p50_ms': round(percentile(latencies, 0.50), 3),
+                'p95_ms': round(percentile(latencies, 0.95), 3),
+                'p99_ms': round(percentile(latencies, 0.99), 3),
+                'mean_ms': round(sum(latencies) / len(latencies), 3),
+                'queries': max(queries),
+                'bytes': len(response.content),
+            }
+
+        report = {
+            'label': options['label'],
+            'iterations': options['iterations'],
+            'fast_read_path': settings.FAST_READ_PATH,
+            'dataset': {
+                'users': User.objects.count(),
+                'projects': Projects.objects.count(),
+                'donations': Donation.objects.count(),
+                'comments': Comment.objects.count(),
+            },
+            'endpoints': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        else:
+            self.stdout.write(output)
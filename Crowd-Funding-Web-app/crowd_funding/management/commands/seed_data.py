@@ -0,0 +1,187 @@
+import io
+import random
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+from crowd_funding import home_feed
+from crowd_funding.models import (
+    User, Category, Tag, Projects, ProjectImages, Donation, Comment, Rating, Report,
+)
+
+SEED_IMAGE = 'projects_Images/seed.jpg'
+WORDS = (
+    'water school clinic solar garden library bakery music art film robot bike farm '
+    'ocean forest kitchen shelter studio theatre games code books health sports travel'
+).split()
+
+
+class Command(BaseCommand):
+    help = "Seed a synthetic dataset with bulk_create (for benchmarks and check_query_plans)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--projects', type=int, default=1000)
+        parser.add_argument('--images-per-project', type=int, default=2)
+        parser.add_argument('--donations', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=5000)
+        parser.add_argument('--ratings', type=int, default=5000)
+        parser.add_argument('--reports', type=int, default=200)
+        parser.add_argument('--days', type=int, default=365, help="Spread created_at over this many days")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.days = options['days']
+        prefix = f"seed{self.random.randrange(10 ** 8)}"
+
+        with transaction.atomic():
+            users = self.seed_users(prefix, options['users'])
+            categories = self.bulk(Category, [Category(name=f"{prefix}-{i}") for i in range(options['categories'])])
+            tags = self.bulk(Tag, [Tag(name=f"{self.random.choice(WORDS)}{i}-{prefix[4:]}") for i in range(options['tags'])])
+            projects = self.seed_projects(users, categories, tags, options['projects'], options['images_per_project'])
+            self.seed_donations(users, projects, options['donations'])
+            comments = self.seed_comments(users, projects, options['comments'])
+            self.seed_ratings(users, projects, options['ratings'])
+            self.seed_reports(users, projects, comments, options['reports'])
+
+        ## derived tables the request paths read instead of aggregating
+        call_command('sync_project_stats', stdout=self.stdout)
+        call_command('backfill_donation_rollups', stdout=self.stdout)
+        call_command('rebuild_comment_tree', stdout=self.stdout)
+        call_command('rebuild_similar_projects', stdout=self.stdout)
+        try:
+            call_command('rebuild_search_index', stdout=self.stdout)
+        except Exception as exc:
+            self.stdout.write(f"Search index skipped: {exc}")
+        home_feed.rebuild_home_feed()
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} users, {len(projects)} projects, {options['donations']} donations, "
+            f"{len(comments)} comments, {options['ratings']} ratings"
+        ))
+
+    def bulk(self, model, objects):
+        return model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def random_time(self):
+        return self.now - timedelta(seconds=self.random.randrange(self.days * 86400))
+
+    ## auto_now_add overwrites created_at on insert, spread it afterwards
+    def spread_created_at(self, model, objects):
+        for obj in objects:
+            obj.created_at = self.random_time()
+        model.objects.bulk_update(objects, ['created_at'], batch_size=self.batch_size)
+
+    def seed_users(self, prefix, count):
+        password = make_password('seed-password')
+        return self.bulk(User, [
+            User(
+                email=f"{prefix}-{i}@example.com", password=password,
+                first_name=f"User{i}", last_name='Seed', mobile_phone='01012345678',
+            )
+            for i in range(count)
+        ])
+
+    def seed_projects(self, users, categories, tags, count, images_per_project):
+        projects = self.bulk(Projects, [
+            Projects(
+                title=' '.join(self.random.sample(WORDS, 2)).title()[:30],
+                details=' '.join(self.random.choices(WORDS, k=80)),
+                totalTarget=self.random.randrange(1000, 100000),
+                startTime=self.now - timedelta(days=self.random.randrange(60)),
+                endTime=self.now + timedelta(days=self.random.randrange(1, 120)),
+                uid=self.random.choice(users),
+                category=self.random.choice(categories) if categories else None,
+                is_featured=self.random.random() < 0.05,
+                is_canceled=self.random.random() < 0.02,
+            )
+            for _ in range(count)
+        ])
+        self.spread_created_at(Projects, projects)
+
+        ProjectTags = Projects.tags.through
+        links = []
+        for project in projects:
+            for tag in self.random.sample(tags, min(len(tags), self.random.randint(1, 4))):
+                links.append(ProjectTags(projects_id=project.pk, tag_id=tag.pk))
+        self.bulk(ProjectTags, links)
+
+        if images_per_project:
+            if not default_storage.exists(SEED_IMAGE):
+                buffer = io.BytesIO()
+                Image.new('RGB', (600, 400), 'steelblue').save(buffer, 'JPEG')
+                default_storage.save(SEED_IMAGE, ContentFile(buffer.getvalue()))
+            self.bulk(ProjectImages, [
+                ProjectImages(project=project, image=SEED_IMAGE, thumbnail=SEED_IMAGE, card=SEED_IMAGE, status=ProjectImages.READY)
+                for project in projects for _ in range(images_per_project)
+            ])
+        return projects
+
+    def seed_donations(self, users, projects, count):
+        ## a few campaigns get most of the donations, like real traffic
+        weights = [1 / (rank + 1) for rank in range(len(projects))]
+        for start in range(0, count, self.batch_size):
+            size = min(self.batch_size, count - start)
+            donations = self.bulk(Donation, [
+                Donation(
+                    project=project, user=self.random.choice(users),
+                    amount=Decimal(self.random.randrange(100, 50000)) / 100,
+                )
+                for project in self.random.choices(projects, weights=weights, k=size)
+            ])
+            self.spread_created_at(Donation, donations)
+
+    def seed_comments(self, users, projects, count):
+        ## top level comments first, then replies to already created comments (up to depth 3)
+        top_level = self.bulk(Comment, [
+            Comment(project=self.random.choice(projects), user=self.random.choice(users), content=' '.join(self.random.choices(WORDS, k=12)))
+            for _ in range(int(count * 0.6))
+        ])
+        comments = list(top_level)
+        level = top_level
+        remaining = count - len(top_level)
+        for depth in range(1, 4):
+            if remaining <= 0 or not level:
+                break
+            size = remaining if depth == 3 else max(1, remaining // 2)
+            parents = self.random.choices(level, k=size)
+            level = self.bulk(Comment, [
+                Comment(project_id=parent.project_id, user=self.random.choice(users), parent=parent,
+                        content=' '.join(self.random.choices(WORDS, k=8)))
+                for parent in parents
+            ])
+            comments.extend(level)
+            remaining -= len(level)
+        self.spread_created_at(Comment, comments)
+        return comments
+
+    def seed_ratings(self, users, projects, count):
+        pairs = set()
+        limit = min(count, len(users) * len(projects))
+        while len(pairs) < limit:
+            pairs.add((self.random.randrange(len(projects)), self.random.randrange(len(users))))
+        self.bulk(Rating, [
+            Rating(project=projects[project], user=users[user], score=self.random.randint(1, 5))
+            for project, user in pairs
+        ])
+
+    def seed_reports(self, users, projects, comments, count):
+        reports = []
+        for _ in range(count):
+            if comments and self.random.random() < 0.5:
+                comment = self.random.choice(comments)
+                reports.append(Report(report_type='COMMENT', comment=comment, user=self.random.choice(users), reason='spam'))
+            else:
+                reports.append(Report(report_type='PROJECT', project=self.random.choice(projects), user=self.random.choice(users), reason='fraud'))
+        self.bulk(Report, reports)
@@ -0,0 +1,42 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connections
+from crowd_funding import outbox
+
+
+def _drain(batch_size):
+    try:
+        return outbox.drain(batch_size)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Send queued emails from the outbox (each worker keeps one SMTP connection open across batches)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=1, help="Sender threads, each with its own connection")
+        parser.add_argument('--loop', action='store_true', help="Keep polling instead of exiting when the outbox is empty")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds between polls with --loop")
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            while True:
+                if pool:
+                    results = list(pool.map(_drain, [options['batch_size']] * workers))
+                else:
+                    results = [outbox.drain(options['batch_size'])]
+                sent = sum(result[0] for result in results)
+                failed = sum(result[1] for result in results)
+                if sent or failed or not options['loop']:
+                    self.stdout.write(f"Sent {sent} emails, {failed} failed")
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        finally:
+            if pool:
+                pool.shutdown()
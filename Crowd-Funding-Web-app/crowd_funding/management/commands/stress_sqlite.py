@@ -0,0 +1,129 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.test import override_settings
+
+## the scratch database's alias, only registered while the command runs
+ALIAS = 'sqlite_stress'
+
+## donation shaped write: read the project, insert the donation, bump the counters
+SCHEMA = [
+    "CREATE TABLE project (id INTEGER PRIMARY KEY, total REAL NOT NULL DEFAULT 0, donations INTEGER NOT NULL DEFAULT 0)",
+    "CREATE TABLE donation (id INTEGER PRIMARY KEY, project_id INTEGER NOT NULL, amount REAL NOT NULL, created_at REAL NOT NULL)",
+    "CREATE INDEX donation_project ON donation (project_id, created_at)",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Concurrent donation-style writes and readers on a scratch SQLite file through Django connections "
+        "(one per thread, transaction.atomic), once with Django's defaults (DEFERRED transactions, no "
+        "PRAGMAs) and once with the project's (DATABASES OPTIONS transaction_mode, the SQLITE_PRAGMAS "
+        "connection hook); reports lock errors and throughput. The project database is not touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--transactions', type=int, default=200, help="Per writer")
+        parser.add_argument('--projects', type=int, default=20)
+        parser.add_argument('--timeout', type=float, default=5.0, help="Busy timeout (seconds) of the default profile, Django's default is 5")
+        parser.add_argument('--profile', choices=['default', 'tuned', 'both'], default='both')
+
+    def handle(self, *args, **options):
+        profiles = ['default', 'tuned'] if options['profile'] == 'both' else [options['profile']]
+        report = {}
+        for profile in profiles:
+            with tempfile.TemporaryDirectory() as directory:
+                connections.settings[ALIAS] = self.database(os.path.join(directory, 'stress.sqlite3'), profile, options)
+                try:
+                    ## the connection_created hook reads SQLITE_TUNING
+                    with override_settings(SQLITE_TUNING=profile == 'tuned'):
+                        report[profile] = self.run(options)
+                finally:
+                    connections[ALIAS].close()
+                    del connections[ALIAS]
+                    del connections.settings[ALIAS]
+        self.stdout.write(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS("Stress test done"))
+
+    ## the project's database settings on the scratch file, or Django's defaults
+    def database(self, path, profile, options):
+        database = {**connections['default'].settings_dict, 'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}
+        if profile == 'default':
+            database['OPTIONS'] = {'timeout': options['timeout']}
+        return database
+
+    def run(self, options):
+        connection = connections[ALIAS]
+        with connection.cursor() as cursor:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+            cursor.executemany("INSERT INTO project (id) VALUES (%s)", [(pk,) for pk in range(1, options['projects'] + 1)])
+            cursor.execute("PRAGMA journal_mode")
+            journal_mode = cursor.fetchone()[0]
+        connection.close()
+
+        stats = {
+            'transaction_mode': connection.settings_dict['OPTIONS'].get('transaction_mode') or 'DEFERRED',
+            'journal_mode': journal_mode,
+            'commits': 0, 'lock_errors': 0, 'reads': 0, 'read_errors': 0,
+        }
+        lock = threading.Lock()
+        writing = threading.Event()
+
+        def count(name):
+            with lock:
+                stats[name] += 1
+
+        ## connections are per thread, each thread closes its own
+        def writer(number):
+            try:
+                for i in range(options['transactions']):
+                    project_id = (number * options['transactions'] + i) % options['projects'] + 1
+                    try:
+                        with transaction.atomic(using=ALIAS), connections[ALIAS].cursor() as cursor:
+                            cursor.execute("SELECT total FROM project WHERE id = %s", [project_id])
+                            cursor.fetchone()
+                            cursor.execute("INSERT INTO donation (project_id, amount, created_at) VALUES (%s, %s, %s)", [project_id, 10, time.time()])
+                            cursor.execute("UPDATE project SET total = total + 10, donations = donations + 1 WHERE id = %s", [project_id])
+                        count('commits')
+                    except OperationalError:
+                        count('lock_errors')
+            finally:
+                connections[ALIAS].close()
+
+        def reader():
+            try:
+                while writing.is_set():
+                    try:
+                        with connections[ALIAS].cursor() as cursor:
+                            cursor.execute("SELECT project_id, SUM(amount), COUNT(*) FROM donation GROUP BY project_id")
+                            cursor.fetchall()
+                        count('reads')
+                    except OperationalError:
+                        count('read_errors')
+            finally:
+                connections[ALIAS].close()
+
+        writing.set()
+        readers = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        writers = [threading.Thread(target=writer, args=(number,)) for number in range(options['writers'])]
+        start = time.perf_counter()
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        writing.clear()
+        for thread in readers:
+            thread.join()
+
+        stats['elapsed_s'] = round(elapsed, 3)
+        stats['writes_per_s'] = round(stats['commits'] / elapsed, 1)
+        stats['reads_per_s'] = round(stats['reads'] / elapsed, 1)
+        return stats
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from crowd_funding.models import Projects, Donation, Rating
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized donation and rating counters of every project"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, action='append', help="Only these project ids")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Projects per query and transaction")
+
+    def handle(self, *args, **options):
+        projects = Projects.objects.order_by('pk')
+        if options['project']:
+            projects = projects.filter(pk__in=options['project'])
+        project_ids = list(projects.values_list('pk', flat=True))
+
+        ## bounded IN lists (SQLite caps the bound parameters of a statement) and a
+        ## short write transaction per batch
+        batch_size = options['batch_size']
+        for start in range(0, len(project_ids), batch_size):
+            self.sync(project_ids[start:start + batch_size])
+
+        self.stdout.write(self.style.SUCCESS(f"Synced stats for {len(project_ids)} projects"))
+
+    def sync(self, project_ids):
+        donations = {
+            row['project']: row for row in Donation.objects.filter(project__in=project_ids)
+            .values('project').annotate(total=Sum('amount'), count=Count('id'), last=Max('created_at'))
+        }
+        ratings = {
+            row['project']: row for row in Rating.objects.filter(project__in=project_ids)
+            .values('project').annotate(
+                total=Sum('score'), count=Count('id'),
+                **{f'stars_{score}': Count('id', filter=Q(score=score)) for score in range(1, 6)}
+            )
+        }
+
+        with transaction.atomic():
+            for project_id in project_ids:
+                donation = donations.get(project_id, {})
+                rating = ratings.get(project_id, {})
+                rating_count = rating.get('count', 0)
+                Projects.objects.filter(pk=project_id).update(
+                    totalDonations=float(donation.get('total') or 0),
+                    donations_count=donation.get('count', 0),
+                    last_donation_at=donation.get('last'),
+                    rating_sum=rating.get('total') or 0,
+                    rating_count=rating_count,
+                    average_rating=rating['total'] / rating_count if rating_count else 0,
+                    **{f'stars_{score}': rating.get(f'stars_{score}', 0) for score in range(1, 6)}
+                )
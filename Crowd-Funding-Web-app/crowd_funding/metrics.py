@@ -0,0 +1,211 @@
+import logging
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+## Per route request metrics (query count, SQL time, total latency) kept in memory per worker.
+## QUERY_METRICS = {'WINDOW': .., 'RAISE_OVER_BUDGET': ..} in settings. Requests over their
+## view's query budget are counted and logged; they only raise when RAISE_OVER_BUDGET is on
+## (the tests' base class), in production the response is already built and its writes committed.
+def _metrics_setting(name, default):
+    return getattr(settings, 'QUERY_METRICS', {}).get(name, default)
+
+
+_off_budget = ContextVar('off_budget', default=False)
+
+
+## queries run inside are counted but not against the view's budget: occasional work
+## a read does on behalf of the background jobs (e.g. rebuilding a stale home feed section)
+@contextmanager
+def off_budget():
+    token = _off_budget.set(True)
+    try:
+        yield
+    finally:
+        _off_budget.reset(token)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.off_budget = 0
+        self.duration = 0.0
+
+    @property
+    def budgeted(self):
+        return self.count - self.off_budget
+
+    ## connection.execute_wrapper hook
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.off_budget += _off_budget.get()
+
+
+## counter hooked on every connection of the current thread, close the stack to unhook it
+def install_counter(counter):
+    stack = ExitStack()
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(counter))
+    return stack
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    with install_counter(counter):
+        yield counter
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+## the last WINDOW samples of one route (rolling, bounded memory)
+class RouteStats:
+    METRICS = ('queries', 'sql_ms', 'total_ms')
+
+    def __init__(self, window):
+        self.samples = {name: deque(maxlen=window) for name in self.METRICS}
+        self.requests = 0
+        self.over_budget = 0
+
+    def add(self, queries, sql_ms, total_ms, over_budget):
+        self.requests += 1
+        self.over_budget += over_budget
+        self.samples['queries'].append(queries)
+        self.samples['sql_ms'].append(sql_ms)
+        self.samples['total_ms'].append(total_ms)
+
+    def summary(self):
+        data = {'requests': self.requests, 'over_budget': self.over_budget}
+        for name, values in self.samples.items():
+            ordered = sorted(values)
+            data[name] = {
+                'p50': percentile(ordered, 0.50),
+                'p95': percentile(ordered, 0.95),
+                'p99': percentile(ordered, 0.99),
+                'max': ordered[-1] if ordered else 0,
+                'mean': round(sum(ordered) / len(ordered), 3) if ordered else 0,
+            }
+        return data
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def record(self, route, queries, sql_ms, total_ms, over_budget=False):
+        with self.lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = RouteStats(_metrics_setting('WINDOW', 1000))
+            stats.add(queries, sql_ms, total_ms, over_budget)
+
+    def snapshot(self):
+        with self.lock:
+            return {route: stats.summary() for route, stats in sorted(self.routes.items())}
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+
+
+registry = MetricsRegistry()
+
+
+## mark a view (function or class) with the most queries one request may run:
+## a number for every method, or per method ({'GET': 6, 'POST': 40}, others unbudgeted)
+def query_budget(max_queries):
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def view_budget(view_func, method=None):
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None:
+        budget = getattr(getattr(view_func, 'view_class', None), 'query_budget', None)
+    if budget is None:
+        budget = getattr(getattr(view_func, 'cls', None), 'query_budget', None)
+    if isinstance(budget, dict):
+        return budget.get(method)
+    return budget
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+## sync and async capable: under ASGI the async views (async_views.py) are awaited
+## directly instead of being run in a thread
+class QueryMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with count_queries() as counter:
+            response = self.get_response(request)
+        self.record(request, counter, start)
+        return response
+
+    ## connections are per thread: the async ORM runs its queries on the request's
+    ## sync thread, so the counter is hooked there and not on the event loop
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        counter = QueryCounter()
+        stack = await sync_to_async(install_counter)(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.record(request, counter, start)
+        return response
+
+    def record(self, request, counter, start):
+        total_ms = (time.perf_counter() - start) * 1000
+
+        match = request.resolver_match
+        route = f"{request.method} /{match.route}" if match else f"{request.method} <unresolved>"
+        budget = view_budget(match.func, request.method) if match else None
+        over_budget = budget is not None and counter.budgeted > budget
+        registry.record(route, counter.count, round(counter.duration * 1000, 3), round(total_ms, 3), over_budget)
+
+        if over_budget:
+            message = f"{route} ran {counter.budgeted} queries (budget {budget})"
+            if _metrics_setting('RAISE_OVER_BUDGET', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+
+## test helper: fail when the block runs more than max_queries queries
+@contextmanager
+def assert_max_queries(max_queries):
+    with count_queries() as counter:
+        yield counter
+    if counter.budgeted > max_queries:
+        raise QueryBudgetExceeded(f"{counter.budgeted} queries executed, budget was {max_queries}")
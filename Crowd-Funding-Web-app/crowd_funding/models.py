@@ -1,5 +1,7 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Cast, Coalesce, Greatest, NullIf
+import os
 import uuid
 from django.utils import timezone
 from datetime import timedelta
@@ -49,28 +51,77 @@ class ExtraInfo(models.Model):
 
 
 class EmailActivation(models.Model):
+    LIFETIME = timedelta(hours=24)
+
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     activation_key = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    ## purge_expired_keys range scans it
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def is_expired(self):
-        return timezone.now() > self.created_at + timedelta(hours=24)
+        return timezone.now() > self.created_at + self.LIFETIME
+
+    ## rows nobody can use anymore (purge_expired_keys)
+    @classmethod
+    def expired(cls):
+        return cls.objects.filter(created_at__lt=timezone.now() - cls.LIFETIME)
 
     def __str__(self):
         return f"Activation for {self.user.email}"
 
 class PasswordReset(models.Model):
+    LIFETIME = timedelta(hours=1)
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     reset_key = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     used = models.BooleanField(default=False)
 
+    class Meta:
+        ## used but not yet expired rows, purged by purge_expired_keys too
+        indexes = [models.Index(fields=['created_at'], condition=models.Q(used=True), name='passwordreset_used_idx')]
+
     def is_expired(self):
-        return timezone.now() > self.created_at + timedelta(hours=1)
+        return timezone.now() > self.created_at + self.LIFETIME
+
+    @classmethod
+    def expired(cls):
+        return cls.objects.filter(created_at__lt=timezone.now() - cls.LIFETIME)
 
     def __str__(self):
         return f"Password reset for {self.user.email}"
 
+## Email outbox: rows are written in the same transaction as the activation / reset row
+## and sent later by the send_outbox command (see outbox.py)
+class OutboxEmail(models.Model):
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    ## a worker owns the row until locked_until (so several workers can drain the outbox)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} ({self.status})"
+
 ###Projects model 
 
 ## Category Model
@@ -109,7 +160,50 @@ class Projects(models.Model):
     is_canceled = models.BooleanField(default=False)  
     created_at = models.DateTimeField(auto_now_add=True)
     totalDonations = models.FloatField(default=0)  
+    donations_count = models.PositiveIntegerField(default=0)
+    last_donation_at = models.DateTimeField(null=True, blank=True)
     average_rating = models.FloatField(default=0)  
+    ## rating aggregates kept up to date by apply_rating from the Rating signals (no Avg() on reads)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+    ## bumped on every change to the project or what is shown with it (ETag / Last-Modified, see conditional.py)
+    version = models.PositiveIntegerField(default=1)
+    modified_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            ## keyset pagination of the project lists (pagination.KeysetPagination)
+            models.Index(fields=['-created_at', '-id'], name='project_created_id_idx'),
+            ## home feed sections (latest / featured / top rated), partial on the non canceled
+            ## projects because sqlite filters booleans as "NOT is_canceled", not with an equality
+            models.Index(fields=['-created_at'], condition=models.Q(is_canceled=False), name='project_latest_idx'),
+            models.Index(fields=['-created_at'], condition=models.Q(is_canceled=False, is_featured=True), name='project_featured_idx'),
+            models.Index(fields=['-average_rating'], condition=models.Q(is_canceled=False), name='project_top_rated_idx'),
+            ## profile projects
+            models.Index(fields=['uid', '-created_at', '-id'], name='project_owner_created_idx'),
+        ]
+
+    ## counters are only changed through single row updates (add_donation / apply_rating),
+    ## saving a loaded project must not write their stale values back
+    COUNTER_FIELDS = (
+        'totalDonations', 'donations_count', 'last_donation_at',
+        'average_rating', 'rating_sum', 'rating_count',
+        'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5',
+        'version', 'modified_at',
+    )
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
@@ -119,12 +213,67 @@ class Projects(models.Model):
 
 
     def can_cancel(self):
-        total_donations = sum(donation.amount for donation in self.donations.all())
-        return total_donations < (self.totalTarget * 0.25)
-        
-    @property
-    def average_rating(self):
-        return self.ratings.aggregate(avg=models.Avg('score'))['avg'] or 0
+        return self.totalDonations < (self.totalTarget * 0.25)
+
+    ## add one donation to the running totals with a single row update
+    ## (F expressions so concurrent donors can't overwrite each other)
+    def add_donation(self, donation):
+        Projects.objects.filter(pk=self.pk).update(
+            totalDonations=models.F('totalDonations') + float(donation.amount),
+            donations_count=models.F('donations_count') + 1,
+            last_donation_at=Greatest(Coalesce(models.F('last_donation_at'), donation.created_at), donation.created_at),
+        )
+
+    ## an edited donation (admin, shell): only the amount difference moves
+    def change_donation_amount(self, old_amount, new_amount):
+        Projects.objects.filter(pk=self.pk).update(
+            totalDonations=Greatest(models.F('totalDonations') + (float(new_amount) - float(old_amount)), 0.0),
+        )
+
+    ## take a deleted donation out of the totals (also cascades, e.g. a deleted donor),
+    ## last_donation_at falls back to the newest remaining donation
+    def remove_donation(self, donation):
+        Projects.objects.filter(pk=self.pk).update(
+            totalDonations=Greatest(models.F('totalDonations') - float(donation.amount), 0.0),
+            donations_count=Greatest(models.F('donations_count') - 1, 0),
+            last_donation_at=models.Subquery(
+                Donation.objects.filter(project=models.OuterRef('pk')).order_by('-created_at').values('created_at')[:1]
+            ),
+        )
+
+    ## move one user's rating from old_score to new_score (None = no rating)
+    ## handles first rating, re-rate and removal with a single row update
+    def apply_rating(self, new_score=None, old_score=None):
+        if new_score == old_score:
+            return
+        sum_delta = (new_score or 0) - (old_score or 0)
+        count_delta = (new_score is not None) - (old_score is not None)
+        changes = {
+            'rating_sum': models.F('rating_sum') + sum_delta,
+            'rating_count': models.F('rating_count') + count_delta,
+            'average_rating': Coalesce(
+                Cast(models.F('rating_sum') + sum_delta, models.FloatField())
+                / NullIf(models.F('rating_count') + count_delta, 0),
+                0.0,
+            ),
+        }
+        if old_score is not None:
+            changes[f'stars_{old_score}'] = models.F(f'stars_{old_score}') - 1
+        if new_score is not None:
+            changes[f'stars_{new_score}'] = models.F(f'stars_{new_score}') + 1
+        Projects.objects.filter(pk=self.pk).update(**changes)
+
+    @classmethod
+    def bump_version(cls, project_id):
+        cls.bump_versions(cls.objects.filter(pk=project_id))
+
+    ## every project of the queryset in one UPDATE
+    @classmethod
+    def bump_versions(cls, projects):
+        projects.update(version=models.F('version') + 1, modified_at=timezone.now())
+
+    def rating_histogram(self):
+        return {str(score): getattr(self, f'stars_{score}') for score in range(1, 6)}
 
 
 
@@ -134,10 +283,41 @@ class Projects(models.Model):
 
     
 ## Projects Images 
+## raw uploads still carry their EXIF (GPS ...), they get a random name until processed
+def pending_upload_path(instance, filename):
+    return f"projects_Images/pending/{uuid.uuid4().hex}{os.path.splitext(filename)[1].lower()}"
+
+
 class ProjectImages(models.Model):
     project=models.ForeignKey('Projects',related_name='images',on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='projects_Images/')
+    image = models.ImageField(upload_to=pending_upload_path)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    ## the upload is kept as is until the process_images command has made the variants,
+    ## then image points at the EXIF stripped full size variant (see images.py)
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    )
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING, db_index=True)
+    ## a process_images worker owns the row until locked_until (then another one may retry it)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    thumbnail = models.ImageField(upload_to='projects_Images/', blank=True)
+    card = models.ImageField(upload_to='projects_Images/', blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    processing_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            ## process_images: expired leases to take over, oldest first
+            models.Index(fields=['status', 'locked_until'], name='projectimage_lease_idx'),
+        ]
     
     #####################################
 
@@ -149,6 +329,17 @@ class Donation(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', '-created_at'], name='donation_project_created_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='donation_user_created_idx'),
+        ]
+
+    ## the post_save signal moves the project totals and rollups, they commit with the row
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.user.email} donated {self.amount} to {self.project.title}"
     #######################################3
@@ -158,6 +349,52 @@ class Comment(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies') # الجزء دة عشان ال replay on comments  self relation
+    ## materialized path tree: root = top level comment of the thread (null for top level),
+    ## path = zero padded ids from the root down, so ordering by path gives the thread in order
+    root = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='thread_comments')
+    path = models.CharField(max_length=255, blank=True, db_index=True)
+    depth = models.PositiveSmallIntegerField(default=0)
+    reply_count = models.PositiveIntegerField(default=0)
+
+    PATH_STEP = 10
+    ## deepest reply whose path (PATH_STEP digits + '/' per level) still fits in the column
+    MAX_DEPTH = path.max_length // (PATH_STEP + 1) - 1
+
+    class Meta:
+        indexes = [
+            ## CommentListView: top level comments of a project, newest first
+            models.Index(fields=['project', 'parent', '-created_at', '-id'], name='comment_project_thread_idx'),
+            ## Comment.reply_map: whole threads in path order
+            models.Index(fields=['root', 'path'], name='comment_root_path_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            parent = self.parent
+            if parent:
+                self.root_id = parent.root_id or parent.pk
+                self.depth = parent.depth + 1
+            super().save(*args, **kwargs)
+            self.path = (parent.path if parent else '') + str(self.pk).zfill(self.PATH_STEP) + '/'
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+            if parent:
+                Comment.objects.filter(pk=parent.pk).update(reply_count=models.F('reply_count') + 1)
+
+    ## all replies under the given top level comments down to max_depth, in one query
+    ## returns {parent_id: [replies in thread order]}
+    @classmethod
+    def reply_map(cls, roots, max_depth):
+        replies = {}
+        root_ids = [root.pk for root in roots if root.reply_count]
+        if not root_ids or max_depth < 1:
+            return replies
+        thread = cls.objects.filter(root__in=root_ids, depth__lte=max_depth) \
+            .select_related('user').order_by('root', 'path')
+        for comment in thread:
+            replies.setdefault(comment.parent_id, []).append(comment)
+        return replies
 
     def __str__(self):
         return f"Comment by {self.user.email} on {self.project.title}"
@@ -188,6 +425,67 @@ class Rating(models.Model):
     class Meta:
         unique_together = ['project', 'user'] # عشان اليوزر مايقيمش نفس المشروع مرتين
 
+    ## the post_save signal moves the project's rating aggregates, they commit with the row
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.user.email} rated {self.project.title} {self.score}"
-    
\ No newline at end of file
+    
+    ##############################
+## Home feed snapshot (one pre serialized row per home page section)
+class HomeFeedSection(models.Model):
+    name = models.CharField(max_length=30, unique=True)
+    project_ids = models.JSONField(default=list)
+    payload = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+    ## writes only mark the section (changes since the last rebuild, oldest of them),
+    ## refresh_home_feed rebuilds it once for all of them (see home_feed.py)
+    pending = models.PositiveIntegerField(default=0)
+    dirty_since = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Home feed section {self.name}"
+
+
+## precomputed "similar projects" (top neighbours by weighted tag overlap, see similarity.py)
+class SimilarProject(models.Model):
+    project = models.ForeignKey(Projects, on_delete=models.CASCADE, related_name='similar_projects')
+    similar = models.ForeignKey(Projects, on_delete=models.CASCADE, related_name='similar_of')
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ['project', 'similar']
+        indexes = [models.Index(fields=['project', '-score'])]
+
+    def __str__(self):
+        return f"{self.similar_id} similar to {self.project_id} ({self.score:.2f})"
+
+
+## donations per project and time bucket, maintained on every donation (see rollups.py)
+## so funding charts read a few small rows instead of scanning Donation
+class DonationRollup(models.Model):
+    project = models.ForeignKey(Projects, on_delete=models.CASCADE)
+    bucket = models.DateTimeField()
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+    donors = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+        unique_together = ['project', 'bucket']
+
+    def __str__(self):
+        return f"{self.project_id} {self.bucket:%Y-%m-%d %H:%M}: {self.amount} ({self.count})"
+
+
+class HourlyDonationRollup(DonationRollup):
+    class Meta(DonationRollup.Meta):
+        pass
+
+
+class DailyDonationRollup(DonationRollup):
+    class Meta(DonationRollup.Meta):
+        pass
+
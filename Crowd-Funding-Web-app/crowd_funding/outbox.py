@@ -0,0 +1,89 @@
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import OutboxEmail
+
+MAX_ATTEMPTS = 6
+## retry after 30s, 1m, 2m, 4m ... capped at one hour
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAX = timedelta(hours=1)
+## how long a worker may hold a claimed row before another worker can take it over
+LEASE = timedelta(minutes=5)
+
+
+## call inside the transaction that creates the row the email is about,
+## so the email exists if and only if that row was committed
+def queue_mail(subject, message, recipient_list, from_email=None):
+    return OutboxEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(recipient_list),
+    )
+
+
+def backoff(attempts):
+    return min(BACKOFF_BASE * (2 ** (attempts - 1)), BACKOFF_MAX)
+
+
+## claim up to batch_size due emails for this worker with one conditional UPDATE
+def claim_batch(worker_id, batch_size):
+    now = timezone.now()
+    due = OutboxEmail.objects.filter(status=OutboxEmail.PENDING, next_attempt_at__lte=now) \
+        .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+    ids = list(due.order_by('next_attempt_at').values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return []
+    due.filter(pk__in=ids).update(locked_by=worker_id, locked_until=now + LEASE)
+    return list(OutboxEmail.objects.filter(pk__in=ids, locked_by=worker_id))
+
+
+def send_batch(emails, connection):
+    sent = 0
+    for email in emails:
+        message = EmailMessage(
+            subject=email.subject, body=email.body, from_email=email.from_email,
+            to=email.to, connection=connection,
+        )
+        try:
+            message.send()
+        except Exception as exc:
+            attempts = email.attempts + 1
+            OutboxEmail.objects.filter(pk=email.pk).update(
+                attempts=F('attempts') + 1,
+                status=OutboxEmail.FAILED if attempts >= MAX_ATTEMPTS else OutboxEmail.PENDING,
+                next_attempt_at=timezone.now() + backoff(attempts),
+                last_error=repr(exc),
+                locked_by='', locked_until=None,
+            )
+            ## the connection may be broken now, the next send reopens it
+            connection.close()
+        else:
+            OutboxEmail.objects.filter(pk=email.pk).update(
+                status=OutboxEmail.SENT, sent_at=timezone.now(),
+                attempts=F('attempts') + 1, locked_by='', locked_until=None,
+            )
+            sent += 1
+    return sent
+
+
+## send everything that is due, reusing one (SMTP) connection across batches
+def drain(batch_size=50, worker_id=None, connection=None):
+    worker_id = worker_id or uuid.uuid4().hex
+    connection = connection or get_connection()
+    sent = failed = 0
+    try:
+        while True:
+            emails = claim_batch(worker_id, batch_size)
+            if not emails:
+                break
+            connection.open()
+            batch_sent = send_batch(emails, connection)
+            sent += batch_sent
+            failed += len(emails) - batch_sent
+    finally:
+        connection.close()
+    return sent, failed
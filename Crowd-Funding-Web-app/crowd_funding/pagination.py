@@ -0,0 +1,119 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+## cursor on created_at: no COUNT(*) / OFFSET, and pages stay stable while new rows arrive
+class CreatedAtCursorPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+
+
+class CommentCursorPagination(CreatedAtCursorPagination):
+    pass
+
+
+## always the first page, whatever cursor the outer request carries
+class FirstPagePagination(CreatedAtCursorPagination):
+    page_size_query_param = None
+
+    def decode_cursor(self, request):
+        return None
+
+
+## first page of a sub-resource embedded in another response,
+## the next link points at the sub-resource itself (url_name)
+def first_page(request, queryset, url_name, page_size):
+    paginator = FirstPagePagination()
+    paginator.page_size = page_size
+    page = paginator.paginate_queryset(queryset, request)
+    paginator.base_url = request.build_absolute_uri(reverse(url_name))
+    return page, paginator.get_next_link()
+
+
+## keyset pagination over (created_at, id), newest first: the cursor is the last row's
+## (created_at, id) so every page is one index range scan, no COUNT(*) and no OFFSET.
+## Opt in per request with ?cursor (empty for the first page), everything else gets
+## legacy_pagination_class (?page=N, with count) in the view queryset's own order.
+class KeysetPagination(BasePagination):
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', '-id')
+    legacy_pagination_class = PageNumberPagination
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.legacy = None
+        if self.legacy_pagination_class and self.cursor_query_param not in request.query_params:
+            self.legacy = self.legacy_pagination_class()
+            return self.legacy.paginate_queryset(self.stable_order(queryset), request, view)
+
+        queryset = queryset.order_by(*self.ordering)
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        if position:
+            created_at, pk = position
+            queryset = queryset.filter(created_at__lte=created_at) \
+                .filter(Q(created_at__lt=created_at) | Q(id__lt=pk))
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.last = rows[-1] if rows else None
+        return rows
+
+    ## the queryset's ordering (the table order when it has none) with id as the
+    ## tiebreaker, so ?page=N pages neither repeat nor skip rows
+    @staticmethod
+    def stable_order(queryset):
+        ordering = list(queryset.query.order_by or (queryset.model._meta.ordering if queryset.query.default_ordering else []))
+        if not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering.append('id')
+        return queryset.order_by(*ordering)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            created_at, pk = urlsafe_b64decode(encoded.encode()).decode().rsplit('|', 1)
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
+
+    def encode_cursor(self, row):
+        return urlsafe_b64encode(f"{row.created_at.isoformat()}|{row.pk}".encode()).decode()
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last))
+
+    def get_paginated_response(self, data):
+        if self.legacy:
+            return self.legacy.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
@@ -0,0 +1,29 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+## JSONRenderer output (compact, UTF-8) encoded by orjson when it is installed.
+## Pretty printed / ASCII output (browsable API, ?indent=) and a missing orjson use JSONRenderer.
+class ORJSONRenderer(JSONRenderer):
+    ## datetimes go through DRF's encoder too, it writes UTC as 'Z'
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+
+    def __init__(self):
+        self.encoder = self.encoder_class()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if orjson is None or indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        ## Decimal, lazy strings, querysets ... use DRF's encoder as well
+        ret = orjson.dumps(data, default=self.encoder.default, option=self.options)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
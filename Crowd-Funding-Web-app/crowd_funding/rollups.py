@@ -0,0 +1,92 @@
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from .models import Donation, HourlyDonationRollup, DailyDonationRollup
+
+## period -> (rollup model, bucket length)
+PERIODS = {
+    'hour': (HourlyDonationRollup, timedelta(hours=1)),
+    'day': (DailyDonationRollup, timedelta(days=1)),
+}
+
+TOTALS = {
+    'total_amount': Sum('amount'),
+    'total_count': Count('id'),
+    'total_donors': Count('user', distinct=True),
+}
+
+
+## start of the bucket holding moment, in the current time zone like Trunc()
+def bucket_start(moment, period):
+    moment = timezone.localtime(moment)
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    if period == 'day':
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def bucket_donations(project_id, period, start):
+    return Donation.objects.filter(project_id=project_id, created_at__gte=start, created_at__lt=start + PERIODS[period][1])
+
+
+## one new donation: a single row update per period (a new bucket row the first time)
+def add_donation(donation):
+    for period, (model, _) in PERIODS.items():
+        start = bucket_start(donation.created_at, period)
+        new_donor = not bucket_donations(donation.project_id, period, start) \
+            .filter(user_id=donation.user_id).exclude(pk=donation.pk).exists()
+        changes = {'amount': F('amount') + donation.amount, 'count': F('count') + 1}
+        if new_donor:
+            changes['donors'] = F('donors') + 1
+        if model.objects.filter(project_id=donation.project_id, bucket=start).update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                model.objects.create(
+                    project_id=donation.project_id, bucket=start,
+                    amount=donation.amount, count=1, donors=1,
+                )
+        except IntegrityError:
+            ## another donation created the bucket first
+            model.objects.filter(project_id=donation.project_id, bucket=start).update(**changes)
+
+
+## deleted / edited donation: recount its buckets (they are small), never create rows
+## here because the project itself may be being deleted
+def recount_donation(donation):
+    for period, (model, _) in PERIODS.items():
+        start = bucket_start(donation.created_at, period)
+        totals = bucket_donations(donation.project_id, period, start).aggregate(**TOTALS)
+        rollup = model.objects.filter(project_id=donation.project_id, bucket=start)
+        if totals['total_count']:
+            rollup.update(amount=totals['total_amount'], count=totals['total_count'], donors=totals['total_donors'])
+        else:
+            rollup.delete()
+
+
+## recompute every bucket of these projects from Donation (backfill_donation_rollups)
+def rebuild(project_ids, batch_size=1000):
+    rows = 0
+    for period, (model, _) in PERIODS.items():
+        model.objects.filter(project_id__in=project_ids).delete()
+        totals = Donation.objects.filter(project_id__in=project_ids) \
+            .annotate(bucket=Trunc('created_at', period)) \
+            .values('project_id', 'bucket').annotate(**TOTALS).order_by()
+        rollups = [
+            model(
+                project_id=row['project_id'], bucket=row['bucket'],
+                amount=row['total_amount'], count=row['total_count'], donors=row['total_donors'],
+            )
+            for row in totals.iterator()
+        ]
+        model.objects.bulk_create(rollups, batch_size=batch_size)
+        rows += len(rollups)
+    return rows
+
+
+def series(project_id, period, since, until):
+    model = PERIODS[period][0]
+    return model.objects.filter(project_id=project_id, bucket__gte=since, bucket__lt=until) \
+        .order_by('bucket').values('bucket', 'amount', 'count', 'donors')
@@ -0,0 +1,155 @@
+import hashlib
+import random
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+
+## Primary / replica routing: DATABASE_REPLICAS = ['replica_1', ...] in settings.
+## Replicas are only used inside a request that ReplicaRoutingMiddleware allowed:
+## safe methods (GET / HEAD / OPTIONS) from a client that hasn't written in the last
+## REPLICA_PIN_SECONDS. Everything else (writes, the reads of a write request,
+## management commands, signals outside a request) stays on the primary.
+## The first write of a request pins the rest of it, and the client, to the primary
+## so a donor reads their own donation even when the replica lags.
+## The pins live in CACHES[REPLICA_PIN_CACHE], which every worker must share: a pin kept
+## in one process is missing when the client's next read lands on another.
+PRIMARY = 'default'
+PIN_CACHE_PREFIX = 'replica-pin:'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RoutingState:
+    def __init__(self, replica=None):
+        self.replica = replica
+        self.wrote = False
+
+
+_state = ContextVar('replica_routing', default=None)
+
+
+def replicas():
+    return [alias for alias in getattr(settings, 'DATABASE_REPLICAS', ()) if alias in connections]
+
+
+def pin_cache_alias():
+    return getattr(settings, 'REPLICA_PIN_CACHE', 'default')
+
+
+def pin_cache():
+    return caches[pin_cache_alias()]
+
+
+@checks.register(checks.Tags.caches)
+def check_pin_cache(app_configs, **kwargs):
+    if not getattr(settings, 'DATABASE_REPLICAS', ()):
+        return []
+    alias = pin_cache_alias()
+    if alias not in settings.CACHES:
+        return [checks.Error(
+            f"REPLICA_PIN_CACHE = {alias!r} isn't in CACHES",
+            hint="Add a shared cache (redis / memcached / database) for the replica pins",
+            id='crowd_funding.E001',
+        )]
+    if isinstance(caches[alias], (LocMemCache, DummyCache)):
+        return [checks.Error(
+            f"Replica pins need a cache shared by every worker, CACHES[{alias!r}] is per process",
+            hint=(
+                "Point REPLICA_PIN_CACHE at a redis / memcached / database cache, a client that wrote "
+                "would read a lagging replica from the other workers (silence crowd_funding.E002 for "
+                "a single process dev server)"
+            ),
+            id='crowd_funding.E002',
+        )]
+    return []
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.replica is None or state.wrote:
+            return PRIMARY
+        ## reads inside a transaction on the primary must see its writes
+        if connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {PRIMARY, *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    ## replicas are copies of the primary (replicate_sqlite), never migrated on their own
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+## everything that identifies the client: the token / session, else its address
+def client_keys(request):
+    keys = []
+    for value in (request.META.get('HTTP_AUTHORIZATION'), request.COOKIES.get(settings.SESSION_COOKIE_NAME)):
+        if value:
+            keys.append(PIN_CACHE_PREFIX + hashlib.sha1(value.encode()).hexdigest())
+    ## by address only when nothing else is known (login / register), a shared proxy
+    ## address would pin every client
+    address = PIN_CACHE_PREFIX + 'addr:' + request.META.get('REMOTE_ADDR', '')
+    return keys, address
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        keys, address = client_keys(request)
+        pinned = self.may_use_replica(request) and bool(pin_cache().get_many([*keys, address]))
+        token = _state.set(self.start(request, pinned))
+        try:
+            response = self.get_response(request)
+            if _state.get().wrote:
+                pin_cache().set_many(dict.fromkeys(keys or [address], True), self.pin_seconds())
+        finally:
+            _state.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        keys, address = client_keys(request)
+        pinned = self.may_use_replica(request) and bool(await pin_cache().aget_many([*keys, address]))
+        token = _state.set(self.start(request, pinned))
+        try:
+            response = await self.get_response(request)
+            if _state.get().wrote:
+                await pin_cache().aset_many(dict.fromkeys(keys or [address], True), self.pin_seconds())
+        finally:
+            _state.reset(token)
+        return response
+
+    def may_use_replica(self, request):
+        return request.method in SAFE_METHODS and bool(replicas())
+
+    ## one replica for the whole request, so its reads are consistent with each other
+    def start(self, request, pinned):
+        if pinned or not self.may_use_replica(request):
+            return RoutingState()
+        return RoutingState(random.choice(replicas()))
+
+    def pin_seconds(self):
+        return getattr(settings, 'REPLICA_PIN_SECONDS', 5)
@@ -0,0 +1,131 @@
+import re
+from django.db import connection, OperationalError
+from .models import Projects
+
+## SQLite FTS5 index over the searchable text of each project (rowid = project id).
+## On other databases (or SQLite builds without FTS5) ProjectSearchView keeps using SearchFilter.
+FTS_TABLE = 'crowd_funding_project_fts'
+## bm25 column weights: title, details, category, tags
+RANK_WEIGHTS = (10.0, 1.0, 2.0, 5.0)
+
+_available = None
+
+
+def is_available():
+    global _available
+    if _available is None:
+        _available = connection.vendor == 'sqlite' and _has_fts5()
+    return _available
+
+
+def _has_fts5():
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            return bool(cursor.fetchone()[0])
+    except OperationalError:
+        return False
+
+
+def create_index():
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            "USING fts5(title, details, category, tags, tokenize='unicode61 remove_diacritics 2')"
+        )
+
+
+## (re)write the index rows of the given projects from the current database state
+def index_projects(project_ids):
+    if not is_available() or not project_ids:
+        return
+    project_ids = list(project_ids)
+    projects = Projects.objects.filter(pk__in=project_ids).select_related('category') \
+        .prefetch_related('tags').only('id', 'title', 'details', 'category__name')
+    rows = [
+        (
+            project.pk,
+            project.title,
+            project.details,
+            project.category.name if project.category else '',
+            ' '.join(tag.name for tag in project.tags.all()),
+        )
+        for project in projects
+    ]
+    with connection.cursor() as cursor:
+        remove_projects(project_ids, cursor)
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, title, details, category, tags) VALUES (%s, %s, %s, %s, %s)",
+            rows,
+        )
+
+
+def remove_projects(project_ids, cursor=None):
+    if not is_available() or not project_ids:
+        return
+    if cursor is None:
+        with connection.cursor() as cursor:
+            return remove_projects(project_ids, cursor)
+    cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(pk,) for pk in project_ids])
+
+
+## every word of the user input must match, the last one (or all with prefix=True) as a prefix
+def build_match(term, prefix=True):
+    words = re.findall(r'\w+', term)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' if prefix else f'"{word}"' for word in words)
+
+
+## lazy, sliceable result list so DRF / Django paginators can page it:
+## count() and each slice are one indexed FTS query, projects are loaded per page only
+class SearchResults:
+    def __init__(self, term, queryset=None):
+        self.match = build_match(term)
+        self.queryset = queryset if queryset is not None else Projects.objects.all()
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            if self.match is None:
+                self._count = 0
+            else:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [self.match])
+                    self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def ranked_ids(self, offset, limit):
+        if self.match is None or limit <= 0:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY bm25({FTS_TABLE}, %s, %s, %s, %s) LIMIT %s OFFSET %s",
+                [self.match, *RANK_WEIGHTS, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        stop = key.stop if key.stop is not None else self.count()
+        ids = self.ranked_ids(start, stop - start)
+        projects = self.queryset.in_bulk(ids)
+        return [projects[pk] for pk in ids if pk in projects]
+
+
+## only the ranked ids of a page, for callers that load the rows themselves (fastpath.project_rows)
+class SearchResultIds(SearchResults):
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        stop = key.stop if key.stop is not None else self.count()
+        return self.ranked_ids(start, stop - start)
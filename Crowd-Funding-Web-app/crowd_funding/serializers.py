@@ -1,9 +1,14 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth.backends import ModelBackend
+from django.db import transaction
 from .models import *
+from .pagination import first_page
+from . import fieldsets
+from django.db.models import Count, Sum
 import re
 import project
 
@@ -99,7 +104,19 @@ class TagSerializer(serializers.ModelSerializer):
 class ProjectImagesSerializer(serializers.ModelSerializer):
     class Meta:
         model=ProjectImages
-        fields=['id','image','uploaded_at']
+        fields=['id','image','thumbnail','card','status','uploaded_at']
+        read_only_fields=['thumbnail','card','status']
+
+    ## the raw upload (EXIF and all) is never linked, a placeholder until it is processed
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.status != ProjectImages.READY:
+            request = self.context.get('request')
+            placeholder = settings.PROJECT_IMAGE_PLACEHOLDER
+            if placeholder and request:
+                placeholder = request.build_absolute_uri(placeholder)
+            data.update(dict.fromkeys(['image', 'thumbnail', 'card'], placeholder))
+        return data
 ## project serializer
 
 class ProjectSerializer(serializers.ModelSerializer):
@@ -116,51 +133,91 @@ class ProjectSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True) 
     images = ProjectImagesSerializer(many=True, read_only=True)
 
-    avg_rating = serializers.FloatField(read_only=True, default=0)
+    avg_rating = serializers.FloatField(source='average_rating', read_only=True)
+    rating_histogram = serializers.DictField(read_only=True)
+
+    ## compact card fields, only sent when asked for with ?fields= / ?expand= (see fieldsets.py)
+    excerpt = serializers.SerializerMethodField()
+    progress = serializers.SerializerMethodField()
+    cover = serializers.SerializerMethodField()
+    OPTIONAL_FIELDS = ('excerpt', 'progress', 'cover')
 
     class Meta:
         model = Projects
-        fields = '__all__' 
+        exclude = ['stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5']
         extra_kwargs = {
-            'uid': {'read_only': True}
+            'uid': {'read_only': True},
+            'totalDonations': {'read_only': True},
+            'donations_count': {'read_only': True},
+            'last_donation_at': {'read_only': True},
+            'average_rating': {'read_only': True},
+            'rating_sum': {'read_only': True},
+            'rating_count': {'read_only': True},
+            'version': {'read_only': True},
+            'modified_at': {'read_only': True},
         }
 
+    ## the view puts the parsed ?fields= / ?expand= in the context
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        keep = fieldsets.selected(
+            list(self.fields), self.OPTIONAL_FIELDS, self.context.get('fields'), self.context.get('expand', ()),
+        )
+        for name in list(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
+
+    def get_excerpt(self, obj):
+        text = getattr(obj, 'details_excerpt', None)
+        if text is None:
+            text = obj.details
+        if len(text) > fieldsets.EXCERPT_LENGTH:
+            return text[:fieldsets.EXCERPT_LENGTH].rstrip() + '…'
+        return text
+
+    def get_progress(self, obj):
+        if not obj.totalTarget:
+            return 0
+        return round(obj.totalDonations / obj.totalTarget * 100, 1)
+
+    ## thumbnail of the first processed image
+    def get_cover(self, obj):
+        for image in obj.images.all():
+            if image.status == ProjectImages.READY and image.thumbnail:
+                request = self.context.get('request')
+                return request.build_absolute_uri(image.thumbnail.url) if request else image.thumbnail.url
+        return None
+
     def create(self, validated_data):
         # Extract category and tags from the validated data
         category = validated_data.pop('category')
         # tags = validated_data.pop('tags')
         tags=self.initial_data.getlist('tags')
-        category_obj, _ = Category.objects.get_or_create(name=category)
-        # Create the project instance
-        
-
-        # Get or create each tag (handle SlugRelatedField 'name')
-        new_tags = []
-        for tag in tags:
-            tag_obj, _ = Tag.objects.get_or_create(name=tag)
-            new_tags.append(tag_obj)
-        
-        project = Projects.objects.create(category=category_obj, **validated_data)
-        project.tags.set(new_tags)
-        # Handle image uploads
-        request = self.context.get('request')
-        if request and hasattr(request, 'FILES'):
-            images = request.FILES.getlist('images')
-            for image in images:
-                ProjectImages.objects.create(project=project, image=image)
+        ## one transaction: the after commit work (home feed, search index) runs once
+        with transaction.atomic():
+            category_obj, _ = Category.objects.get_or_create(name=category)
+            # Create the project instance
+
+            # Get or create each tag (handle SlugRelatedField 'name')
+            new_tags = []
+            for tag in tags:
+                tag_obj, _ = Tag.objects.get_or_create(name=tag)
+                new_tags.append(tag_obj)
+
+            project = Projects.objects.create(category=category_obj, **validated_data)
+            project.tags.set(new_tags)
+            # Handle image uploads
+            request = self.context.get('request')
+            if request and hasattr(request, 'FILES'):
+                images = request.FILES.getlist('images')
+                for image in images:
+                    ProjectImages.objects.create(project=project, image=image)
         return project
     ##log errors
     def to_internal_value(self, data):
         print("Incoming data to ProjectSerializer:", data)
         return super().to_internal_value(data)
 
-    def get_average_rating(self, obj):
-        ratings = obj.ratings.all()  
-        if ratings.exists():
-            return round(sum(r.score for r in ratings) / ratings.count(), 1)
-
-        return None  
-
 
     ##################################
     # Project Details
@@ -177,18 +234,34 @@ class DonationSerializer(serializers.ModelSerializer):
 
 class CommentSerializer(serializers.ModelSerializer):
     user = UserProfileSerializer(read_only=True)
-    project = ProjectSerializer(read_only=True)
+    project = serializers.PrimaryKeyRelatedField(read_only=True)
     replies = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
-        fields = ['id', 'project', 'user', 'content', 'created_at', 'parent', 'replies']
-        read_only_fields = ['user', 'created_at']
+        fields = ['id', 'project', 'user', 'content', 'created_at', 'parent', 'depth', 'reply_count', 'replies']
+        read_only_fields = ['user', 'created_at', 'depth', 'reply_count']
 
+    def validate_parent(self, value):
+        if value and value.depth >= Comment.MAX_DEPTH:
+            raise serializers.ValidationError(f"Replies can't be nested more than {Comment.MAX_DEPTH} levels deep.")
+        return value
+
+    ## CommentListView loads the replies of a whole page at once (Comment.reply_map)
+    ## and passes them in the context, otherwise the subtree is loaded in one query here
     def get_replies(self, obj):
-        if obj.replies.exists():
-            return CommentSerializer(obj.replies.all(), many=True).data
-        return []
+        if not obj.reply_count:
+            return []
+        context = self.context
+        if context.get('reply_map') is None:
+            reply_map = {}
+            subtree = Comment.objects.filter(
+                root=obj.root_id or obj.pk, path__startswith=obj.path, depth__gt=obj.depth
+            ).select_related('user').order_by('path')
+            for comment in subtree:
+                reply_map.setdefault(comment.parent_id, []).append(comment)
+            context = dict(context, reply_map=reply_map)
+        return CommentSerializer(context['reply_map'].get(obj.pk, []), many=True, context=context).data
 
 class ReportSerializer(serializers.ModelSerializer):
     user = UserProfileSerializer(read_only=True)
@@ -236,21 +309,45 @@ class ExtraInfoSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 class UserProfileSerializer(serializers.ModelSerializer):
+    stats = serializers.SerializerMethodField()
     projects = serializers.SerializerMethodField()
     donations = serializers.SerializerMethodField()
     extra_info = ExtraInfoSerializer(read_only=True)
 
+    ## only the newest items are embedded, the rest come from
+    ## profile/projects/ and profile/donations/ (cursor paginated)
+    PREVIEW_SIZE = 5
+
     class Meta:
         model = User
-        fields = ['id', 'first_name', 'last_name', 'email', 'mobile_phone', 'profile_picture', 'extra_info','projects', 'donations']
+        fields = ['id', 'first_name', 'last_name', 'email', 'mobile_phone', 'profile_picture', 'extra_info', 'stats', 'projects', 'donations']
+
+    def get_stats(self, obj):
+        donations = Donation.objects.filter(user=obj).aggregate(count=Count('id'), total=Sum('amount'))
+        return {
+            'projects_count': Projects.objects.filter(uid=obj).count(),
+            'donations_count': donations['count'],
+            'donations_total': donations['total'] or 0,
+        }
 
     def get_projects(self, obj):
-        user_projects = Projects.objects.filter(uid=obj)
-        return ProjectSerializer(user_projects, many=True, context=self.context).data
+        user_projects = Projects.objects.filter(uid=obj).select_related('category').prefetch_related('tags', 'images')
+        return self.preview(user_projects, ProjectSerializer, 'profile-projects')
 
     def get_donations(self, obj):
-        user_donations = Donation.objects.filter(user=obj)
-        return DonationSerializer(user_donations, many=True, context=self.context).data
+        user_donations = Donation.objects.filter(user=obj).select_related('user')
+        return self.preview(user_donations, DonationSerializer, 'profile-donations')
+
+    def preview(self, queryset, serializer_class, url_name):
+        request = self.context.get('request')
+        if request is None:
+            page, next_link = queryset.order_by('-created_at', '-id')[:self.PREVIEW_SIZE], None
+        else:
+            page, next_link = first_page(request, queryset, url_name, self.PREVIEW_SIZE)
+        return {
+            'results': serializer_class(page, many=True, context=self.context).data,
+            'next': next_link,
+        }
 
 class UpdateUserProfileSerializer(serializers.ModelSerializer):
     new_password = serializers.CharField(write_only=True, required=False)
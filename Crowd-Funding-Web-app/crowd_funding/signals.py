@@ -0,0 +1,229 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed, post_migrate
+from django.dispatch import receiver
+from django.db.models import F
+from rest_framework.authtoken.models import Token
+from .models import User, Projects, ProjectImages, Donation, Rating, Comment, Category, Tag
+from .authentication import invalidate_token
+from . import home_feed, rollups, search, similarity
+from .fastpath import COMMENT_USER_FIELDS
+
+
+## after commit work, coalesced per transaction: one call with every item the
+## transaction's writes added (a project create saves the row, its tags and images)
+class _Batch:
+    def __init__(self, func):
+        self.func = func
+        self.items = set()
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        self.func(self.items)
+
+
+## merged with a batch of the same (save)point of the transaction only, so a rolled
+## back savepoint never takes items of the outer transaction with it
+def _on_commit_batched(func, items):
+    connection = transaction.get_connection()
+    ## atomic(savepoint=False) blocks add None
+    savepoint_ids = set(connection.savepoint_ids) - {None}
+    for sids, callback, _ in connection.run_on_commit:
+        if isinstance(callback, _Batch) and callback.func is func and not callback.done and sids - {None} == savepoint_ids:
+            callback.items.update(items)
+            return
+    batch = _Batch(func)
+    batch.items.update(items)
+    transaction.on_commit(batch)
+
+
+## home feed sections showing the project (plus the given ones) are marked,
+## refresh_home_feed rebuilds them (see home_feed.py)
+def _refresh_home_feed(project_id, sections=()):
+    _on_commit_batched(home_feed.mark_dirty, [(project_id, None), *((project_id, name) for name in sections)])
+
+
+## full text index rows are rewritten after commit too
+def _reindex(project_ids):
+    _on_commit_batched(search.index_projects, project_ids)
+
+
+## as are the similar projects neighbours of a project whose tags / category changed
+def _update_similar(project_ids):
+    _on_commit_batched(_update_similar_now, project_ids)
+
+
+def _update_similar_now(project_ids):
+    for project_id in project_ids:
+        similarity.update_project(project_id)
+
+
+## ETag / Last-Modified of the project's reads change with the write itself
+def _bump_version(project_ids):
+    for project_id in project_ids:
+        Projects.bump_version(project_id)
+
+
+@receiver(post_migrate)
+def create_search_index(sender, **kwargs):
+    if sender.name == 'crowd_funding':
+        search.create_index()
+
+
+@receiver(post_save, sender=Projects)
+def project_saved(sender, instance, created, **kwargs):
+    ## a new / edited project can enter any section
+    _refresh_home_feed(instance.pk, home_feed.SECTIONS)
+    _reindex([instance.pk])
+    if not created:
+        _update_similar([instance.pk])
+        _bump_version([instance.pk])
+
+
+@receiver(post_delete, sender=Projects)
+def project_deleted(sender, instance, **kwargs):
+    _refresh_home_feed(instance.pk)
+    project_id = instance.pk
+    transaction.on_commit(lambda: search.remove_projects([project_id]))
+
+
+@receiver(m2m_changed, sender=Projects.tags.through)
+def project_tags_changed(sender, instance, action, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if isinstance(instance, Projects):
+        _refresh_home_feed(instance.pk)
+        _reindex([instance.pk])
+        _update_similar([instance.pk])
+        _bump_version([instance.pk])
+    elif pk_set:
+        ## tag.projects_set.add(...) from the tag side
+        _reindex(pk_set)
+        _update_similar(pk_set)
+        _bump_version(pk_set)
+
+
+## category / tag names are part of every project read that shows them
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    if not created:
+        _reindex(Projects.objects.filter(category=instance).values_list('pk', flat=True))
+        Projects.bump_versions(Projects.objects.filter(category=instance))
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, **kwargs):
+    if not created:
+        _reindex(Projects.objects.filter(tags=instance).values_list('pk', flat=True))
+        Projects.bump_versions(Projects.objects.filter(tags=instance))
+
+
+@receiver([post_save, post_delete], sender=ProjectImages)
+def project_image_changed(sender, instance, **kwargs):
+    _refresh_home_feed(instance.project_id)
+    _bump_version([instance.project_id])
+
+
+@receiver([post_save, post_delete], sender=Donation)
+def donation_changed(sender, instance, **kwargs):
+    _refresh_home_feed(instance.project_id)
+    _bump_version([instance.project_id])
+
+
+## the project totals and the hourly / daily donation rollups move with every donation
+## saved or deleted, whatever the code path (API, admin, shell), in the same transaction
+@receiver(pre_save, sender=Donation)
+def donation_saving(sender, instance, **kwargs):
+    instance._saved = None
+    if not instance._state.adding:
+        instance._saved = Donation.objects.filter(pk=instance.pk).only('project_id', 'user_id', 'amount', 'created_at').first()
+
+
+@receiver(post_save, sender=Donation)
+def donation_saved(sender, instance, created, **kwargs):
+    saved = getattr(instance, '_saved', None)
+    if created or saved is None:
+        Projects(pk=instance.project_id).add_donation(instance)
+        rollups.add_donation(instance)
+    elif saved.project_id != instance.project_id:
+        Projects(pk=saved.project_id).remove_donation(saved)
+        rollups.recount_donation(saved)
+        Projects(pk=instance.project_id).add_donation(instance)
+        rollups.add_donation(instance)
+    elif saved.amount != instance.amount:
+        Projects(pk=instance.project_id).change_donation_amount(saved.amount, instance.amount)
+        rollups.recount_donation(instance)
+
+
+@receiver(post_delete, sender=Donation)
+def donation_deleted(sender, instance, **kwargs):
+    Projects(pk=instance.project_id).remove_donation(instance)
+    rollups.recount_donation(instance)
+
+
+@receiver([post_save, post_delete], sender=Rating)
+def rating_changed(sender, instance, **kwargs):
+    _refresh_home_feed(instance.project_id, ['top_rated_projects'])
+    _bump_version([instance.project_id])
+
+
+## the project's rating aggregates move with every rating saved or deleted, whatever
+## the code path (API, admin, shell, cascades from a deleted user)
+@receiver(pre_save, sender=Rating)
+def rating_saving(sender, instance, **kwargs):
+    instance._saved = None
+    if not instance._state.adding:
+        instance._saved = Rating.objects.filter(pk=instance.pk).only('project_id', 'score').first()
+
+
+@receiver(post_save, sender=Rating)
+def rating_saved(sender, instance, created, **kwargs):
+    saved = getattr(instance, '_saved', None)
+    if created or saved is None:
+        Projects(pk=instance.project_id).apply_rating(instance.score)
+    elif saved.project_id != instance.project_id:
+        Projects(pk=saved.project_id).apply_rating(None, saved.score)
+        Projects(pk=instance.project_id).apply_rating(instance.score)
+    else:
+        Projects(pk=instance.project_id).apply_rating(instance.score, saved.score)
+
+
+@receiver(post_delete, sender=Rating)
+def rating_deleted(sender, instance, **kwargs):
+    Projects(pk=instance.project_id).apply_rating(None, instance.score)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance.parent_id:
+        Comment.objects.filter(pk=instance.parent_id, reply_count__gt=0).update(reply_count=F('reply_count') - 1)
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    _bump_version([instance.project_id])
+
+
+## cached token authentication: drop the cached token as soon as it is deleted
+## (LogoutView) or its user changes (UpdateUserProfileView, DeleteUserView, admin ...)
+@receiver([post_save, post_delete], sender=Token)
+def token_changed(sender, instance, **kwargs):
+    key = instance.key
+    invalidate_token(key)
+    transaction.on_commit(lambda: invalidate_token(key))
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    for key in Token.objects.filter(user_id=instance.pk).values_list('key', flat=True):
+        invalidate_token(key)
+        transaction.on_commit(lambda key=key: invalidate_token(key))
+
+
+## the comment lists show the commenter's profile: an edit changes every project they
+## commented on (saves of other fields, e.g. last_login on login, change none)
+@receiver(post_save, sender=User)
+def commenter_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not set(update_fields) & set(COMMENT_USER_FIELDS)):
+        return
+    Projects.bump_versions(Projects.objects.filter(comments__user=instance))
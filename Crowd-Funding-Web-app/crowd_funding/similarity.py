@@ -0,0 +1,151 @@
+import math
+from django.db import transaction
+from django.db.models import Count, Min
+from .models import Projects, SimilarProject
+
+## score(a, b) = weighted Jaccard of the two tag sets, each tag weighted by its rarity
+## (log(1 + projects / projects with the tag)), plus a bonus for the same category
+CATEGORY_BONUS = 0.2
+## rows kept per project, more than the views show so an update that pushes
+## one neighbour out still leaves a ranked list behind it
+SIMILAR_STORED = 10
+## ids per IN list, SQLite caps the bound parameters of a statement
+ID_BATCH = 1000
+
+ProjectTags = Projects.tags.through
+
+
+def tag_weights(tag_ids):
+    total = Projects.objects.count() or 1
+    counts = ProjectTags.objects.filter(tag_id__in=tag_ids).values('tag_id').annotate(n=Count('projects_id'))
+    return {row['tag_id']: math.log(1 + total / row['n']) for row in counts}
+
+
+## tag sets of the given projects (every project when None)
+def tags_by_project(project_ids=None):
+    if project_ids is None:
+        tags = {}
+        for project_id, tag_id in ProjectTags.objects.values_list('projects_id', 'tag_id').iterator():
+            tags.setdefault(project_id, set()).add(tag_id)
+        return tags
+    tags = {pk: set() for pk in project_ids}
+    for batch in id_batches(tags):
+        for project_id, tag_id in ProjectTags.objects.filter(projects_id__in=batch).values_list('projects_id', 'tag_id'):
+            tags[project_id].add(tag_id)
+    return tags
+
+
+def categories_by_project(project_ids):
+    categories = {}
+    for batch in id_batches(project_ids):
+        categories.update(Projects.objects.filter(pk__in=batch).values_list('pk', 'category_id'))
+    return categories
+
+
+def id_batches(project_ids):
+    project_ids = list(project_ids)
+    for start in range(0, len(project_ids), ID_BATCH):
+        yield project_ids[start:start + ID_BATCH]
+
+
+def score(tags_a, tags_b, weights, same_category):
+    union = sum(weights.get(tag, 0) for tag in tags_a | tags_b)
+    if not union:
+        return 0
+    shared = sum(weights.get(tag, 0) for tag in tags_a & tags_b)
+    if not shared:
+        return 0
+    return shared / union + (CATEGORY_BONUS if same_category else 0)
+
+
+## recompute one project's neighbours after its tags / category changed,
+## and move it up or down in the lists of the projects it shares (or shared) tags with
+def update_project(project_id):
+    with transaction.atomic():
+        tags = tags_by_project([project_id])[project_id]
+        candidates = set(
+            ProjectTags.objects.filter(tag_id__in=tags).exclude(projects_id=project_id)
+            .values_list('projects_id', flat=True)
+        )
+        previous = set(SimilarProject.objects.filter(similar_id=project_id).values_list('project_id', flat=True))
+        affected = candidates | previous
+
+        candidate_tags = tags_by_project(affected)
+        categories = categories_by_project(affected | {project_id})
+        weights = tag_weights(tags.union(*candidate_tags.values()))
+        category = categories.get(project_id)
+        scores = {}
+        for other in candidates:
+            value = score(tags, candidate_tags[other], weights, category is not None and categories.get(other) == category)
+            if value > 0:
+                scores[other] = value
+
+        ## this project's own list
+        SimilarProject.objects.filter(project_id=project_id).delete()
+        top = sorted(scores.items(), key=lambda item: -item[1])[:SIMILAR_STORED]
+        SimilarProject.objects.bulk_create([
+            SimilarProject(project_id=project_id, similar_id=other, score=value) for other, value in top
+        ])
+
+        ## the other side: only insert where it beats the current tail of the list
+        SimilarProject.objects.filter(project_id__in=affected, similar_id=project_id).delete()
+        tails = {
+            row['project_id']: row for row in SimilarProject.objects.filter(project_id__in=scores)
+            .values('project_id').annotate(n=Count('id'), low=Min('score'))
+        }
+        inserted = []
+        for other, value in scores.items():
+            tail = tails.get(other)
+            if tail is None or tail['n'] < SIMILAR_STORED or value > tail['low']:
+                inserted.append(SimilarProject(project_id=other, similar_id=project_id, score=value))
+        SimilarProject.objects.bulk_create(inserted)
+        for row in inserted:
+            tail = tails.get(row.project_id)
+            if tail and tail['n'] >= SIMILAR_STORED:
+                trim(row.project_id)
+
+
+def trim(project_id):
+    keep = SimilarProject.objects.filter(project_id=project_id).order_by('-score') \
+        .values_list('pk', flat=True)[:SIMILAR_STORED]
+    SimilarProject.objects.filter(project_id=project_id).exclude(pk__in=list(keep)).delete()
+
+
+## full rebuild (fresh tag weights for everyone), used by the rebuild_similar_projects command
+def rebuild_all(batch_size=1000):
+    ## projects without tags have no neighbours, only tagged ones are loaded
+    total = Projects.objects.count()
+    tags = tags_by_project()
+    categories = dict(Projects.objects.values_list('pk', 'category_id').iterator())
+    by_tag = {}
+    for project_id, project_tags in tags.items():
+        for tag in project_tags:
+            by_tag.setdefault(tag, []).append(project_id)
+    weights = {tag: math.log(1 + (total or 1) / len(members)) for tag, members in by_tag.items()}
+
+    with transaction.atomic():
+        SimilarProject.objects.all().delete()
+        rows = []
+        for project_id, project_tags in tags.items():
+            candidates = {other for tag in project_tags for other in by_tag[tag]} - {project_id}
+            category = categories.get(project_id)
+            scores = [
+                (other, score(project_tags, tags[other], weights, category is not None and categories.get(other) == category))
+                for other in candidates
+            ]
+            scores.sort(key=lambda item: -item[1])
+            rows.extend(
+                SimilarProject(project_id=project_id, similar_id=other, score=value)
+                for other, value in scores[:SIMILAR_STORED] if value > 0
+            )
+            if len(rows) >= batch_size:
+                SimilarProject.objects.bulk_create(rows)
+                rows = []
+        SimilarProject.objects.bulk_create(rows)
+    return total
+
+
+## ranked neighbours of a project, one indexed lookup
+def similar_projects(project_id, limit=4):
+    return Projects.objects.filter(similar_of__project_id=project_id, is_canceled=False) \
+        .order_by('-similar_of__score')[:limit]
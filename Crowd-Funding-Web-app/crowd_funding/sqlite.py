@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+## settings.SQLITE_PRAGMAS on every new SQLite connection (WAL, busy_timeout, ...).
+## journal_mode=WAL is stored in the database file, the others only last for the connection,
+## so it is only in SQLITE_PRAGMAS when the deployment sets SQLITE_JOURNAL_MODE.
+## IMMEDIATE write transactions are DATABASES OPTIONS['transaction_mode'].
+
+
+def pragma_statements(pragmas):
+    return [f"PRAGMA {name} = {value}" for name, value in pragmas.items()]
+
+
+## on a raw sqlite3 connection
+def apply_pragmas(raw_connection, pragmas):
+    for statement in pragma_statements(pragmas):
+        raw_connection.execute(statement).fetchall()
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite' or not getattr(settings, 'SQLITE_TUNING', False):
+        return
+    ## in memory test databases have no WAL / mmap, SQLite ignores those there
+    apply_pragmas(connection.connection, getattr(settings, 'SQLITE_PRAGMAS', {}))
@@ -1,3 +1,1236 @@
-from django.test import TestCase
+import csv
+import importlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.auth.models import update_last_login
+from django.core import checks, mail
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import Count, Sum
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve
+from django.utils import timezone
+from PIL import Image
+from project import settings as settings_module
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase, APITransactionTestCase
+from . import async_views, authentication, fastpath, fieldsets, home_feed, images, outbox, routers, search, throttling, urls, views
+from .renderers import ORJSONRenderer
+from .serializers import CommentSerializer, ProjectSerializer, UserProfileSerializer
+from .metrics import QueryBudgetExceeded, assert_max_queries
+from .models import (
+    User, Category, Tag, Projects, Donation, Comment, Rating, HomeFeedSection, OutboxEmail, EmailActivation, ProjectImages,
+    HourlyDonationRollup, DailyDonationRollup, PasswordReset, SimilarProject,
+)
 
-# Create your tests here.
+## migrations aren't tracked, run makemigrations before the tests
+
+
+class APITestHelpers:
+    def setUp(self):
+        ## a request over its view's query budget fails the test
+        budgets = override_settings(QUERY_METRICS={**settings.QUERY_METRICS, 'RAISE_OVER_BUDGET': True})
+        budgets.enable()
+        self.addCleanup(budgets.disable)
+        cache.clear()
+        self.user = self.make_user('donor@example.com')
+        self.category = Category.objects.create(name='Health')
+        self.authenticate(self.user)
+
+    def make_user(self, email):
+        return User.objects.create_user(
+            email=email, password='S3cure-pass!', first_name='Test', last_name='User', mobile_phone='01012345678',
+        )
+
+    def authenticate(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def make_project(self, title='Clean water', details='Wells for the village', **fields):
+        now = timezone.now()
+        return Projects.objects.create(
+            title=title, details=details, totalTarget=1000, startTime=now,
+            endTime=now + timedelta(days=30), uid=self.user, **{'category': self.category, **fields},
+        )
+
+    def donate(self, project, amount='10.00'):
+        return self.client.post('/api/donations/', {'project': project.pk, 'amount': amount})
+
+
+class APITestBase(APITestHelpers, APITestCase):
+    pass
+
+
+class DonationTotalsTests(APITestBase):
+    def test_donations_add_to_the_totals(self):
+        project = self.make_project()
+        self.assertEqual(self.donate(project, '10.00').status_code, 201)
+        self.assertEqual(self.donate(project, '5.50').status_code, 201)
+        project.refresh_from_db()
+        self.assertEqual(project.totalDonations, 15.5)
+        self.assertEqual(project.donations_count, 2)
+
+    def test_deleted_donations_leave_the_totals(self):
+        project = self.make_project()
+        self.donate(project, '10.00')
+        other = self.make_user('other@example.com')
+        self.authenticate(other)
+        self.donate(project, '4.00')
+
+        Donation.objects.filter(user=self.user).get().delete()
+        project.refresh_from_db()
+        self.assertEqual((project.totalDonations, project.donations_count), (4.0, 1))
+
+        ## DeleteUserView cascades to the donor's donations
+        other.delete()
+        project.refresh_from_db()
+        self.assertEqual((project.totalDonations, project.donations_count, project.last_donation_at), (0.0, 0, None))
+
+    def totals(self, project):
+        project.refresh_from_db()
+        rollups = [
+            list(model.objects.filter(project=project).values_list('amount', 'count', 'donors'))
+            for model in (HourlyDonationRollup, DailyDonationRollup)
+        ]
+        return project.totalDonations, project.donations_count, rollups
+
+    def test_donations_outside_the_api_move_the_totals_and_rollups(self):
+        project = self.make_project()
+        self.donate(project, '10.00')
+        before = self.totals(project)
+
+        ## admin / shell / import code paths
+        donation = Donation.objects.create(project=project, user=self.make_user('other@example.com'), amount='4.00')
+        self.assertEqual(self.totals(project), (14.0, 2, [[(14, 2, 2)]] * 2))
+        donation.amount = '6.50'
+        donation.save()
+        self.assertEqual(self.totals(project), (16.5, 2, [[(Decimal('16.5'), 2, 2)]] * 2))
+
+        other = self.make_project('Solar panels')
+        donation.project = other
+        donation.save()
+        self.assertEqual(self.totals(project), before)
+        self.assertEqual(self.totals(other), (6.5, 1, [[(Decimal('6.5'), 1, 1)]] * 2))
+
+        donation.project = project
+        donation.save()
+        donation.delete()
+        self.assertEqual(self.totals(project), before)
+        self.assertEqual(self.totals(other), (0.0, 0, [[], []]))
+
+
+class HomeFeedTests(APITestBase):
+    def create_project(self, title='Solar panels'):
+        now = timezone.now()
+        return self.client.post('/api/projects/', {
+            'title': title, 'details': 'Panels for the school', 'totalTarget': 500, 'category': 'Energy',
+            'startTime': now.isoformat(), 'endTime': (now + timedelta(days=10)).isoformat(), 'tags': ['solar', 'school'],
+        })
+
+    def test_project_create_runs_the_after_commit_work_once(self):
+        home_feed.rebuild_home_feed()
+        with mock.patch('crowd_funding.search.index_projects') as index_projects, \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.assertEqual(self.create_project().status_code, 201)
+        index_projects.assert_called_once()
+        self.assertEqual(len([callback for callback in callbacks if getattr(callback, 'func', None) is home_feed.mark_dirty]), 1)
+        ## marked, not rebuilt inside the request
+        self.assertEqual(set(HomeFeedSection.objects.filter(pending__gt=0).values_list('name', flat=True)), set(home_feed.SECTIONS))
+        self.assertEqual(self.client.get('/api/home-projects/').json()['latest_projects'], [])
+
+        call_command('refresh_home_feed', stdout=StringIO())
+        self.assertFalse(HomeFeedSection.objects.filter(pending__gt=0).exists())
+        latest = self.client.get('/api/home-projects/').json()['latest_projects']
+        self.assertEqual([project['title'] for project in latest], ['Solar panels'])
+
+    def test_rating_marks_top_rated_and_stale_reads_rebuild(self):
+        project = self.make_project()
+        home_feed.rebuild_home_feed()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/projects/{project.pk}/rate/', {'value': 5})
+        top_rated = HomeFeedSection.objects.get(name='top_rated_projects')
+        self.assertEqual(top_rated.pending, 1)
+        self.assertEqual(self.client.get('/api/home-projects/').json()['top_rated_projects'][0]['avg_rating'], 0)
+
+        with override_settings(HOME_FEED_MAX_STALENESS=0):
+            feed = self.client.get('/api/home-projects/').json()
+        self.assertEqual(feed['top_rated_projects'][0]['avg_rating'], 5)
+        self.assertEqual(HomeFeedSection.objects.get(name='top_rated_projects').pending, 0)
+
+
+class RatingAggregateTests(APITestBase):
+    def rate(self, project, value):
+        return self.client.post(f'/api/projects/{project.pk}/rate/', {'value': value})
+
+    def histogram(self, project):
+        return self.client.get(f'/api/projects/{project.pk}/ratings/histogram/').json()
+
+    def test_rates_re_rates_and_deletes_move_the_histogram(self):
+        project = self.make_project()
+        self.assertEqual(self.rate(project, 4).status_code, 201)
+        other = self.make_user('other@example.com')
+        self.authenticate(other)
+        self.assertEqual(self.rate(project, 2).status_code, 201)
+        self.assertEqual(self.rate(project, 5).status_code, 200)
+
+        response = self.histogram(project)
+        self.assertEqual((response['average_rating'], response['rating_count']), (4.5, 2))
+        self.assertEqual(response['histogram'], {'1': 0, '2': 0, '3': 0, '4': 1, '5': 1})
+
+        ## DeleteUserView cascades to the user's ratings
+        other.delete()
+        self.authenticate(self.user)
+        response = self.histogram(project)
+        self.assertEqual((response['average_rating'], response['rating_count']), (4.0, 1))
+        self.assertEqual(response['histogram'], {'1': 0, '2': 0, '3': 0, '4': 1, '5': 0})
+
+        Rating.objects.get().delete()
+        response = self.histogram(project)
+        self.assertEqual((response['average_rating'], response['rating_count']), (0.0, 0))
+        self.assertEqual(set(response['histogram'].values()), {0})
+
+    def test_ratings_outside_the_api_move_the_histogram(self):
+        project = self.make_project()
+        self.rate(project, 4)
+
+        ## admin / shell code paths, then DeleteUserView's cascade
+        other = self.make_user('other@example.com')
+        rating = Rating.objects.create(project=project, user=other, score=1)
+        self.assertEqual(self.histogram(project)['histogram'], {'1': 1, '2': 0, '3': 0, '4': 1, '5': 0})
+        rating.score = 3
+        rating.save()
+        response = self.histogram(project)
+        self.assertEqual((response['average_rating'], response['rating_count']), (3.5, 2))
+        self.assertEqual(response['histogram'], {'1': 0, '2': 0, '3': 1, '4': 1, '5': 0})
+
+        second = self.make_project('Solar panels')
+        rating.project = second
+        rating.save()
+        self.assertEqual(self.histogram(project)['histogram'], {'1': 0, '2': 0, '3': 0, '4': 1, '5': 0})
+        self.assertEqual(self.histogram(second)['histogram'], {'1': 0, '2': 0, '3': 1, '4': 0, '5': 0})
+
+        other.delete()
+        response = self.histogram(second)
+        self.assertEqual((response['average_rating'], response['rating_count']), (0.0, 0))
+        self.assertEqual(set(response['histogram'].values()), {0})
+        self.assertEqual(self.histogram(project)['rating_count'], 1)
+
+
+class CommentTreeTests(APITestBase):
+    def test_replies_stop_where_the_path_column_ends(self):
+        project = self.make_project()
+        parent = Comment.objects.create(project=project, user=self.user, content='root')
+        for _ in range(Comment.MAX_DEPTH - 1):
+            parent = Comment.objects.create(project=project, user=self.user, content='reply', parent=parent)
+
+        response = self.client.post('/api/comments/', {'content': 'deepest', 'parent': parent.pk})
+        self.assertEqual(response.status_code, 201)
+        deepest = Comment.objects.get(pk=response.json()['id'])
+        self.assertEqual(deepest.depth, Comment.MAX_DEPTH)
+        self.assertLessEqual(len(deepest.path), Comment._meta.get_field('path').max_length)
+
+        response = self.client.post('/api/comments/', {'content': 'too deep', 'parent': deepest.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent', response.json())
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'FTS5 index')
+class ProfileTests(APITestBase):
+    ## more than the preview plus one full page of the lists (PAGE_SIZE 15)
+    ROWS = 22
+
+    def follow(self, next_link):
+        ids = []
+        while next_link:
+            page = self.client.get(next_link).json()
+            ids += [row['id'] for row in page['results']]
+            next_link = page['next']
+        return ids
+
+    def test_previews_link_to_the_full_lists(self):
+        project = self.make_project()
+        for number in range(self.ROWS - 1):
+            self.make_project(f'Project {number}')
+        for number in range(self.ROWS):
+            Donation.objects.create(project=project, user=self.user, amount=number + 1)
+        ## rows created in the same instant are ordered by id, across page boundaries too
+        same_instant = timezone.now() - timedelta(days=1)
+        Projects.objects.filter(pk__in=list(Projects.objects.values_list('pk', flat=True)[3:9])).update(created_at=same_instant)
+        Donation.objects.filter(pk__in=list(Donation.objects.values_list('pk', flat=True)[3:9])).update(created_at=same_instant)
+        Donation.objects.create(project=project, user=self.make_user('other@example.com'), amount=100)
+
+        profile = self.client.get('/api/profile/').json()
+        self.assertEqual(profile['stats'], {
+            'projects_count': self.ROWS, 'donations_count': self.ROWS, 'donations_total': self.ROWS * (self.ROWS + 1) / 2,
+        })
+        for name, model in (('projects', Projects), ('donations', Donation)):
+            with self.subTest(name):
+                newest = list(model.objects.filter(
+                    **{'uid' if model is Projects else 'user': self.user}
+                ).order_by('-created_at', '-id').values_list('pk', flat=True))
+                preview = profile[name]
+                self.assertEqual([row['id'] for row in preview['results']], newest[:UserProfileSerializer.PREVIEW_SIZE])
+                self.assertIn(f'/api/profile/{name}/', preview['next'])
+                self.assertEqual([row['id'] for row in preview['results']] + self.follow(preview['next']), newest)
+
+
+class ProjectSearchTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.in_details = self.make_project('Village school', details='A water pump for the school')
+            self.in_title = self.make_project('Water wells')
+            self.tagged = self.make_project('Solar panels', details='Panels for the clinic')
+            self.tagged.tags.add(Tag.objects.create(name='waterproof'))
+
+    def search(self, term):
+        return [project['id'] for project in self.client.get('/api/projects/search/', {'search': term}).json()['results']]
+
+    def test_ranked_prefix_matches_on_both_paths(self):
+        for fast_path in (True, False):
+            with self.subTest(fast_path=fast_path), override_settings(FAST_READ_PATH=fast_path):
+                ## title beats tags beats details, the last word is a prefix
+                self.assertEqual(self.search('wat'), [self.in_title.pk, self.tagged.pk, self.in_details.pk])
+                self.assertEqual(self.search('water school'), [self.in_details.pk])
+                self.assertEqual(self.search('clinic'), [self.tagged.pk])
+                self.assertEqual(self.search('"*'), [])
+
+    def test_edits_and_deletes_reach_the_index(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.in_title.title = 'Deep wells'
+            self.in_title.save()
+            self.in_details.delete()
+        self.assertEqual(self.search('water'), [self.tagged.pk])
+        self.assertEqual(self.search('deep'), [self.in_title.pk])
+
+
+class SimilarProjectsTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        water, rare, solar = (Tag.objects.create(name=name) for name in ('water', 'wells', 'solar'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project = self.make_project('Clean water')
+            self.project.tags.set([water, rare])
+            self.close = self.make_project('Village wells')
+            self.close.tags.set([water, rare])
+            self.far = self.make_project('Water filters', category=Category.objects.create(name='Education'))
+            self.far.tags.set([water])
+            self.unrelated = self.make_project('Solar panels')
+            self.unrelated.tags.set([solar])
+
+    def similar(self, project):
+        return [row['id'] for row in self.client.get(f'/api/projects/{project.pk}/similar/').json()]
+
+    def test_neighbours_are_ranked_by_shared_rare_tags(self):
+        self.assertEqual(self.similar(self.project), [self.close.pk, self.far.pk])
+        self.assertEqual(self.similar(self.unrelated), [])
+        ## the incremental updates agree with a full rebuild
+        call_command('rebuild_similar_projects', stdout=StringIO())
+        self.assertEqual(self.similar(self.project), [self.close.pk, self.far.pk])
+
+    def test_tag_changes_and_cancels_move_the_lists(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.close.tags.clear()
+        self.assertEqual(self.similar(self.project), [self.far.pk])
+        Projects.objects.filter(pk=self.far.pk).update(is_canceled=True)
+        self.assertEqual(self.similar(self.project), [])
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class OutboxTests(APITestBase):
+    def register(self, email='new@example.com'):
+        self.client.credentials()
+        return self.client.post('/api/register/', {
+            'first_name': 'New', 'last_name': 'User', 'email': email, 'mobile_phone': '01012345678',
+            'password': 'S3cure-pass!', 'confirm_password': 'S3cure-pass!',
+        })
+
+    def test_activation_email_is_queued_with_the_user_and_sent_by_send_outbox(self):
+        self.assertEqual(self.register().status_code, 201)
+        queued = OutboxEmail.objects.get()
+        self.assertEqual((queued.status, queued.to), (OutboxEmail.PENDING, ['new@example.com']))
+        self.assertEqual(mail.outbox, [])
+
+        call_command('send_outbox', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        activation = EmailActivation.objects.get(user__email='new@example.com')
+        self.assertIn(str(activation.activation_key), mail.outbox[0].body)
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.SENT)
+
+    def test_rolled_back_registration_leaves_no_email(self):
+        def queue_then_fail(*args, **kwargs):
+            outbox.queue_mail(*args, **kwargs)
+            raise RuntimeError('registration failed after queueing')
+
+        with mock.patch('crowd_funding.views.queue_mail', side_effect=queue_then_fail), self.assertRaises(RuntimeError):
+            self.register()
+        self.assertFalse(User.objects.filter(email='new@example.com').exists())
+        self.assertFalse(OutboxEmail.objects.exists())
+        call_command('send_outbox', stdout=StringIO())
+        self.assertEqual(mail.outbox, [])
+
+    def test_leases_are_taken_over_and_failures_backed_off(self):
+        emails = [outbox.queue_mail('Hello', 'Body', [f'user{number}@example.com']) for number in range(3)]
+        self.assertEqual(len(outbox.claim_batch('worker-1', 2)), 2)
+        self.assertEqual([email.pk for email in outbox.claim_batch('worker-2', 5)], [emails[2].pk])
+
+        ## worker-1 died: its rows come back once the lease is up
+        OutboxEmail.objects.filter(locked_by='worker-1').update(locked_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = outbox.claim_batch('worker-3', 5)
+        self.assertEqual([email.pk for email in reclaimed], [emails[0].pk, emails[1].pk])
+
+        broken = mock.Mock(send_messages=mock.Mock(side_effect=OSError('connection refused')))
+        self.assertEqual(outbox.send_batch(reclaimed, broken), 0)
+        for email in OutboxEmail.objects.filter(pk__in=[emails[0].pk, emails[1].pk]):
+            self.assertEqual((email.status, email.attempts, email.locked_by), (OutboxEmail.PENDING, 1, ''))
+            self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertEqual(outbox.claim_batch('worker-4', 5), [])
+
+
+def jpeg_with_gps(color='red'):
+    exif = Image.Exif()
+    exif[0x8825] = {1: 'N', 2: (30.0, 2.0, 40.0)}
+    buffer = BytesIO()
+    Image.new('RGB', (800, 600), color).save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+class ImageProcessingTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, PROJECT_IMAGE_PLACEHOLDER='/static/img/placeholder.jpg')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.project = self.make_project()
+
+    def upload(self, data, name='holiday.jpg'):
+        return ProjectImages.objects.create(project=self.project, image=SimpleUploadedFile(name, data, 'image/jpeg'))
+
+    def test_pending_uploads_are_not_linked(self):
+        pending = self.upload(jpeg_with_gps())
+        self.assertNotIn('holiday', pending.image.name)
+        for path in (f'/api/projects/{self.project.pk}/', '/api/projects/'):
+            response = self.client.get(path).json()
+            image = (response if 'images' in response else response['results'][0])['images'][0]
+            self.assertEqual(image['status'], ProjectImages.PENDING)
+            self.assertEqual({image[key] for key in ('image', 'thumbnail', 'card')}, {'http://testserver/static/img/placeholder.jpg'})
+
+        images.process_batch(10)
+        image = self.client.get(f'/api/projects/{self.project.pk}/').json()['images'][0]
+        self.assertEqual(image['status'], ProjectImages.READY)
+        self.assertTrue(image['thumbnail'].endswith('_thumbnail.jpg'))
+        pending.refresh_from_db()
+        with pending.image.open('rb') as full:
+            self.assertNotIn(0x8825, Image.open(full).getexif())
+
+    def test_workers_claim_disjoint_batches(self):
+        uploads = [self.upload(jpeg_with_gps(color)) for color in ('red', 'green', 'blue')]
+        first = images.claim_batch('worker-1', 2)
+        second = images.claim_batch('worker-2', 2)
+        self.assertEqual([row.pk for row in first], [uploads[0].pk, uploads[1].pk])
+        self.assertEqual([row.pk for row in second], [uploads[2].pk])
+        self.assertEqual(images.claim_batch('worker-3', 2), [])
+
+        ## a worker that died is taken over once its lease is up
+        ProjectImages.objects.filter(locked_by='worker-1').update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(images.claim_batch('worker-3', 5)), 2)
+
+    def test_same_bytes_reuse_the_stored_variants(self):
+        data = jpeg_with_gps()
+        first = self.upload(data)
+        images.process_batch(10)
+        second = self.upload(data, 'again.jpg')
+        with mock.patch('crowd_funding.images.render_job') as render_job:
+            self.assertEqual(images.process_batch(10), (1, 0))
+        render_job.assert_not_called()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(second.status, ProjectImages.READY)
+        self.assertEqual((second.image.name, second.thumbnail.name), (first.image.name, first.thumbnail.name))
+
+    def test_the_default_placeholder_is_a_static_file(self):
+        default = settings_module.PROJECT_IMAGE_PLACEHOLDER
+        self.assertTrue(default.startswith(settings.STATIC_URL))
+        path = finders.find(default[len(settings.STATIC_URL):])
+        self.assertIsNotNone(path)
+        with Image.open(path) as placeholder:
+            self.assertEqual(placeholder.format, 'JPEG')
+
+
+class TokenCacheTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        authentication._local_tokens.clear()
+        self.key = Token.objects.get(user=self.user).key
+
+    def authenticate_key(self):
+        return authentication.CachedTokenAuthentication().authenticate_credentials(self.key)
+
+    def test_only_ids_are_cached_and_the_user_loads_lazily(self):
+        with self.assertNumQueries(1):
+            user, token = self.authenticate_key()
+        self.assertEqual(cache.get(authentication.token_cache_key(self.key)), (self.user.pk, True, self.key))
+
+        with self.assertNumQueries(0):
+            user, token = self.authenticate_key()
+            self.assertTrue(user and user.is_authenticated)
+            self.assertEqual((user.pk, token.user_id, token.key), (self.user.pk, self.user.pk, self.key))
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, 'donor@example.com')
+        self.assertIs(token.user, user)
+
+    def test_deactivated_user_is_refused_at_once(self):
+        self.authenticate_key()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(authentication.exceptions.AuthenticationFailed):
+            self.authenticate_key()
+
+    def test_shared_ttl_is_capped_without_a_cross_process_cache(self):
+        self.assertEqual(authentication.shared_cache_ttl(), settings.TOKEN_AUTH_CACHE['LOCAL_TTL'])
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location,
+        }}):
+            self.assertEqual(authentication.shared_cache_ttl(), settings.TOKEN_AUTH_CACHE['SHARED_TTL'])
+
+
+class ProjectPaginationTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.projects = [self.make_project(f'Project {number}') for number in range(settings.REST_FRAMEWORK['PAGE_SIZE'] + 3)]
+        ## ties on created_at are broken by id
+        Projects.objects.filter(pk__in=[project.pk for project in self.projects[:6]]).update(created_at=self.projects[0].created_at)
+        self.newest_first = list(Projects.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def test_page_numbers_stay_the_default(self):
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        ## in the order clients got before keyset pagination (the table's)
+        in_table_order = sorted(self.newest_first)
+        response = self.client.get('/api/projects/').json()
+        self.assertEqual(set(response), {'count', 'next', 'previous', 'results'})
+        self.assertEqual(response['count'], len(self.projects))
+        self.assertEqual([project['id'] for project in response['results']], in_table_order[:page_size])
+        second = self.client.get(response['next']).json()
+        self.assertEqual([project['id'] for project in second['results']], in_table_order[page_size:])
+
+    def test_cursor_opts_in_to_keyset_pages(self):
+        seen = []
+        url = '/api/projects/?cursor=&page_size=5'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url).json()
+            self.assertNotIn('count', response)
+            self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+            seen += [project['id'] for project in response['results']]
+            url = response['next']
+        self.assertEqual(seen, self.newest_first)
+        self.assertEqual(self.client.get('/api/projects/?cursor=not-a-cursor').status_code, 404)
+
+
+class QueryPlanTests(APITestBase):
+    def test_view_queries_use_indexes_on_seeded_data(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with override_settings(MEDIA_ROOT=media_root):
+            call_command('seed_data', users=20, projects=150, donations=400, comments=150, ratings=150, reports=5, stdout=StringIO())
+        out = StringIO()
+        call_command('check_query_plans', analyze=True, host='testserver', stdout=out)
+        report = out.getvalue()
+        self.assertNotIn('FAIL', report)
+        for name in ('ProjectSearchView (fast path)', 'ProjectSearchView SearchFilter (serializer)', 'CommentListView (fast path)'):
+            self.assertIn(name, report)
+
+
+class QueryBudgetTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        tags = [Tag.objects.create(name=name) for name in ('water', 'health')]
+        self.projects = [self.make_project(f'Water {number}', is_featured=number % 2 == 0) for number in range(6)]
+        for project in self.projects:
+            project.tags.set(tags)
+        self.project = self.projects[0]
+        thread = Comment.objects.create(project=self.project, user=self.user, content='First')
+        Comment.objects.create(project=self.project, user=self.user, content='Reply', parent=thread)
+        for project in self.projects[:3]:
+            self.donate(project)
+        home_feed.rebuild_home_feed()
+
+    ## cold caches and the after commit work included, as in a request outside the tests
+    def assert_within_budget(self, view, method, url, data=None):
+        budget = view.query_budget
+        budget = budget[method] if isinstance(budget, dict) else budget
+        cache.clear()
+        authentication._local_tokens.clear()
+        with assert_max_queries(budget), self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method.lower())(url, data)
+        self.assertLess(response.status_code, 300, response.content)
+        return response
+
+    def test_read_budgets(self):
+        pk = self.project.pk
+        for view, url in [
+            (views.ProjectView, '/api/projects/'),
+            (views.ProjectView, '/api/projects/?cursor='),
+            (views.ProjectView, '/api/projects/?fields=card'),
+            (views.ProjectDetailView, f'/api/projects/{pk}/'),
+            (views.SimilarProjectsView, f'/api/projects/{pk}/similar/'),
+            (views.CommentListView, f'/api/comments/list/?project={pk}'),
+            (views.RatingHistogramView, f'/api/projects/{pk}/ratings/histogram/'),
+            (views.ProfileView, '/api/profile/'),
+            (views.ProfileProjectsView, '/api/profile/projects/'),
+            (views.ProfileDonationsView, '/api/profile/donations/'),
+            (views.home_projects, '/api/home-projects/'),
+            (views.ProjectSearchView, '/api/projects/search/?search=water'),
+        ]:
+            for fast_path in (True, False):
+                with self.subTest(url=url, fast_path=fast_path), override_settings(FAST_READ_PATH=fast_path):
+                    self.assert_within_budget(view, 'GET', url)
+
+    def test_over_budget_requests_fail_the_tests(self):
+        url = f'/api/projects/{self.project.pk}/ratings/histogram/'
+        with mock.patch.object(views.RatingHistogramView, 'query_budget', 0), self.assertRaises(QueryBudgetExceeded):
+            self.client.get(url)
+        ## a stale home feed section rebuilt by the read is outside the budget
+        HomeFeedSection.objects.update(pending=1, dirty_since=timezone.now() - timedelta(hours=1))
+        self.assert_within_budget(views.home_projects, 'GET', '/api/home-projects/')
+        self.assertFalse(HomeFeedSection.objects.filter(pending__gt=0).exists())
+
+    def test_donation_budget(self):
+        on_feed = self.project
+        off_feed = self.make_project('Not on the home feed', is_canceled=True)
+        home_feed.rebuild_home_feed()
+        for project in (on_feed, off_feed):
+            ## the first donation of the hour creates the rollup rows, the next one updates them
+            for _ in range(2):
+                with self.subTest(project=project.title):
+                    self.assert_within_budget(views.DonationCreateView, 'POST', '/api/donations/', {'project': project.pk, 'amount': '5.00'})
+
+    def test_project_create_budget(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        now = timezone.now()
+        self.assert_within_budget(views.ProjectView, 'POST', '/api/projects/', {
+            'title': 'Solar panels', 'details': 'Panels for the school', 'totalTarget': 500, 'category': 'Energy',
+            'startTime': now.isoformat(), 'endTime': (now + timedelta(days=10)).isoformat(),
+            'tags': ['solar', 'school', 'water'],
+            'images': [SimpleUploadedFile(f'panel{number}.jpg', jpeg_with_gps(), 'image/jpeg') for number in range(2)],
+        })
+
+
+class SeedAndBenchmarkTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('seed_data', users=15, projects=40, donations=300, comments=80, ratings=60, reports=5, stdout=StringIO())
+
+    def test_seeded_counters_match_the_rows(self):
+        self.assertEqual(Projects.objects.count(), 40)
+        for project in Projects.objects.annotate(total=Sum('donations__amount'), count=Count('donations', distinct=True)):
+            self.assertAlmostEqual(project.totalDonations, float(project.total or 0), places=2)
+            self.assertEqual(project.donations_count, project.count)
+        self.assertEqual(
+            Projects.objects.aggregate(total=Sum('rating_count'))['total'],
+            Rating.objects.count(),
+        )
+        self.assertEqual(HourlyDonationRollup.objects.aggregate(count=Sum('count'))['count'], Donation.objects.count())
+        self.assertFalse(Comment.objects.filter(path='').exists())
+
+    def test_benchmark_report(self):
+        out = StringIO()
+        call_command('run_benchmarks', iterations=3, warmup=1, host='testserver', label='test', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual((report['label'], report['iterations'], report['dataset']['projects']), ('test', 3, 40))
+        self.assertIn('ProjectSearchView', report['endpoints'])
+        for name, result in report['endpoints'].items():
+            with self.subTest(name):
+                self.assertGreater(result['queries'], 0)
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+
+class ImportDataTests(APITestBase):
+    def write(self, name, lines):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as target:
+            target.write('\n'.join(lines) + '\n')
+        return path
+
+    def test_legacy_ids_resolve_across_chunks(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        existing = self.make_project('Existing')
+        project = '{"id": %d, "owner": "donor@example.com", "title": "%s", "totalTarget": 100, ' \
+                  '"startTime": "2024-01-01T00:00:00", "endTime": "2024-02-01T00:00:00"}'
+        files = {
+            'projects': self.write('projects.jsonl', [project % (number, f'Legacy {number}') for number in (7, 8, 9)]),
+            'donations': self.write('donations.csv', ['project,user,amount', '9,donor@example.com,5', f'{existing.pk},donor@example.com,3']),
+            'comments': self.write('comments.csv', [
+                'id,project,user,content,parent',
+                '1,7,donor@example.com,root,',
+                '2,7,donor@example.com,reply,1',
+                '3,8,donor@example.com,other root,',
+                '4,7,donor@example.com,reply to reply,2',
+                '5,7,donor@example.com,late reply,1',
+            ]),
+        }
+        call_command('import_data', batch_size=2, skip_rebuild=True, stdout=StringIO(), **files)
+
+        projects = dict(Projects.objects.values_list('title', 'pk'))
+        self.assertEqual(
+            sorted(Donation.objects.values_list('project_id', 'amount')),
+            sorted([(projects['Legacy 9'], 5), (existing.pk, 3)]),
+        )
+        comments = {comment.content: comment for comment in Comment.objects.all()}
+        self.assertEqual(comments['root'].project_id, projects['Legacy 7'])
+        self.assertEqual(comments['other root'].project_id, projects['Legacy 8'])
+        for reply, parent in [('reply', 'root'), ('reply to reply', 'reply'), ('late reply', 'root')]:
+            self.assertEqual(comments[reply].parent_id, comments[parent].pk, reply)
+        ## the id map only lives while the command runs
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_temp_master WHERE name = 'import_data_ids'")
+            self.assertIsNone(cursor.fetchone())
+
+    def test_rebuild_keeps_statements_under_the_variable_limit(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        tag = Tag.objects.create(name='water')
+        now = timezone.now()
+        projects = Projects.objects.bulk_create([
+            Projects(title=f'Project {number}', details='Imported', totalTarget=100, startTime=now,
+                     endTime=now + timedelta(days=30), uid=self.user, category=self.category)
+            for number in range(300)
+        ])
+        Projects.tags.through.objects.bulk_create([Projects.tags.through(projects=project, tag=tag) for project in projects])
+        comments = Comment.objects.bulk_create([Comment(project=projects[0], user=self.user, content='root')])
+        for number in range(60):
+            comments += Comment.objects.bulk_create([
+                Comment(project=projects[0], user=self.user, content=f'reply {number}', parent=comments[number // 2])
+            ])
+        donations = self.write('donations.csv', ['project,user,amount'] + [f'{project.pk},donor@example.com,5' for project in projects])
+
+        ## every project id in one IN list would go past it
+        connection.ensure_connection()
+        previous = connection.connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 250)
+        self.addCleanup(connection.connection.setlimit, sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, previous)
+        call_command('import_data', batch_size=20, donations=donations, stdout=StringIO())
+
+        self.assertEqual(set(Projects.objects.values_list('totalDonations', 'donations_count')), {(5.0, 1)})
+        self.assertEqual(SimilarProject.objects.filter(project=projects[0]).count(), 10)
+        deepest = Comment.objects.get(content='reply 59')
+        self.assertEqual((deepest.root_id, deepest.depth), (comments[0].pk, 5))
+        self.assertEqual(deepest.path, ''.join(str(pk).zfill(Comment.PATH_STEP) + '/' for pk in (
+            comments[0].pk, comments[2].pk, comments[6].pk, comments[14].pk, comments[29].pk, deepest.pk,
+        )))
+        self.assertEqual(Comment.objects.get(pk=comments[0].pk).reply_count, 2)
+        self.assertEqual(Comment.objects.get(pk=comments[29].pk).reply_count, 2)
+
+
+class DonationExportTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.other = self.make_project('Solar panels')
+        for project, amount in [(self.project, '10.00'), (self.other, '2.50'), (self.project, '7.25')]:
+            self.donate(project, amount)
+        ## the first donation is from last year
+        Donation.objects.filter(amount=10).update(created_at=timezone.now() - timedelta(days=400))
+        self.user.is_staff = True
+        self.user.save()
+
+    def export(self, **params):
+        response = self.client.get('/api/donations/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_and_jsonl_with_filters(self):
+        lines = self.export().splitlines()
+        self.assertEqual(lines[0], 'id,created_at,amount,project_id,project_title,user_id,user_email')
+        self.assertEqual([line.split(',')[2] for line in lines[1:]], ['10.00', '2.50', '7.25'])
+
+        rows = [json.loads(line) for line in self.export(output='jsonl', project=self.project.pk).splitlines()]
+        self.assertEqual([(row['amount'], row['project_title'], row['user_email']) for row in rows], [
+            ('10.00', 'Clean water', 'donor@example.com'), ('7.25', 'Clean water', 'donor@example.com'),
+        ])
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+        rows = [json.loads(line) for line in self.export(output='jsonl', since=since).splitlines()]
+        self.assertEqual([row['amount'] for row in rows], ['2.50', '7.25'])
+
+    def test_csv_cells_are_never_formulas(self):
+        titles = ['=HYPERLINK("http://example.com","x")', '+1', '-2+3', '@SUM(A1)', '\tcmd', '\r=1']
+        Projects.objects.filter(pk=self.other.pk).update(title=titles[0])
+        for title in titles[1:]:
+            self.donate(self.make_project(title), '1.00')
+        rows = list(csv.reader(StringIO(self.export())))[1:]
+        self.assertEqual({row[4] for row in rows} - {'Clean water'}, {"'" + title for title in titles})
+        ## JSONL keeps the values as typed
+        rows = [json.loads(line) for line in self.export(output='jsonl', project=self.other.pk).splitlines()]
+        self.assertEqual(rows[0]['project_title'], titles[0])
+
+    def test_one_query_whatever_the_rows(self):
+        Donation.objects.bulk_create([Donation(project=self.other, user=self.user, amount=1) for _ in range(200)])
+        response = self.client.get('/api/donations/export/')
+        with CaptureQueriesContext(connection) as queries:
+            lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual((len(lines), len(queries)), (1 + 203, 1))
+
+    def test_admins_only_and_bad_parameters(self):
+        self.assertEqual(self.client.get('/api/donations/export/', {'output': 'xlsx'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/donations/export/', {'since': 'yesterday'}).status_code, 400)
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/donations/export/').status_code, 403)
+
+
+class SparseFieldsetTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project(details='word ' * 60)
+        self.project.tags.add(Tag.objects.create(name='water'))
+        self.donate(self.project, '250.00')
+
+    def first(self, query):
+        return self.client.get('/api/projects/' + query).json()['results'][0]
+
+    def test_fields_presets_and_expand(self):
+        for fast_path in (True, False):
+            with self.subTest(fast_path=fast_path), override_settings(FAST_READ_PATH=fast_path):
+                self.assertEqual(self.first('?fields=id,title'), {'id': self.project.pk, 'title': 'Clean water'})
+                card = self.first('?fields=card&expand=tags')
+                self.assertEqual(set(card), {'id', 'title', 'tags', 'avg_rating', 'excerpt', 'progress', 'cover'})
+                self.assertEqual((card['progress'], card['cover'], card['tags'][0]['name']), (25.0, None, 'water'))
+                self.assertEqual(len(card['excerpt']), fieldsets.EXCERPT_LENGTH)
+                self.assertTrue(card['excerpt'].endswith('…'))
+
+                default = self.first('')
+                self.assertFalse(set(ProjectSerializer.OPTIONAL_FIELDS) & set(default))
+                self.assertEqual(default['details'], 'word ' * 60)
+
+    def test_unselected_columns_and_relations_are_not_loaded(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.first('?fields=id,title')
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('"details"', sql)
+        self.assertNotIn('crowd_funding_category', sql)
+        self.assertNotIn('crowd_funding_projectimages', sql)
+
+
+class FastReadPathTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.with_images = self.make_project('Water wells')
+        self.with_images.tags.set([Tag.objects.create(name='water'), Tag.objects.create(name='wells')])
+        ProjectImages.objects.create(
+            project=self.with_images, image='projects_Images/a.jpg', thumbnail='projects_Images/a_thumbnail.jpg',
+            card='projects_Images/a_card.jpg', status=ProjectImages.READY,
+        )
+        ProjectImages.objects.create(project=self.with_images, image='projects_Images/pending/b.jpg')
+        self.no_category = self.make_project('Water filters', category=None)
+        Rating.objects.create(project=self.no_category, user=self.user, score=4)
+        self.no_category.apply_rating(4)
+        self.no_category.tags.add(Tag.objects.get(name='water'))
+
+        commenter = self.make_user('commenter@example.com')
+        commenter.profile_picture = 'profile_pics/me.jpg'
+        commenter.save()
+        thread = Comment.objects.create(project=self.with_images, user=commenter, content='First')
+        reply = Comment.objects.create(project=self.with_images, user=self.user, content='Reply', parent=thread)
+        Comment.objects.create(project=self.with_images, user=commenter, content='Reply to reply', parent=reply)
+        Comment.objects.create(project=self.with_images, user=self.user, content='Second')
+        with self.captureOnCommitCallbacks(execute=True):
+            search.index_projects([self.with_images.pk, self.no_category.pk])
+
+    def both_ways(self, url):
+        responses = []
+        for fast_path in (True, False):
+            with override_settings(FAST_READ_PATH=fast_path):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            responses.append(json.loads(response.content))
+        return responses
+
+    def test_rows_match_the_serializers(self):
+        request = Request(APIRequestFactory().get('/'))
+        project_ids = [self.with_images.pk, self.no_category.pk]
+        projects = Projects.objects.select_related('category').prefetch_related('tags', 'images').in_bulk(project_ids)
+        serialized = ProjectSerializer([projects[pk] for pk in project_ids], many=True, context={'request': request}).data
+        self.assertEqual(
+            json.loads(ORJSONRenderer().render(fastpath.project_rows(project_ids, request))),
+            json.loads(JSONRenderer().render(serialized)),
+        )
+
+        threads = Comment.objects.filter(project=self.with_images, parent=None).order_by('-created_at', '-id')
+        page = list(threads.select_related('user'))
+        context = {'request': request, 'reply_map': Comment.reply_map(page, 3)}
+        self.assertEqual(
+            json.loads(ORJSONRenderer().render(fastpath.comment_rows(list(fastpath.comment_values(threads)), 3, request))),
+            json.loads(JSONRenderer().render(CommentSerializer(page, many=True, context=context).data)),
+        )
+
+    def test_views_answer_the_same_json(self):
+        for url in (
+            '/api/projects/search/?search=water',
+            '/api/projects/search/?search=',
+            f'/api/comments/list/?project={self.with_images.pk}',
+            f'/api/comments/list/?project={self.with_images.pk}&depth=1',
+        ):
+            with self.subTest(url=url):
+                fast, serializer = self.both_ways(url)
+                self.assertTrue(fast['results'])
+                self.assertEqual(fast, serializer)
+
+
+class ProjectVersionTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        self.tag = Tag.objects.create(name='water')
+        self.project.tags.add(self.tag)
+
+    ## the response to a conditional GET with the ETag the client got before
+    def revalidate(self, url):
+        etag = self.client.get(url)['ETag']
+        return lambda: self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_tag_rename_changes_the_project(self):
+        revalidate = self.revalidate(f'/api/projects/{self.project.pk}/')
+        self.assertEqual(revalidate().status_code, 304)
+        self.tag.name = 'clean-water'
+        self.tag.save()
+        response = revalidate()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([tag['name'] for tag in response.json()['tags']], ['clean-water'])
+
+    def test_commenter_profile_edit_changes_the_comments(self):
+        commenter = self.make_user('commenter@example.com')
+        Comment.objects.create(project=self.project, user=commenter, content='Great idea')
+        other_project = self.make_project('Solar panels')
+        revalidate = self.revalidate(f'/api/comments/list/?project={self.project.pk}')
+
+        ## a session login (admin) only saves last_login
+        update_last_login(None, commenter)
+        self.assertEqual(revalidate().status_code, 304)
+
+        self.authenticate(commenter)
+        response = self.client.patch('/api/update-profile/', {'first_name': 'Renamed', 'current_password': 'S3cure-pass!'})
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials()
+        response = revalidate()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['user']['first_name'], 'Renamed')
+        ## projects they never commented on keep their version
+        self.assertEqual(Projects.objects.get(pk=other_project.pk).version, other_project.version)
+
+
+class DonationRollupTests(APITestBase):
+    def rollups(self):
+        return {
+            model.__name__: sorted(model.objects.values_list('project_id', 'bucket', 'amount', 'count', 'donors'))
+            for model in (HourlyDonationRollup, DailyDonationRollup)
+        }
+
+    def test_live_rollups_equal_the_backfill(self):
+        project = self.make_project()
+        other = self.make_user('other@example.com')
+        start = timezone.now().replace(minute=10) - timedelta(days=2)
+        for hours, user, amount in [(0, self.user, '5.00'), (0, other, '2.50'), (1, self.user, '1.00'), (25, self.user, '4.00'), (25, self.user, '3.00')]:
+            with mock.patch('django.utils.timezone.now', return_value=start + timedelta(hours=hours)):
+                Donation.objects.create(project=project, user=user, amount=amount)
+        Donation.objects.filter(amount=1).delete()
+        live = self.rollups()
+
+        call_command('backfill_donation_rollups', stdout=StringIO())
+        self.assertEqual(self.rollups(), live)
+        hourly = [(amount, count, donors) for _, _, amount, count, donors in live['HourlyDonationRollup']]
+        self.assertEqual(hourly, [(Decimal('7.5'), 2, 2), (Decimal('7'), 2, 1)])
+
+        since = (start - timedelta(days=1)).date().isoformat()
+        series = self.client.get(f'/api/projects/{project.pk}/donations/series/', {'period': 'hour', 'since': since}).json()['series']
+        self.assertEqual([(row['amount'], row['count'], row['donors']) for row in series], [(7.5, 2, 2), (7.0, 2, 1)])
+
+
+class AsyncReadPathTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.project = self.make_project()
+        similar = self.make_project('Village wells')
+        tag = Tag.objects.create(name='water')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.tags.add(tag)
+            similar.tags.add(tag)
+        thread = Comment.objects.create(project=self.project, user=self.user, content='First')
+        Comment.objects.create(project=self.project, user=self.user, content='Reply', parent=thread)
+        home_feed.rebuild_home_feed()
+        self.token = Token.objects.get(user=self.user).key
+
+    ## the urls as built with ASYNC_READ_PATH on (the root urlconf holds the resolver of
+    ## the included app urls), back to the settings' afterwards
+    def use_async_read_path(self):
+        def reload_urls():
+            importlib.reload(urls)
+            importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+            clear_url_caches()
+
+        with override_settings(ASYNC_READ_PATH=True):
+            reload_urls()
+        self.addCleanup(reload_urls)
+
+    async def test_async_views_answer_like_the_sync_views(self):
+        pk = self.project.pk
+        paths = [
+            '/api/home-projects/', '/api/home-projects/?fields=card', f'/api/projects/{pk}/',
+            f'/api/projects/{pk}/similar/', f'/api/comments/list/?project={pk}', '/api/projects/0/',
+        ]
+        expected = {}
+        for path in paths:
+            response = await sync_to_async(self.client.get)(path)
+            expected[path] = (response.status_code, json.loads(response.content), response.get('ETag'))
+        unauthorized = await sync_to_async(self.client_class().get)(paths[0], HTTP_AUTHORIZATION='Token not-a-token')
+
+        await sync_to_async(self.use_async_read_path)()
+        self.assertIs(resolve(f'/api/projects/{pk}/').func, async_views.project_detail)
+        for path in paths:
+            with self.subTest(path=path):
+                ## cold token caches: the authentication query counts against the budgets
+                await sync_to_async(cache.clear)()
+                authentication._local_tokens.clear()
+                response = await self.async_client.get(path, headers={'Authorization': f'Token {self.token}'})
+                self.assertEqual((response.status_code, json.loads(response.content), response.get('ETag')), expected[path])
+        response = await self.async_client.get(paths[0], headers={'Authorization': 'Token not-a-token'})
+        self.assertEqual((response.status_code, json.loads(response.content)), (401, json.loads(unauthorized.content)))
+
+
+## a real second SQLite file as the replica; TestCase would keep every read on the primary
+## (reads inside a transaction on the primary never go to a replica)
+class ReplicaRoutingTests(APITestHelpers, APITransactionTestCase):
+    ## resolved when the class is set up, after replica_1 is added
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        ## settings.DATABASES is the dict the connection handler reads; a mirror isn't flushed
+        settings.DATABASES['replica_1'] = {
+            **connection.settings_dict,
+            'NAME': os.path.join(cls.directory, 'replica.sqlite3'),
+            'TEST': {**connection.settings_dict['TEST'], 'MIRROR': 'default'},
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica_1'].close()
+        del connections['replica_1']
+        settings.DATABASES.pop('replica_1')
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        super().setUp()
+        authentication._local_tokens.clear()
+        self.project = self.make_project()
+
+    ## what replicate_sqlite does, from the test database
+    def replicate(self):
+        settings_override = override_settings(DATABASE_REPLICAS=['replica_1'])
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        replica = connections['replica_1']
+        replica.ensure_connection()
+        connection.ensure_connection()
+        connection.connection.backup(replica.connection)
+
+    def title(self, client):
+        return client.get(f'/api/projects/{self.project.pk}/').json()['title']
+
+    def test_a_write_pins_the_client_to_the_primary(self):
+        self.replicate()
+        ## the replica lags behind this change
+        Projects.objects.filter(pk=self.project.pk).update(title='Clean water for the school')
+        self.assertEqual(self.title(self.client), 'Clean water')
+
+        self.assertEqual(self.donate(self.project).status_code, 201)
+        self.assertEqual(self.title(self.client), 'Clean water for the school')
+        ## only the client that wrote is pinned
+        self.assertEqual(self.title(self.client_class()), 'Clean water')
+
+        routers.pin_cache().clear()
+        self.assertEqual(self.title(self.client), 'Clean water')
+
+    def test_pins_need_a_cache_shared_by_the_workers(self):
+        self.assertEqual(routers.check_pin_cache(None), [])
+        with override_settings(DATABASE_REPLICAS=['replica_1']):
+            ## the LocMem default cache: the hint names the id to silence for a dev server
+            [per_process] = routers.check_pin_cache(None)
+            self.assertEqual(per_process.id, 'crowd_funding.E002')
+            self.assertIn('silence crowd_funding.E002', per_process.hint)
+            self.assertIn(per_process, checks.run_checks(tags=[checks.Tags.caches]))
+            with override_settings(REPLICA_PIN_CACHE='pins'):
+                [missing] = routers.check_pin_cache(None)
+                self.assertEqual(missing.id, 'crowd_funding.E001')
+                self.assertIn(missing, checks.run_checks(tags=[checks.Tags.caches]))
+            shared = {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'replica_pins'}
+            with override_settings(CACHES={**settings.CACHES, 'pins': shared}, REPLICA_PIN_CACHE='pins'):
+                self.assertEqual(routers.check_pin_cache(None), [])
+
+
+## no project database: stress_sqlite writes to a scratch SQLite file under an alias it adds
+## while it runs, which a Django TestCase refuses (only the aliases declared up front)
+class SQLiteStressTests(unittest.TestCase):
+    ## what a deployment with SQLITE_JOURNAL_MODE=WAL gets
+    @override_settings(SQLITE_PRAGMAS={**settings.SQLITE_PRAGMAS, 'journal_mode': 'WAL', 'synchronous': 'NORMAL'})
+    def test_concurrent_writers_are_never_locked_out(self):
+        out = StringIO()
+        call_command('stress_sqlite', profile='tuned', writers=8, readers=2, transactions=40, stdout=out)
+        report = json.JSONDecoder().raw_decode(out.getvalue())[0]['tuned']
+        ## the settings' transaction_mode and the connection_created PRAGMAs were used
+        self.assertEqual((report['transaction_mode'], report['journal_mode']), ('IMMEDIATE', 'wal'))
+        self.assertEqual((report['commits'], report['lock_errors'], report['read_errors']), (8 * 40, 0, 0))
+
+    def test_journal_mode_is_left_to_the_database_file_by_default(self):
+        self.assertNotIn('journal_mode', settings.SQLITE_PRAGMAS)
+        self.assertEqual(settings.SQLITE_PRAGMAS['synchronous'], 'FULL')
+
+
+class ThrottleTests(APITestBase):
+    ## the middle of a one minute window
+    now = 60 * 1000 + 30
+
+    def donate_at(self, project, now):
+        with mock.patch('crowd_funding.throttling.time.time', return_value=now):
+            return self.donate(project)
+
+    @override_settings(THROTTLE_RATES={'donation_user': '3/min'})
+    def test_capacity_per_window_and_retry_after(self):
+        project = self.make_project()
+        responses = [self.donate_at(project, self.now) for _ in range(4)]
+        self.assertEqual([response.status_code for response in responses], [201, 201, 201, 429])
+        ## 20s into the next window two thirds of this one's 3 still count
+        self.assertEqual(responses[-1]['Retry-After'], '50')
+        self.assertEqual(self.donate_at(project, self.now + 49).status_code, 429)
+        self.assertEqual(self.donate_at(project, self.now + 50).status_code, 201)
+
+    @override_settings(THROTTLE_RATES={'donation_user': '4/min'})
+    def test_no_burst_across_the_window_boundary(self):
+        project = self.make_project()
+        end_of_window = 60 * 1001 - 1
+        statuses = [self.donate_at(project, end_of_window).status_code for _ in range(4)]
+        statuses += [self.donate_at(project, end_of_window + 2).status_code for _ in range(4)]
+        ## a fixed window would let 8 through in two seconds
+        self.assertEqual(statuses, [201] * 4 + [429] * 4)
+        ## a refused request isn't counted: 30s into the window half of the 4 have slid out
+        self.assertEqual([self.donate_at(project, end_of_window + 31).status_code for _ in range(3)], [201, 201, 429])
+
+    def test_concurrent_requests_are_counted_once_each(self):
+        allowed = []
+        ## a network round trip per read, so a read-modify-write would lose counts
+        ## (each thread has its own cache object, patched on the class)
+        real_get = LocMemCache.get
+
+        def slow_get(self, *args, **kwargs):
+            value = real_get(self, *args, **kwargs)
+            time.sleep(0.001)
+            return value
+
+        def requests():
+            for _ in range(25):
+                if not throttling.consume('throttle:test', 50, 60):
+                    allowed.append(True)
+
+        with mock.patch('crowd_funding.throttling.time.time', return_value=self.now), \
+                mock.patch.object(LocMemCache, 'get', slow_get):
+            threads = [threading.Thread(target=requests) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(allowed), 50)
+
+    def test_in_process_windows_while_the_cache_is_down(self):
+        with mock.patch('crowd_funding.throttling.time.time', return_value=self.now), \
+                mock.patch('crowd_funding.throttling.cache.add', side_effect=ConnectionError('cache down')), \
+                self.assertLogs('crowd_funding.throttling', 'WARNING'):
+            waits = [throttling.consume('throttle:down', 2, 60) for _ in range(3)]
+        self.assertEqual(waits[:2], [0, 0])
+        self.assertGreater(waits[2], 0)
+
+    @override_settings(THROTTLE_RATES={'login_ip': '2/min'})
+    def test_a_rotating_forwarded_for_header_is_the_same_address(self):
+        statuses = [
+            self.client.post(
+                '/api/login/', {'email': f'user{number}@example.com', 'password': 'wrong'},
+                HTTP_X_FORWARDED_FOR=f'198.51.100.{number}',
+            ).status_code
+            for number in range(3)
+        ]
+        self.assertEqual(statuses[-1], 429)
+        self.assertNotIn(429, statuses[:2])
+
+    @override_settings(THROTTLE_RATES={'login_account': '5/min', 'donation_project': '5/min'})
+    def test_bodies_that_are_not_objects(self):
+        self.assertEqual(self.client.post('/api/login/', ['user@example.com'], format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/donations/', 'project', format='json').status_code, 400)
+
+    def test_default_ident_is_the_user_or_the_address(self):
+        request = APIRequestFactory().get('/', REMOTE_ADDR='203.0.113.7')
+        request.user = mock.Mock(is_authenticated=False)
+        self.assertEqual(throttling.WindowThrottle().get_ident_key(request, None), 'ip:203.0.113.7')
+        request.user = self.user
+        self.assertEqual(throttling.WindowThrottle().get_ident_key(request, None), f'user:{self.user.pk}')
+
+
+class PurgeExpiredKeysTests(APITestBase):
+    def backdate(self, row, age):
+        type(row).objects.filter(pk=row.pk).update(created_at=timezone.now() - age)
+
+    def test_only_keys_nobody_can_use_are_deleted(self):
+        expired_activation = EmailActivation.objects.create(user=self.make_user('old@example.com'))
+        self.backdate(expired_activation, EmailActivation.LIFETIME + timedelta(minutes=1))
+        activation = EmailActivation.objects.create(user=self.make_user('new@example.com'))
+        self.backdate(activation, EmailActivation.LIFETIME - timedelta(minutes=1))
+
+        expired_reset = PasswordReset.objects.create(user=self.user)
+        self.backdate(expired_reset, PasswordReset.LIFETIME + timedelta(minutes=1))
+        PasswordReset.objects.create(user=self.user, used=True)
+        reset = PasswordReset.objects.create(user=self.user)
+        self.backdate(reset, PasswordReset.LIFETIME - timedelta(minutes=1))
+
+        out = StringIO()
+        call_command('purge_expired_keys', dry_run=True, stdout=out)
+        self.assertIn('Would delete 3 rows', out.getvalue())
+        self.assertEqual(EmailActivation.objects.count() + PasswordReset.objects.count(), 5)
+
+        ## batches of one: the loop goes on until a batch comes back short
+        out = StringIO()
+        call_command('purge_expired_keys', batch_size=1, pause=0, stdout=out)
+        self.assertIn('Deleted 3 rows', out.getvalue())
+        self.assertEqual(list(EmailActivation.objects.values_list('pk', flat=True)), [activation.pk])
+        self.assertEqual(list(PasswordReset.objects.values_list('pk', flat=True)), [reset.pk])
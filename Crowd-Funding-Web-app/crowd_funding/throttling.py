@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections.abc import Mapping
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+from .authentication import LocalLRUCache
+
+logger = logging.getLogger(__name__)
+
+## Request budgets for the write / login hot paths.
+## THROTTLE_RATES = {'<view throttle_scope>_<kind>': '<capacity>/<period>'} in settings:
+## at most capacity requests in any period long stretch of time (sliding window: the count
+## of the current fixed window plus the previous window's, weighted by how much of it is still
+## inside the last period, so there's no 2x burst across a window boundary).
+## Scopes without a rate aren't throttled. The counts live in the shared cache so every worker
+## sees them, each request is one atomic cache.add / cache.incr (no read-modify-write race
+## between workers, a refused request takes its count back with cache.decr), and in a per
+## process LRU while the cache is unreachable.
+## A throttled request gets DRF's 429 with Retry-After (seconds until it would be let through).
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+LOCAL_SIZE = 10000
+
+_local_windows = LocalLRUCache(LOCAL_SIZE)
+_local_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    capacity, period = rate.split('/')
+    return int(capacity), PERIODS[period[0]]
+
+
+def rates():
+    return getattr(settings, 'THROTTLE_RATES', {})
+
+
+## the request's number in its window
+def count_request(key, timeout):
+    if cache.add(key, 1, timeout):
+        return 1
+    try:
+        return cache.incr(key)
+    except ValueError:
+        ## evicted since the add, count from here
+        cache.set(key, 1, timeout)
+        return 1
+
+
+def uncount_request(key, timeout):
+    try:
+        cache.decr(key)
+    except ValueError:
+        pass
+
+
+def count_local_request(key, timeout):
+    with _local_lock:
+        count = (_local_windows.get(key) or 0) + 1
+        _local_windows.set(key, count, timeout)
+    return count
+
+
+def uncount_local_request(key, timeout):
+    with _local_lock:
+        count = _local_windows.get(key)
+        if count:
+            _local_windows.set(key, count - 1, timeout)
+
+
+## seconds until a request refused with count (itself included) in the current window and
+## previous in the one before would fit, elapsed seconds into the current window
+def wait_seconds(count, previous, capacity, period, elapsed):
+    if count <= capacity and previous:
+        ## later in this window, as the previous one slides out
+        return period - elapsed - (capacity - count) * period / previous
+    ## in the next window, with the other requests of this one as its previous count
+    others = count - 1
+    return period - elapsed + (period * max(0, others - capacity + 1) / others if others else 0)
+
+
+## seconds to wait, 0 when the request may go on (and is counted)
+def consume(key, capacity, period):
+    now = time.time()
+    window = int(now // period)
+    elapsed = now - window * period
+    current, previous = f'{key}:{window}', f'{key}:{window - 1}'
+    ## the window's key is read until the next one ends, never after
+    timeout = math.ceil(2 * period - elapsed) + 1
+    try:
+        count = count_request(current, timeout)
+        previous_count = cache.get(previous) or 0
+        uncount = uncount_request
+    except Exception as error:
+        logger.warning("throttle cache unavailable (%r), using the in-process windows", error)
+        count = count_local_request(current, timeout)
+        previous_count = _local_windows.get(previous) or 0
+        uncount = uncount_local_request
+    ## previous * (period - elapsed) / period + count <= capacity, without the division
+    if previous_count * (period - elapsed) + count * period <= capacity * period:
+        return 0
+    uncount(current, timeout)
+    return wait_seconds(count, previous_count, capacity, period, elapsed)
+
+
+## a field of the request body, None when the body isn't a JSON object / form
+def body_value(request, name):
+    data = request.data
+    return data.get(name) if isinstance(data, Mapping) else None
+
+
+class WindowThrottle(BaseThrottle):
+    kind = 'client'
+
+    ## what the window is counted on, None skips this throttle for the request:
+    ## the user, or the client address for anonymous requests
+    def get_ident_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return f'ip:{self.get_ident(request)}'
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        scope = f"{getattr(view, 'throttle_scope', None)}_{self.kind}"
+        rate = rates().get(scope)
+        if not rate:
+            return True
+        ident = self.get_ident_key(request, view)
+        if ident is None:
+            return True
+        key = 'throttle:%s:%s' % (scope, hashlib.sha1(str(ident).encode()).hexdigest())
+        self.wait_seconds = consume(key, *parse_rate(rate))
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class UserWindowThrottle(WindowThrottle):
+    kind = 'user'
+
+    def get_ident_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        return None
+
+
+## get_ident(): REMOTE_ADDR with NUM_PROXIES = 0 (the default in settings), otherwise the
+## address the last of NUM_PROXIES trusted proxies appended to X-Forwarded-For
+class IPWindowThrottle(WindowThrottle):
+    kind = 'ip'
+
+    def get_ident_key(self, request, view):
+        return self.get_ident(request)
+
+
+## the project from the url (projects/<pk>/...) or the request body
+class ProjectWindowThrottle(WindowThrottle):
+    kind = 'project'
+
+    def get_ident_key(self, request, view):
+        return view.kwargs.get('pk') or body_value(request, 'project')
+
+
+## login attempts on one account from any address (password guessing, PBKDF2 cost)
+class AccountWindowThrottle(WindowThrottle):
+    kind = 'account'
+
+    def get_ident_key(self, request, view):
+        email = body_value(request, 'email')
+        return email.strip().lower() if isinstance(email, str) and email.strip() else None
@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import path,include
 from rest_framework.routers import DefaultRouter
 from .views import *
+from . import async_views
 
 
 
@@ -33,8 +35,11 @@ urlpatterns = [
     path('comments/list/', CommentListView.as_view(), name='comment-list'),
 
     path('projects/<int:pk>/rate/', RatingCreateView.as_view(), name='project-rate'),
+    path('projects/<int:pk>/ratings/histogram/', RatingHistogramView.as_view(), name='project-rating-histogram'),
+    path('projects/<int:pk>/donations/series/', DonationSeriesView.as_view(), name='project-donation-series'),
     path('reports/', ReportCreateView.as_view(), name='report-create'),
     path('donations/', DonationCreateView.as_view(), name='donation-create'),
+    path('donations/export/', DonationExportView.as_view(), name='donation-export'),
    
 
 
@@ -42,8 +47,21 @@ urlpatterns = [
     path('delete-account/', DeleteUserView.as_view(), name='delete-account'),
     path('update-profile/', UpdateUserProfileView.as_view(), name='update-profile'),
     path('profile/', ProfileView.as_view(), name='profile'),
+    path('profile/projects/', ProfileProjectsView.as_view(), name='profile-projects'),
+    path('profile/donations/', ProfileDonationsView.as_view(), name='profile-donations'),
     path('home-projects/', home_projects, name='home-projects'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
+
+## async read path (ASGI), listed first so these shadow the DRF views above
+async_urlpatterns = [
+    path('projects/<int:pk>/', async_views.project_detail, name='project-detail'),
+    path('projects/<int:pk>/similar/', async_views.similar_projects, name='similar-projects'),
+    path('comments/list/', async_views.comment_list, name='comment-list'),
+    path('home-projects/', async_views.home_projects, name='home-projects'),
+]
+if settings.ASYNC_READ_PATH:
+    urlpatterns = async_urlpatterns + urlpatterns
   
 
 
@@ -5,12 +5,20 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta
 from django.core.mail import send_mail
 from django.shortcuts import render ,get_object_or_404
 from django.conf import settings
 from django.contrib.auth import login
 from .models import User, EmailActivation, PasswordReset, Projects, Comment, Rating, Report, Donation
 from .serializers import *
+from . import conditional, exports, fastpath, fieldsets, home_feed, metrics, rollups, search, similarity
+from .metrics import query_budget
+from .outbox import queue_mail
+from .pagination import CommentCursorPagination, CreatedAtCursorPagination, KeysetPagination
+from .throttling import AccountWindowThrottle, IPWindowThrottle, ProjectWindowThrottle, UserWindowThrottle
+from django.db import transaction
 from django.db.models import Sum
 from django.db.models import Avg, Value, FloatField
 from django.utils.timezone import now
@@ -29,17 +37,16 @@ class UserRegistrationView(viewsets.ModelViewSet):
     serializer_class = UserRegistrationSerializer
     permission_classes = [AllowAny]               ###### Try as Unautheticated
     def perform_create(self, serializer):
-        user = serializer.save()
-        activation = EmailActivation.objects.create(user=user)
-        activation_link = f"http://localhost:8000/api/activate/{activation.activation_key}/"
-        print(f"Sending activation email to: {user.email}")
-        sent =send_mail(
-            subject="Activate your account",
-            message=f"Click the link to activate your account: {activation_link}",
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-        )
-        print(f"Email sent successfully: {sent}")
+        ## the email is queued in the outbox and sent by the send_outbox command
+        with transaction.atomic():
+            user = serializer.save()
+            activation = EmailActivation.objects.create(user=user)
+            activation_link = f"http://localhost:8000/api/activate/{activation.activation_key}/"
+            queue_mail(
+                subject="Activate your account",
+                message=f"Click the link to activate your account: {activation_link}",
+                recipient_list=[user.email],
+            )
 
 # Account activation
 class ActivateAccountView(views.APIView):
@@ -72,6 +79,9 @@ class ActivateAccountView(views.APIView):
 
 class UserLoginView(APIView):
     permission_classes = [AllowAny]
+    ## checked before the password hash is computed
+    throttle_scope = 'login'
+    throttle_classes = [IPWindowThrottle, AccountWindowThrottle]
     def post(self, request):
         serializer = UserLoginSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -80,7 +90,7 @@ class UserLoginView(APIView):
         return Response({
             "message": "Login successful.",
             "token": token.key,
-            "user": UserProfileSerializer(user).data
+            "user": UserProfileSerializer(user, context={'request': request}).data
         })
 
 
@@ -91,14 +101,14 @@ class PasswordResetRequestView(views.APIView):
         serializer.is_valid(raise_exception=True)
         email = serializer.validated_data['email']
         user = User.objects.get(email=email)
-        reset = PasswordReset.objects.create(user=user)
-        reset_link = f"http://localhost:8000/api/reset-password/{reset.reset_key}/"
-        send_mail(
-            subject="Password Reset Request",
-            message=f"Click the link to reset your password: {reset_link}",
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-        )
+        with transaction.atomic():
+            reset = PasswordReset.objects.create(user=user)
+            reset_link = f"http://localhost:8000/api/reset-password/{reset.reset_key}/"
+            queue_mail(
+                subject="Password Reset Request",
+                message=f"Click the link to reset your password: {reset_link}",
+                recipient_list=[user.email],
+            )
         return Response({"message": "Password reset email sent."})
 
 # Confirm password reset
@@ -131,14 +141,27 @@ class UserProfileView(generics.RetrieveAPIView):
     
 ###Projects viewsets\
 class ProjectView(viewsets.ModelViewSet):
-    queryset=Projects.objects.prefetch_related("tags","images").all()
+    queryset=Projects.objects.select_related("category").prefetch_related("tags","images").all()
     serializer_class=ProjectSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    ## a create runs 48 with a new category, three tags (two new), two images and
+    ## its after commit work (feed marks, search index, similar projects)
+    query_budget = {'GET': 6, 'POST': 50}
     ##Pass the data to the serialziers
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
+        if self.request.method == 'GET':
+            context.update(fieldsets.from_request(self.request))
         return context
+
+    ## ?fields= / ?expand= decide which columns and relations are loaded
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method == 'GET' and self.request.query_params.get('fields'):
+            queryset = fieldsets.project_queryset(queryset, self.get_serializer().fields)
+        return queryset
     ## list the projects in the templates
     # def list(self,request,args,*kwargs):
     #     projects = self.get_queryset()
@@ -185,16 +208,29 @@ class CheckAuthView(APIView):
         return Response({'is_authenticated': False})
 
 class ProjectDetailView(generics.RetrieveAPIView):
-    queryset = Projects.objects.all()
+    queryset = Projects.objects.select_related('category').prefetch_related('tags', 'images')
     serializer_class = ProjectSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    query_budget = 6
+
+    ## 304 from the project's version alone, before it is loaded and serialized (conditional.py)
+    def retrieve(self, request, *args, **kwargs):
+        validators = Projects.objects.filter(pk=kwargs['pk']).values_list('version', 'modified_at').first()
+        if validators is None:
+            return super().retrieve(request, *args, **kwargs)
+        version, modified_at = validators
+        etag = conditional.make_etag(request, 'project', kwargs['pk'], version)
+        response = conditional.check(request, etag, modified_at) or super().retrieve(request, *args, **kwargs)
+        return conditional.set_validators(response, etag, modified_at)
 
 class SimilarProjectsView(APIView):
+    query_budget = 6
+
     def get(self, request, pk):
         try:
             project = Projects.objects.get(pk=pk)
-            tags = project.tags.all()
-            similar_projects = Projects.objects.filter(tags__in=tags).exclude(pk=pk).distinct()[:4]
+            similar_projects = similarity.similar_projects(project.pk) \
+                .select_related('category').prefetch_related('tags', 'images')
             serializer = ProjectSerializer(similar_projects, many=True, context={'request': request})
             return Response(serializer.data)
         except Projects.DoesNotExist:
@@ -205,6 +241,8 @@ class CommentCreateView(generics.CreateAPIView):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'comment'
+    throttle_classes = [UserWindowThrottle, IPWindowThrottle]
 
     def perform_create(self, serializer):
         parent_id = self.request.data.get('parent')
@@ -227,18 +265,56 @@ class CommentCreateView(generics.CreateAPIView):
         )
 class CommentListView(generics.ListAPIView):
     serializer_class = CommentSerializer
-
+    pagination_class = CommentCursorPagination
+    query_budget = 5
+    ## how many reply levels are returned under each top level comment
+    DEFAULT_DEPTH = 3
+    MAX_DEPTH = 10
 
     def get_queryset(self):
         project_id = self.request.query_params.get('project')
         if project_id:
-            return Comment.objects.filter(project_id=project_id, parent=None).order_by('-created_at')
+            return Comment.objects.filter(project_id=project_id, parent=None).select_related('user')
         return Comment.objects.none()     
+
+    def get_depth(self):
+        try:
+            depth = int(self.request.query_params.get('depth', self.DEFAULT_DEPTH))
+        except ValueError:
+            depth = self.DEFAULT_DEPTH
+        return max(0, min(depth, self.MAX_DEPTH))
+
+    ## comment writes bump the project's version, so it validates the thread pages too
+    def get(self, request, *args, **kwargs):
+        try:
+            project_id = int(request.query_params.get('project', ''))
+        except ValueError:
+            return super().get(request, *args, **kwargs)
+        validators = Projects.objects.filter(pk=project_id).values_list('version', 'modified_at').first()
+        if validators is None:
+            return super().get(request, *args, **kwargs)
+        version, modified_at = validators
+        etag = conditional.make_etag(request, 'comments', project_id, version)
+        response = conditional.check(request, etag, modified_at) or super().get(request, *args, **kwargs)
+        return conditional.set_validators(response, etag, modified_at)
+
+    ## one query for the page of threads + one for all their replies
+    def list(self, request, *args, **kwargs):
+        if fastpath.enabled(request):
+            page = self.paginate_queryset(fastpath.comment_values(self.get_queryset()))
+            return self.get_paginated_response(fastpath.comment_rows(page, self.get_depth(), request))
+        page = self.paginate_queryset(self.get_queryset())
+        context = self.get_serializer_context()
+        context['reply_map'] = Comment.reply_map(page, self.get_depth())
+        serializer = self.get_serializer_class()(page, many=True, context=context)
+        return self.get_paginated_response(serializer.data)
     
 class RatingCreateView(generics.CreateAPIView):
     queryset = Rating.objects.all()
     serializer_class = RatingSerializer
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'rating'
+    throttle_classes = [UserWindowThrottle, IPWindowThrottle, ProjectWindowThrottle]
 
     def create(self, request, *args, **kwargs):
         project_id = self.kwargs['pk'] 
@@ -249,19 +325,38 @@ class RatingCreateView(generics.CreateAPIView):
 
         project = get_object_or_404(Projects, pk=project_id)
 
+        ## the Rating signals move the project's rating aggregates with the row
         rating, created = Rating.objects.update_or_create(
             user=request.user,
             project=project,
-            defaults={'score': value}
+            defaults={'score': int(value)}
         )
 
         return Response({"message": "Rating submitted successfully."}, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
 
+class RatingHistogramView(APIView):
+    ## measured: the project row plus authentication on a cold cache (one token
+    ## query, or the session and its user for a session login)
+    query_budget = 3
+
+    def get(self, request, pk):
+        project = get_object_or_404(Projects.objects.only(
+            'id', 'average_rating', 'rating_count', 'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5'
+        ), pk=pk)
+        return Response({
+            "average_rating": project.average_rating,
+            "rating_count": project.rating_count,
+            "histogram": project.rating_histogram(),
+        })
+
+
 class ReportCreateView(generics.CreateAPIView):
     queryset = Report.objects.all()
     serializer_class = ReportSerializer
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'report'
+    throttle_classes = [UserWindowThrottle, IPWindowThrottle]
 
     def perform_create(self, serializer):
         project_id = self.request.data.get('project_id')
@@ -276,21 +371,77 @@ class DonationCreateView(generics.CreateAPIView):
     queryset = Donation.objects.all()
     serializer_class = DonationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'donation'
+    throttle_classes = [UserWindowThrottle, IPWindowThrottle, ProjectWindowThrottle]
+    ## measured with the after commit work: 19 for the first donation of the hour (the
+    ## hourly / daily rollup rows are created), 14 once they exist
+    query_budget = 20
 
     def perform_create(self, serializer):
-        project_id = self.request.data.get('project')
-        project = Projects.objects.get(pk=project_id)
-        
+        ## the project totals and rollups are updated by the post_save signal
+        serializer.save(user=self.request.user)
 
-        serializer.save(user=self.request.user, project=project)
-        
-        
-        total_donations = project.donations.aggregate(Sum('amount'))['amount__sum'] or 0
-        
-        project.totalDonations = total_donations
-        project.save()
+
+## ?since= / ?until= of a date range: a date or a datetime, until is inclusive for plain dates
+def parse_bound(value, end=False):
+    if not value:
+        return None
+    day = parse_date(value)
+    if day is not None:
+        parsed = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    else:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(value)
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+## finance export: ?output=csv|jsonl&project=<id>&since=<date>&until=<date>
+class DonationExportView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        params = request.query_params
+        file_format = params.get('output', 'csv')
+        if file_format not in exports.FORMATS:
+            return Response({"error": f"output must be one of {', '.join(exports.FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            project_id = int(params['project']) if params.get('project') else None
+            since = parse_bound(params.get('since'))
+            until = parse_bound(params.get('until'), end=True)
+        except ValueError:
+            return Response({"error": "Invalid project, since or until."}, status=status.HTTP_400_BAD_REQUEST)
+
+        filename = f"donations-project-{project_id}" if project_id else "donations"
+        return exports.stream_donations(file_format, filename, project_id=project_id, since=since, until=until)
 
 
+## funding chart: ?period=day|hour&since=&until= (default the last 30 days / 48 hours),
+## read from the rollup tables, buckets without donations are left out
+class DonationSeriesView(APIView):
+    DEFAULT_RANGE = {'day': timedelta(days=30), 'hour': timedelta(hours=48)}
+
+    def get(self, request, pk):
+        period = request.query_params.get('period', 'day')
+        if period not in rollups.PERIODS:
+            return Response({"error": f"period must be one of {', '.join(rollups.PERIODS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            since = parse_bound(request.query_params.get('since'))
+            until = parse_bound(request.query_params.get('until'), end=True)
+        except ValueError:
+            return Response({"error": "Invalid since or until."}, status=status.HTTP_400_BAD_REQUEST)
+        until = until or timezone.now()
+        since = since or until - self.DEFAULT_RANGE[period]
+        if not Projects.objects.filter(pk=pk).exists():
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            'project': pk,
+            'period': period,
+            'since': since,
+            'until': until,
+            'series': list(rollups.series(pk, period, since, until)),
+        })
 
 
 class CancelProjectView(APIView):
@@ -308,8 +459,7 @@ class CancelProjectView(APIView):
         
 def project_detail_template(request, pk):
     project = get_object_or_404(Projects, pk=pk)
-    tags = project.tags.all()
-    similar_projects = Projects.objects.filter(tags__in=tags).exclude(pk=pk).distinct()[:4]
+    similar_projects = similarity.similar_projects(project.pk)
     return render(request, 'projects.html', {
         'project': project,
         'similar_projects': similar_projects
@@ -362,34 +512,49 @@ class UpdateUserProfileView(APIView):
 
 class ProfileView(APIView):
     permission_classes = [IsAuthenticated]
+    query_budget = 9
 
     def get(self, request):
         user = request.user
-        serializer = UserProfileSerializer(user)
+        serializer = UserProfileSerializer(user, context={'request': request})
         return Response(serializer.data)
 
 
-@api_view(['GET'])
-def home_projects(request):
-    current_time = now()
-    base_qs = Projects.objects.filter(is_canceled=False)
+## rest of the profile lists, newest first
+class ProfileProjectsView(generics.ListAPIView):
+    serializer_class = ProjectSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+    query_budget = 5
 
-    latest_projects = base_qs.order_by('-created_at') \
-        .annotate(avg_rating=Coalesce(Avg('ratings__score'), Value(0, output_field=FloatField())))[:5]
+    def get_queryset(self):
+        return Projects.objects.filter(uid=self.request.user).select_related('category').prefetch_related('tags', 'images')
 
-    featured_projects = base_qs.filter(is_featured=True).order_by('-created_at') \
-        .annotate(avg_rating=Coalesce(Avg('ratings__score'), Value(0, output_field=FloatField())))[:5]
 
-    top_rated_projects = base_qs.annotate(
-    avg_rating=Coalesce(Avg('ratings__score'), Value(0, output_field=FloatField()))
-    ).order_by('-avg_rating')[:5]
-   
+class ProfileDonationsView(generics.ListAPIView):
+    serializer_class = DonationSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+    query_budget = 3
 
-    return Response({
-        "latest_projects": ProjectSerializer(latest_projects, many=True, context={'request': request}).data,
-        "featured_projects": ProjectSerializer(featured_projects, many=True, context={'request': request}).data,
-        "top_rated_projects": ProjectSerializer(top_rated_projects, many=True, context={'request': request}).data,
-    })
+    def get_queryset(self):
+        return Donation.objects.filter(user=self.request.user).select_related('user')
+
+
+## steady state is token + one read, a missing or too stale section is rebuilt
+## by the read outside its budget (home_feed.rebuild_off_budget)
+@query_budget(5)
+@api_view(['GET'])
+def home_projects(request):
+    ## the sections' last rebuild validates the whole feed
+    updated_at, sections = home_feed.feed_validators()
+    etag = conditional.make_etag(request, 'home', updated_at and updated_at.isoformat(), sections)
+    response = conditional.check(request, etag, updated_at)
+    if response is not None:
+        return conditional.set_validators(response, etag, updated_at)
+
+    feed = home_feed.present(home_feed.get_home_feed(), request)
+    return conditional.set_validators(Response(feed), etag, updated_at)
 
 
 
@@ -397,11 +562,49 @@ def home_projects(request):
 
 # search by using tags and id
 class ProjectSearchView(generics.ListAPIView):
-    queryset = Projects.objects.prefetch_related("tags", "images").all()
+    queryset = Projects.objects.select_related("category").prefetch_related("tags", "images").order_by('id')
     serializer_class = ProjectSerializer
+    query_budget = 7
     
+    ## SearchFilter is only the fallback when the FTS index isn't available (see search.py)
     filter_backends = [filters.SearchFilter]
     search_fields = ['title', 'tags__name']
 
     def get_serializer_context(self):
-        return {'request': self.request}
+        return {'request': self.request, **fieldsets.from_request(self.request)}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.query_params.get('fields'):
+            queryset = fieldsets.project_queryset(queryset, self.get_serializer().fields)
+        return queryset
+
+    ## ranked full text search (title, details, category, tags), prefix match on every word
+    def list(self, request, *args, **kwargs):
+        term = request.query_params.get(filters.SearchFilter.search_param, '')
+        use_fts = term.strip() and search.is_available()
+        if fastpath.enabled(request):
+            ## page of ids, then the rows as plain dicts (fastpath.py)
+            if use_fts:
+                ids = search.SearchResultIds(term)
+            else:
+                ids = self.filter_queryset(Projects.objects.order_by('id')).values_list('id', flat=True)
+            page = self.paginate_queryset(ids)
+            return self.get_paginated_response(fastpath.project_rows(page, request))
+        if not use_fts:
+            return super().list(request, *args, **kwargs)
+        page = self.paginate_queryset(search.SearchResults(term, self.get_queryset()))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+## request metrics of this worker (metrics.QueryMetricsMiddleware), DELETE resets them
+class MetricsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics.registry.snapshot())
+
+    def delete(self, request):
+        metrics.registry.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
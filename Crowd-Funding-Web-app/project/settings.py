@@ -1,7 +1,7 @@
 
 from pathlib import Path
 import os
-from decouple import config
+from decouple import config, Csv
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 
 # Middleware
 MIDDLEWARE = [
+    'crowd_funding.metrics.QueryMetricsMiddleware',
+    'crowd_funding.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -78,7 +80,12 @@ WSGI_APPLICATION = 'project.wsgi.application'
 DATABASES = {
        'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / "db.sqlite3",
+        'NAME': config('SQLITE_PATH', default=str(BASE_DIR / "db.sqlite3")),
+        'OPTIONS': {
+            # take the write lock at BEGIN so concurrent writers wait (busy_timeout)
+            # instead of failing with "database is locked" when a read turns into a write
+            'transaction_mode': config('SQLITE_TRANSACTION_MODE', default='IMMEDIATE'),
+        },
     }
     # 'default': {
     #     'ENGINE': 'django.db.backends.postgresql',
@@ -90,6 +97,36 @@ DATABASES = {
     # }
 }
 # print(f"Database: {os.getenv('DB_NAME')}")
+
+# Read replicas (crowd_funding.routers): safe requests read from one of DATABASE_REPLICAS,
+# writes and the client's next REPLICA_PIN_SECONDS of reads go to 'default'.
+# Locally SQLITE_REPLICAS lists SQLite files kept in sync by the replicate_sqlite command.
+for index, path in enumerate(config('SQLITE_REPLICAS', default='', cast=Csv()), start=1):
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'NAME': path,
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['crowd_funding.routers.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=5, cast=int)
+# Cache alias holding the pins, must be shared by every worker (system check crowd_funding.E002)
+REPLICA_PIN_CACHE = config('REPLICA_PIN_CACHE', default='default')
+
+# SQLite performance profile, PRAGMAs run on every new connection (crowd_funding.sqlite)
+SQLITE_TUNING = config('SQLITE_TUNING', default=True, cast=bool)
+# journal_mode is written into the database file itself, so it is left as the file has it
+# unless the deployment sets SQLITE_JOURNAL_MODE=WAL (readers don't block the writer)
+SQLITE_JOURNAL_MODE = config('SQLITE_JOURNAL_MODE', default='')
+SQLITE_PRAGMAS = {
+    **({'journal_mode': SQLITE_JOURNAL_MODE} if SQLITE_JOURNAL_MODE else {}),
+    # fsync at checkpoints only, which is safe with WAL; FULL for a rollback journal
+    'synchronous': config('SQLITE_SYNCHRONOUS', default='NORMAL' if SQLITE_JOURNAL_MODE.upper() == 'WAL' else 'FULL'),
+    'busy_timeout': config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int),  # ms to wait for the write lock
+    'mmap_size': config('SQLITE_MMAP_SIZE', default=268435456, cast=int),  # bytes
+    'cache_size': config('SQLITE_CACHE_SIZE', default=-65536, cast=int),   # negative: KiB per connection
+    'temp_store': 'MEMORY',
+}
 ### The Custom User Model
 AUTH_USER_MODEL = 'crowd_funding.User'
 
@@ -124,7 +161,7 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 # إعدادات REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'crowd_funding.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -132,6 +169,68 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 15,
+    'DEFAULT_RENDERER_CLASSES': [
+        'crowd_funding.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # proxies in front of the app that append to X-Forwarded-For; 0 = the client is REMOTE_ADDR
+    # (unset, DRF would trust the whole client supplied header for the per address throttles)
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
+}
+
+# Home feed sections marked by writes are rebuilt by the refresh_home_feed command,
+# a read rebuilds a section itself once it has been marked for longer than this (seconds)
+HOME_FEED_MAX_STALENESS = config('HOME_FEED_MAX_STALENESS', default=60, cast=int)
+
+# Shown instead of a project image until process_images has stripped its EXIF and made the variants
+PROJECT_IMAGE_PLACEHOLDER = config('PROJECT_IMAGE_PLACEHOLDER', default='/static/img/project-placeholder.jpg')
+
+# Read-only list endpoints build rows from values() instead of the serializers (crowd_funding.fastpath)
+FAST_READ_PATH = config('FAST_READ_PATH', default=True, cast=bool)
+
+# Serve home / project detail / similar / comment list reads from crowd_funding.async_views,
+# only worth it when running under ASGI (uvicorn / daphne with project.asgi)
+ASYNC_READ_PATH = config('ASYNC_READ_PATH', default=False, cast=bool)
+
+# Cache (shared between workers when CACHE_BACKEND points at e.g. redis / memcached)
+CACHES = {
+    'default': {
+        'BACKEND':  config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
+# Throttles (crowd_funding.throttling): '<view scope>_<kind>': '<capacity>/<period>',
+# at most capacity requests in any period long stretch (a sliding window over two fixed windows'
+# counts, no 2x burst at a window boundary), counted atomically in the cache.
+# Scopes left out (or THROTTLE_ENABLED=False) aren't throttled.
+THROTTLE_RATES = {
+    'login_ip':         '20/min',
+    'login_account':    '5/min',
+    'donation_user':    '20/min',
+    'donation_ip':      '60/min',
+    'donation_project': '600/min',
+    'rating_user':      '30/min',
+    'rating_ip':        '60/min',
+    'rating_project':   '600/min',
+    'comment_user':     '20/min',
+    'comment_ip':       '60/min',
+    'report_user':      '10/min',
+    'report_ip':        '30/min',
+} if config('THROTTLE_ENABLED', default=True, cast=bool) else {}
+
+# Token authentication cache (crowd_funding.authentication.CachedTokenAuthentication)
+TOKEN_AUTH_CACHE = {
+    'LOCAL_TTL':  5,      # seconds a token stays in the in-process LRU
+    'LOCAL_SIZE': 10000,
+    'SHARED_TTL': 300,    # seconds in the shared cache, LOCAL_TTL unless CACHE_BACKEND is shared (redis / memcached ...)
+}
+
+# Per route query / latency metrics (crowd_funding.metrics, served on /api/metrics/ for admins)
+QUERY_METRICS = {
+    'WINDOW': 1000,    # samples kept per route
+    # over budget requests fail (QueryBudgetExceeded) instead of being logged, the tests turn it on
+    'RAISE_OVER_BUDGET': config('QUERY_BUDGET_RAISE', default=False, cast=bool),
 }
 
 # # إعدادات CORS